@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+import math
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.ingest import scan_csv
+from app.dataset_store import dataset_store
+from app.profiling import parse_datetime
+from app.storage import file_sha256, file_stamp, load_json, save_json, state
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.csv as pa_csv  # type: ignore
+    import pyarrow.feather as feather  # type: ignore
+except Exception:  # pragma: no cover
+    pa = None  # type: ignore
+
+CSV_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+def _source_stamp(path: Path) -> Dict[str, int]:
+    return file_stamp(path)
+
+
+def _resolve(csv_path: Optional[Path]) -> Path:
+    """``csv_path``, or the current dataset's file when it is None."""
+    return dataset_store.path() if csv_path is None else csv_path
+
+
+# derived files live next to the CSV they were built from
+def _cache_path(csv_path: Path) -> Path:
+    return csv_path.with_name("dataset.feather")
+
+
+def _cache_meta_path(csv_path: Path) -> Path:
+    return csv_path.with_name("dataset_cache.json")
+
+
+def _time_index_path(csv_path: Path) -> Path:
+    return csv_path.with_name("dataset_time_index.npz")
+
+
+def profile_path(csv_path: Path) -> Path:
+    return csv_path.with_name("profile.json")
+
+
+def drop_columnar_cache(csv_path: Optional[Path] = None) -> None:
+    csv_path = _resolve(csv_path)
+    _cache_path(csv_path).unlink(missing_ok=True)
+    _cache_meta_path(csv_path).unlink(missing_ok=True)
+    _time_index_path(csv_path).unlink(missing_ok=True)
+
+
+def build_columnar_cache(
+    csv_path: Optional[Path] = None,
+    time_column: Optional[str] = None,
+    target_column: Optional[str] = None,
+) -> bool:
+    """Write a typed Arrow IPC (Feather v2) copy of the dataset, streaming block by block.
+
+    Returns False and leaves no cache behind when pyarrow is missing or the CSV
+    cannot be converted with a single schema; readers then fall back to the CSV.
+    """
+    csv_path = _resolve(csv_path)
+    drop_columnar_cache(csv_path)
+    if pa is None:
+        return False
+
+    cache_path = _cache_path(csv_path)
+    tmp_path = cache_path.with_suffix(".feather.part")
+    try:
+        reader = pa_csv.open_csv(str(csv_path), read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES))
+        with pa.ipc.new_file(str(tmp_path), reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+        schema = reader.schema
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        return False
+
+    tmp_path.replace(cache_path)
+    save_json(_cache_meta_path(csv_path), {
+        "source": _source_stamp(csv_path),
+        "columns": schema.names,
+        "types": {f.name: str(f.type) for f in schema},
+        "time_column": time_column,
+        "target_column": target_column,
+    })
+    return True
+
+
+def cache_info(csv_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Recorded cache metadata, or an empty dict when the cache is missing or stale."""
+    csv_path = _resolve(csv_path)
+    if pa is None or not _cache_path(csv_path).exists() or not csv_path.exists():
+        return {}
+    info = load_json(_cache_meta_path(csv_path))
+    if not info or info.get("source") != _source_stamp(csv_path):
+        return {}
+    return info
+
+
+def save_profile(profile: Dict[str, Any], csv_path: Optional[Path] = None, sha256: Optional[str] = None) -> Dict[str, Any]:
+    csv_path = _resolve(csv_path)
+    stored = {**profile, "source": _source_stamp(csv_path)}
+    if sha256:
+        stored["sha256"] = sha256
+    state.put(profile_path(csv_path), stored)
+    return stored
+
+
+def get_profile(csv_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Column roles for the dataset; profiles it once if no fresh profile is stored."""
+    csv_path = _resolve(csv_path)
+    if not csv_path.exists():
+        return {}
+    profile = state.get(profile_path(csv_path))
+    if profile and profile.get("source") == _source_stamp(csv_path):
+        return profile
+    return save_profile(scan_csv(csv_path).profile(), csv_path)
+
+
+def dataset_hash(csv_path: Optional[Path] = None) -> str:
+    """SHA-256 of the dataset, kept with its profile so the file is hashed once per upload."""
+    csv_path = _resolve(csv_path)
+    profile = get_profile(csv_path)
+    digest = profile.get("sha256")
+    if not digest:
+        digest = file_sha256(csv_path)
+        state.update(profile_path(csv_path), lambda stored: {**stored, "sha256": digest})
+    return digest
+
+
+def _downcast_table(table: Any) -> Any:
+    """float64 columns as float32, before pandas materializes them."""
+    fields = [
+        pa.field(f.name, pa.float32()) if pa.types.is_float64(f.type) else f
+        for f in table.schema
+    ]
+    return table.cast(pa.schema(fields))
+
+
+def downcast_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Smallest float/integer dtype per numeric column, converted one column at a time."""
+    for c in df.columns:
+        if pd.api.types.is_float_dtype(df[c]):
+            df[c] = pd.to_numeric(df[c], downcast="float")
+        elif pd.api.types.is_integer_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c]):
+            df[c] = pd.to_numeric(df[c], downcast="integer")
+    return df
+
+
+def load_dataset(
+    columns: Optional[List[str]] = None,
+    csv_path: Optional[Path] = None,
+    downcast: bool = False,
+) -> pd.DataFrame:
+    """Load the dataset (optionally only ``columns``), preferring the columnar cache.
+
+    ``downcast`` stores numeric columns in the smallest dtype that holds them
+    (float64 becomes float32), roughly halving the frame for training.
+    """
+    csv_path = _resolve(csv_path)
+    if cache_info(csv_path):
+        try:
+            table = feather.read_table(str(_cache_path(csv_path)), columns=columns, memory_map=True)
+            if downcast:
+                table = _downcast_table(table)
+            df = table.to_pandas()
+            return downcast_frame(df) if downcast else df
+        except Exception:
+            pass
+    df = pd.read_csv(csv_path, usecols=columns)
+    return downcast_frame(df) if downcast else df
+
+
+class DatasetChunks:
+    """The dataset as fixed-size row chunks, read one at a time.
+
+    With the columnar cache a chunk is a slice of the memory-mapped file, so only
+    that chunk is ever materialized. Without it the CSV is streamed; random access
+    through ``chunk`` then re-reads the file up to the chunk.
+    """
+
+    def __init__(
+        self,
+        columns: Optional[List[str]],
+        chunk_rows: int,
+        csv_path: Optional[Path] = None,
+        downcast: bool = True,
+    ) -> None:
+        self.columns = columns
+        self.chunk_rows = max(int(chunk_rows), 1)
+        self.csv_path = csv_path = _resolve(csv_path)
+        self.downcast = downcast
+        self._table = None
+        if cache_info(csv_path):
+            try:
+                self._table = feather.read_table(str(_cache_path(csv_path)), columns=columns, memory_map=True)
+            except Exception:
+                self._table = None
+        if self._table is not None:
+            self.rows = int(self._table.num_rows)
+        else:
+            self.rows = int(get_profile(csv_path).get("records") or 0)
+
+    def __len__(self) -> int:
+        return math.ceil(self.rows / self.chunk_rows)
+
+    def _finish(self, df: pd.DataFrame) -> pd.DataFrame:
+        return downcast_frame(df) if self.downcast else df
+
+    def chunk(self, i: int) -> pd.DataFrame:
+        start = i * self.chunk_rows
+        if self._table is not None:
+            table = self._table.slice(start, self.chunk_rows)
+            return self._finish((_downcast_table(table) if self.downcast else table).to_pandas())
+        return self._finish(pd.read_csv(
+            self.csv_path, usecols=self.columns, skiprows=range(1, start + 1), nrows=self.chunk_rows
+        ))
+
+    def __iter__(self) -> Iterator[Tuple[int, pd.DataFrame]]:
+        """``(first row number, chunk)`` pairs in file order."""
+        if self._table is not None:
+            for i in range(len(self)):
+                yield i * self.chunk_rows, self.chunk(i)
+            return
+        offset = 0
+        for df in pd.read_csv(self.csv_path, usecols=self.columns, chunksize=self.chunk_rows):
+            yield offset, self._finish(df)
+            offset += int(df.shape[0])
+
+
+class TimeIndex:
+    """Sorted timestamps of the dataset rows, so a date window is two binary searches.
+
+    ``order`` maps sorted positions back to row numbers; it is ``None`` when the
+    rows are already in time order and windows are contiguous row ranges.
+    """
+
+    def __init__(self, times: np.ndarray, order: Optional[np.ndarray]) -> None:
+        self.times = times
+        self.order = order
+
+    def __len__(self) -> int:
+        return int(self.times.shape[0])
+
+    def bounds(self, start: Any, end: Any) -> Tuple[int, int]:
+        """Sorted positions covering ``start`` through the whole ``end`` day."""
+        lo_ts = pd.to_datetime(start, errors="coerce")
+        hi_ts = pd.to_datetime(end, errors="coerce")
+        if pd.isna(lo_ts) or pd.isna(hi_ts):
+            return 0, 0
+        lo = np.searchsorted(self.times, np.datetime64(lo_ts, "ns"), side="left")
+        hi = np.searchsorted(self.times, np.datetime64(hi_ts + pd.Timedelta(days=1), "ns"), side="left")
+        return int(lo), int(max(hi, lo))
+
+    def rows(self, start: Any, end: Any) -> np.ndarray:
+        lo, hi = self.bounds(start, end)
+        if self.order is None:
+            return np.arange(lo, hi)
+        return self.order[lo:hi]
+
+    def count(self, start: Any, end: Any) -> int:
+        lo, hi = self.bounds(start, end)
+        return hi - lo
+
+    def cumulative(self, bins: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Cumulative row count sampled at ``bins + 1`` evenly spaced instants."""
+        if len(self) == 0:
+            return self.times[:0], np.empty(0, dtype=np.int64)
+        lo, hi = self.times[0].astype("int64"), self.times[-1].astype("int64")
+        edges = np.linspace(lo, hi, bins + 1).astype("int64").astype("datetime64[ns]")
+        edges[-1] = self.times[-1]
+        return edges, np.searchsorted(self.times, edges, side="right")
+
+
+def build_time_index(csv_path: Optional[Path] = None) -> Optional[TimeIndex]:
+    """Sort the profiled timestamp column once and store it next to the dataset."""
+    csv_path = _resolve(csv_path)
+    _time_index_path(csv_path).unlink(missing_ok=True)
+    profile = get_profile(csv_path)
+    time_col = profile.get("time_column")
+    if not time_col:
+        return None
+
+    parsed = parse_datetime(load_dataset([time_col], csv_path)[time_col], profile.get("time_format"))
+    values = parsed.to_numpy(dtype="datetime64[ns]")
+    valid_rows = np.flatnonzero(~np.isnat(values))
+    times = values[valid_rows]
+    if valid_rows.shape[0] == values.shape[0] and (times[1:] >= times[:-1]).all():
+        order = None
+    else:
+        perm = np.argsort(times, kind="stable")
+        times = times[perm]
+        order = valid_rows[perm]
+
+    np.savez(
+        _time_index_path(csv_path),
+        times=times,
+        order=order if order is not None else np.empty(0, dtype=np.int64),
+        sorted=np.array(order is None),
+        source=np.array([profile["source"]["size"], profile["source"]["mtime_ns"]], dtype=np.int64),
+    )
+    return TimeIndex(times, order)
+
+
+def get_time_index(csv_path: Optional[Path] = None) -> Optional[TimeIndex]:
+    csv_path = _resolve(csv_path)
+    if not csv_path.exists():
+        return None
+    index_path = _time_index_path(csv_path)
+    if index_path.exists():
+        stamp = _source_stamp(csv_path)
+        with np.load(index_path) as data:
+            if data["source"].tolist() == [stamp["size"], stamp["mtime_ns"]]:
+                order = None if bool(data["sorted"]) else data["order"]
+                return TimeIndex(data["times"], order)
+    return build_time_index(csv_path)
+
+
+def load_rows(
+    rows: np.ndarray,
+    columns: Optional[List[str]] = None,
+    csv_path: Optional[Path] = None,
+    downcast: bool = False,
+) -> pd.DataFrame:
+    """Load only the given row numbers; contiguous ranges are zero-copy slices of the cache."""
+    csv_path = _resolve(csv_path)
+    if cache_info(csv_path):
+        try:
+            table = feather.read_table(str(_cache_path(csv_path)), columns=columns, memory_map=True)
+            if rows.shape[0] and rows[-1] - rows[0] + 1 == rows.shape[0] and (np.diff(rows) == 1).all():
+                table = table.slice(int(rows[0]), int(rows.shape[0]))
+            else:
+                table = table.take(pa.array(rows))
+            if downcast:
+                table = _downcast_table(table)
+            df = table.to_pandas()
+            return downcast_frame(df) if downcast else df
+        except Exception:
+            pass
+    df = pd.read_csv(csv_path, usecols=columns).iloc[rows].reset_index(drop=True)
+    return downcast_frame(df) if downcast else df
+
+
+def load_window(start: Any, end: Any, columns: Optional[List[str]] = None, csv_path: Optional[Path] = None) -> Optional[pd.DataFrame]:
+    """Rows whose timestamp falls in [start, end] (whole days), or None without a time index."""
+    csv_path = _resolve(csv_path)
+    index = get_time_index(csv_path)
+    if index is None:
+        return None
+    return load_rows(index.rows(start, end), columns, csv_path)
@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.profiling import PROFILE_PATH
+from app.storage import DATA_DIR, META_PATH, file_sha256, state
+
+DATASETS_DIR = DATA_DIR / "datasets"
+DATASETS_INDEX_PATH = DATA_DIR / "datasets.json"
+DATASET_FILE = "dataset.csv"
+# per-dataset documents in the state store, removed with the dataset
+DATASET_DOCS = ("metadata.json", "profile.json", "date_ranges.json")
+
+# the single-dataset layout of earlier versions, adopted into the store on first use
+LEGACY_DATASET_PATH = DATA_DIR / DATASET_FILE
+LEGACY_FILES = ("dataset.csv", "dataset.feather", "dataset_cache.json", "dataset_time_index.npz")
+LEGACY_DATE_RANGES_PATH = DATA_DIR / "date_ranges.json"
+
+# disk budget for stored datasets; the least recently used beyond it are evicted (0 keeps everything)
+DATASET_STORE_MB = float(os.environ.get("DATASET_STORE_MB", "20480"))
+# seconds after which an unfinished ingest counts as abandoned (its worker died) and may be redone
+DATASET_INGEST_TIMEOUT = float(os.environ.get("DATASET_INGEST_TIMEOUT", "3600"))
+
+
+class DatasetNotFoundError(KeyError):
+    pass
+
+
+class DatasetInUseError(Exception):
+    pass
+
+
+def make_dataset_id(sha256: str) -> str:
+    return sha256[:16]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class DatasetStore:
+    """Uploaded datasets keyed by content hash, one directory each, and which one is current.
+
+    The index lives in the shared state store. An upload first claims its id
+    (status "ingesting"), so the same bytes uploaded to another worker meanwhile
+    wait for that ingest instead of repeating it; the entry becomes "ready" once
+    the profile, columnar cache and time index are written.
+    """
+
+    def __init__(self, root: Path, index_path: Path, budget_mb: float = DATASET_STORE_MB) -> None:
+        self.root = root
+        self.index_path = index_path
+        self.budget_mb = budget_mb
+
+    def dir_for(self, dataset_id: str) -> Path:
+        return self.root / dataset_id
+
+    def csv_path(self, dataset_id: str) -> Path:
+        return self.dir_for(dataset_id) / DATASET_FILE
+
+    def metadata_path(self, dataset_id: str) -> Path:
+        return self.dir_for(dataset_id) / "metadata.json"
+
+    def ranges_path(self, dataset_id: str) -> Path:
+        return self.dir_for(dataset_id) / "date_ranges.json"
+
+    def upload_path(self) -> Path:
+        """A fresh temp file for an upload whose content hash is not known yet."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.root / f".upload-{uuid.uuid4().hex}.part"
+
+    def _index(self) -> Dict[str, Any]:
+        index = state.get(self.index_path)
+        if not index.get("datasets") and LEGACY_DATASET_PATH.exists():
+            self._adopt_legacy()
+            index = state.get(self.index_path)
+        return index
+
+    def _adopt_legacy(self) -> None:
+        """Move a dataset uploaded before the store existed into it, with its profile, metadata and ranges."""
+        digest = state.get(PROFILE_PATH).get("sha256")
+        try:
+            digest = digest or file_sha256(LEGACY_DATASET_PATH)
+        except FileNotFoundError:
+            return
+        dataset_id = make_dataset_id(digest)
+        target = self.dir_for(dataset_id)
+        target.mkdir(parents=True, exist_ok=True)
+        for name in LEGACY_FILES:
+            try:
+                # a rename keeps the files' size and mtime, so the stored stamps stay valid
+                os.replace(DATA_DIR / name, target / name)
+            except FileNotFoundError:
+                continue
+        for src, name in ((META_PATH, "metadata.json"), (PROFILE_PATH, "profile.json"), (LEGACY_DATE_RANGES_PATH, "date_ranges.json")):
+            doc = state.get(src)
+            if doc and not state.get(target / name):
+                state.put(target / name, doc)
+
+        def adopt(index: Dict[str, Any]) -> None:
+            datasets = index.setdefault("datasets", {})
+            datasets.setdefault(dataset_id, {
+                "dataset_id": dataset_id,
+                "sha256": digest,
+                "file_name": state.get(target / "metadata.json").get("fileName") or DATASET_FILE,
+                "status": "ready",
+                "size_bytes": _dir_size(target),
+                "created_at": _now(),
+                "last_used_at": _now(),
+            })
+            index.setdefault("current", dataset_id)
+
+        state.update(self.index_path, adopt)
+
+    def resolve(self, dataset_id: Optional[str] = None) -> str:
+        """``dataset_id`` if it is stored and ready, else the current dataset's id when none is given."""
+        index = self._index()
+        dataset_id = dataset_id or index.get("current")
+        if not dataset_id:
+            raise DatasetNotFoundError(None)
+        entry = (index.get("datasets") or {}).get(dataset_id)
+        if entry is None or entry.get("status") != "ready":
+            raise DatasetNotFoundError(dataset_id)
+        return dataset_id
+
+    def path(self, dataset_id: Optional[str] = None) -> Path:
+        return self.csv_path(self.resolve(dataset_id))
+
+    def get(self, dataset_id: str) -> Dict[str, Any]:
+        index = self._index()
+        entry = (index.get("datasets") or {}).get(dataset_id)
+        if entry is None:
+            raise DatasetNotFoundError(dataset_id)
+        return {**entry, "current": index.get("current") == dataset_id}
+
+    def list(self) -> List[Dict[str, Any]]:
+        index = self._index()
+        entries = [{**e, "current": index.get("current") == k} for k, e in (index.get("datasets") or {}).items()]
+        return sorted(entries, key=lambda e: e.get("last_used_at", ""), reverse=True)
+
+    def claim(self, sha256: str, file_name: str) -> Tuple[str, str]:
+        """Look up or claim the dataset with this content hash.
+
+        Returns its id and ``"ready"`` (already stored: it becomes current), ``"busy"``
+        (another upload is ingesting it) or ``"claimed"`` (the caller must ingest it
+        and then ``commit`` or ``abandon``).
+        """
+        dataset_id = make_dataset_id(sha256)
+        outcome: Dict[str, str] = {}
+
+        def apply(index: Dict[str, Any]) -> None:
+            datasets = index.setdefault("datasets", {})
+            entry = datasets.get(dataset_id)
+            if entry is not None and entry.get("status") == "ready":
+                entry["last_used_at"] = _now()
+                index["current"] = dataset_id
+                outcome["status"] = "ready"
+            elif entry is not None and time.time() - entry.get("claimed_at", 0) < DATASET_INGEST_TIMEOUT:
+                outcome["status"] = "busy"
+            else:
+                datasets[dataset_id] = {
+                    "dataset_id": dataset_id,
+                    "sha256": sha256,
+                    "file_name": file_name,
+                    "status": "ingesting",
+                    "claimed_at": time.time(),
+                    "created_at": _now(),
+                }
+                outcome["status"] = "claimed"
+
+        state.update(self.index_path, apply)
+        if outcome["status"] == "claimed":
+            # an abandoned ingest may have left partial files behind
+            shutil.rmtree(self.dir_for(dataset_id), ignore_errors=True)
+            self.dir_for(dataset_id).mkdir(parents=True, exist_ok=True)
+        return dataset_id, outcome["status"]
+
+    def commit(self, dataset_id: str, keep: Iterable[Optional[str]] = ()) -> List[str]:
+        """Mark an ingested dataset ready and current, then evict down to the budget; returns evicted ids."""
+        size = _dir_size(self.dir_for(dataset_id))
+
+        def apply(index: Dict[str, Any]) -> None:
+            entry = index.setdefault("datasets", {}).setdefault(dataset_id, {"dataset_id": dataset_id})
+            entry.pop("claimed_at", None)
+            entry.update(status="ready", size_bytes=size, last_used_at=_now())
+            index["current"] = dataset_id
+
+        state.update(self.index_path, apply)
+        return self.evict(keep={dataset_id, *keep})
+
+    def abandon(self, dataset_id: str) -> None:
+        """Drop a claimed dataset whose ingest failed."""
+        def apply(index: Dict[str, Any]) -> None:
+            datasets = index.get("datasets") or {}
+            if (datasets.get(dataset_id) or {}).get("status") == "ingesting":
+                del datasets[dataset_id]
+
+        state.update(self.index_path, apply)
+        shutil.rmtree(self.dir_for(dataset_id), ignore_errors=True)
+
+    def touch(self, dataset_id: str) -> None:
+        """Record a use, so eviction keeps the datasets being worked with."""
+        def apply(index: Dict[str, Any]) -> None:
+            entry = (index.get("datasets") or {}).get(dataset_id)
+            if entry is not None:
+                entry["last_used_at"] = _now()
+
+        state.update(self.index_path, apply)
+
+    def delete(self, dataset_id: str, keep: Iterable[Optional[str]] = ()) -> Dict[str, Any]:
+        """Remove a dataset, its documents and files; the ids in ``keep`` are refused."""
+        if dataset_id in set(keep):
+            raise DatasetInUseError(dataset_id)
+        removed: Dict[str, Dict[str, Any]] = {}
+
+        def apply(index: Dict[str, Any]) -> None:
+            datasets = index.get("datasets") or {}
+            entry = datasets.get(dataset_id)
+            if entry is None or entry.get("status") != "ready":
+                raise DatasetNotFoundError(dataset_id)
+            removed["entry"] = datasets.pop(dataset_id)
+            if index.get("current") == dataset_id:
+                ready = [e for e in datasets.values() if e.get("status") == "ready"]
+                latest = max(ready, key=lambda e: e.get("last_used_at", ""), default=None)
+                index["current"] = latest["dataset_id"] if latest else None
+
+        state.update(self.index_path, apply)
+        for name in DATASET_DOCS:
+            state.delete(self.dir_for(dataset_id) / name)
+        shutil.rmtree(self.dir_for(dataset_id), ignore_errors=True)
+        return removed["entry"]
+
+    def evict(self, keep: Iterable[Optional[str]] = ()) -> List[str]:
+        """Delete least recently used datasets until the store fits ``budget_mb``.
+
+        The current dataset and the ids in ``keep`` are never evicted.
+        """
+        if self.budget_mb <= 0:
+            return []
+        index = self._index()
+        protected = {index.get("current"), *keep}
+        entries = [e for e in (index.get("datasets") or {}).values() if e.get("status") == "ready"]
+        total = sum(int(e.get("size_bytes") or 0) for e in entries)
+        removed: List[str] = []
+        for entry in sorted(entries, key=lambda e: e.get("last_used_at", "")):
+            if total <= self.budget_mb * 1024 * 1024:
+                break
+            if entry["dataset_id"] in protected:
+                continue
+            try:
+                self.delete(entry["dataset_id"])
+            except DatasetNotFoundError:
+                continue
+            total -= int(entry.get("size_bytes") or 0)
+            removed.append(entry["dataset_id"])
+        return removed
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file()) if path.exists() else 0
+
+
+dataset_store = DatasetStore(DATASETS_DIR, DATASETS_INDEX_PATH)
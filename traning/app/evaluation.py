@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# score bins of the threshold-binned ROC and precision-recall curves
+EVAL_BINS = int(os.environ.get("EVAL_BINS", "1000"))
+
+
+def class_codes(y: Any, classes: Any) -> np.ndarray:
+    """Position of each label in ``classes``, or -1 for labels that are not among them."""
+    classes = np.asarray(classes)
+    y = np.asarray(y)
+    if classes.shape[0] == 0:
+        return np.full(y.shape[0], -1, dtype=np.int64)
+    order = np.argsort(classes, kind="stable")
+    pos = np.clip(np.searchsorted(classes[order], y), 0, classes.shape[0] - 1)
+    codes = order[pos]
+    return np.where(classes[codes] == y, codes, -1)
+
+
+def _pair_counts(true: np.ndarray, pred: np.ndarray, k: int) -> np.ndarray:
+    keep = (true >= 0) & (pred >= 0)
+    return np.bincount(true[keep] * k + pred[keep], minlength=k * k).reshape(k, k).astype(np.int64)
+
+
+def confusion_counts(y_true: Any, y_pred: Any, classes: List[Any]) -> np.ndarray:
+    """Confusion matrix over ``classes`` (rows: true class), counted in one ``bincount``."""
+    return _pair_counts(class_codes(y_true, classes), class_codes(y_pred, classes), len(classes))
+
+
+def metrics_from_counts(counts: np.ndarray) -> Dict[str, float]:
+    """Accuracy, precision, recall and F1 from a confusion matrix (macro-averaged
+    over classes; binary problems report the positive class, like average="binary")."""
+    counts = np.asarray(counts, dtype=np.float64)
+    tp = np.diag(counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.nan_to_num(tp / counts.sum(axis=0))
+        recall = np.nan_to_num(tp / counts.sum(axis=1))
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    pick = slice(1, 2) if counts.shape[0] == 2 else slice(None)
+    return {
+        "accuracy": float(tp.sum() / max(counts.sum(), 1)),
+        "precision": float(precision[pick].mean()),
+        "recall": float(recall[pick].mean()),
+        "f1Score": float(f1[pick].mean()),
+    }
+
+
+class Evaluation:
+    """Held-out predictions reduced to counts: the confusion matrix and, for binary
+    problems, positives and negatives per score bin.
+
+    Batches add up, so a streamed hold-out set or a model update is evaluated
+    without keeping any predictions. The metrics, the ROC and precision-recall
+    curves and their areas all derive from the counts, so the size of the stored
+    bundle is bounded by the number of bins, whatever the size of the test set.
+    """
+
+    def __init__(self, classes: Sequence[Any], bins: int = EVAL_BINS) -> None:
+        self.classes = np.asarray(classes)
+        self.bins = max(int(bins), 1)
+        k = self.classes.shape[0]
+        self.counts = np.zeros((k, k), dtype=np.int64)
+        self.positive: Optional[np.ndarray] = None
+        self.negative: Optional[np.ndarray] = None
+
+    def add(self, y_true: Any, y_pred: Any, y_score: Any = None) -> "Evaluation":
+        """Count a batch; ``y_score`` is the positive-class score in [0, 1] (binary problems only)."""
+        true = class_codes(y_true, self.classes)
+        self.counts += _pair_counts(true, class_codes(y_pred, self.classes), self.classes.shape[0])
+        if y_score is not None and self.classes.shape[0] == 2:
+            score = np.asarray(y_score, dtype=np.float64)
+            valid = np.isfinite(score)
+            bins = np.clip((score[valid] * self.bins).astype(np.int64), 0, self.bins - 1)
+            if self.positive is None:
+                self.positive = np.zeros(self.bins, dtype=np.int64)
+                self.negative = np.zeros(self.bins, dtype=np.int64)
+            self.positive += np.bincount(bins[true[valid] == 1], minlength=self.bins)
+            self.negative += np.bincount(bins[true[valid] == 0], minlength=self.bins)
+        return self
+
+    def curves(self) -> Optional[Dict[str, np.ndarray]]:
+        """ROC and precision-recall points, one per non-empty score bin from the highest threshold down."""
+        if self.positive is None:
+            return None
+        tp = np.concatenate([[0], np.cumsum(self.positive[::-1])])
+        fp = np.concatenate([[0], np.cumsum(self.negative[::-1])])
+        thresholds = (self.bins - np.arange(self.bins + 1)) / self.bins
+        # an empty bin moves no point, so dropping it loses nothing
+        keep = np.concatenate([[True], (self.positive + self.negative)[::-1] > 0])
+        tp, fp, thresholds = tp[keep], fp[keep], thresholds[keep]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        return {
+            "thresholds": thresholds,
+            "fpr": fp / max(fp[-1], 1),
+            "tpr": tp / max(tp[-1], 1),
+            "precision": precision,
+            "recall": tp / max(tp[-1], 1),
+        }
+
+    def areas(self) -> Dict[str, Optional[float]]:
+        """ROC AUC (trapezoidal, so scores tied within a bin count half) and average precision."""
+        curves = self.curves()
+        if curves is None or self.positive.sum() == 0 or self.negative.sum() == 0:
+            return {"rocAuc": None, "averagePrecision": None}
+        recall = curves["recall"]
+        return {
+            "rocAuc": float(np.trapezoid(curves["tpr"], curves["fpr"])),
+            "averagePrecision": float(np.sum(np.diff(recall) * curves["precision"][1:])),
+        }
+
+    def bundle(self) -> Dict[str, Any]:
+        """JSON-ready summary stored with the model version."""
+        out: Dict[str, Any] = {
+            "classes": self.classes.tolist(),
+            "confusion": self.counts.tolist(),
+            "support": int(self.counts.sum()),
+            "metrics": {**metrics_from_counts(self.counts), **self.areas()},
+        }
+        if self.positive is not None:
+            index = np.flatnonzero(self.positive + self.negative)
+            out["scores"] = {
+                "bins": self.bins,
+                "index": index.tolist(),
+                "positive": self.positive[index].tolist(),
+                "negative": self.negative[index].tolist(),
+            }
+        return out
+
+    @classmethod
+    def from_bundle(cls, bundle: Dict[str, Any]) -> "Evaluation":
+        scores = bundle.get("scores")
+        evaluation = cls(bundle["classes"], scores["bins"] if scores else EVAL_BINS)
+        evaluation.counts = np.asarray(bundle["confusion"], dtype=np.int64).reshape(evaluation.counts.shape)
+        if scores:
+            evaluation.positive = np.zeros(evaluation.bins, dtype=np.int64)
+            evaluation.negative = np.zeros(evaluation.bins, dtype=np.int64)
+            evaluation.positive[scores["index"]] = scores["positive"]
+            evaluation.negative[scores["index"]] = scores["negative"]
+        return evaluation
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa  # type: ignore
+except Exception:  # pragma: no cover
+    pa = None  # type: ignore
+
+PREDICT_MAX_BATCH = int(os.environ.get("PREDICT_MAX_BATCH", "256"))
+PREDICT_MAX_WAIT_MS = float(os.environ.get("PREDICT_MAX_WAIT_MS", "5"))
+# score with the model's compiled NumPy scorer when one was exported (0 always loads the full model)
+PREDICT_COMPILED = int(os.environ.get("PREDICT_COMPILED", "1"))
+# compiled tree scorers beat the libraries only on small batches; larger ones use the full model
+PREDICT_COMPILED_TREE_ROWS = int(os.environ.get("PREDICT_COMPILED_TREE_ROWS", "8"))
+
+ARROW_MEDIA_TYPES = ("application/vnd.apache.arrow.stream", "application/vnd.apache.arrow.file")
+
+
+class InferenceError(Exception):
+    pass
+
+
+def parse_payload(body: bytes, content_type: str) -> Tuple[pd.DataFrame, bool]:
+    """Decode a request body into rows; the flag is True for a single JSON record."""
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+    try:
+        if media_type in ("text/csv", "application/csv"):
+            return pd.read_csv(io.BytesIO(body)), False
+        if media_type in ARROW_MEDIA_TYPES:
+            if pa is None:
+                raise InferenceError("Arrow payloads need pyarrow installed")
+            if media_type.endswith("stream"):
+                table = pa.ipc.open_stream(body).read_all()
+            else:
+                table = pa.ipc.open_file(pa.BufferReader(body)).read_all()
+            return table.to_pandas(), False
+        data = json.loads(body or b"null")
+    except InferenceError:
+        raise
+    except Exception as e:
+        raise InferenceError(f"Failed to parse request body: {e}")
+
+    if isinstance(data, dict) and isinstance(data.get("records"), list):
+        data = data["records"]
+    if isinstance(data, dict):
+        return pd.DataFrame([data]), True
+    if isinstance(data, list) and all(isinstance(r, dict) for r in data):
+        return pd.DataFrame(data), False
+    raise InferenceError("Expected a JSON object, a JSON array of objects, CSV or Arrow data")
+
+
+def feature_matrix(df: pd.DataFrame, features: List[str]) -> pd.DataFrame:
+    """Select the model's features in training order, rejecting missing or non-numeric values."""
+    if not features:
+        raise InferenceError("Model has no recorded feature list")
+    missing = [f for f in features if f not in df.columns]
+    if missing:
+        raise InferenceError(f"Missing features: {', '.join(missing)}")
+    X = df[features].apply(pd.to_numeric, errors="coerce")
+    bad = X.isna().any(axis=0)
+    if bad.any():
+        raise InferenceError(f"Non-numeric or missing values in: {', '.join(X.columns[bad])}")
+    return X
+
+
+def predict_frame(model: Any, X: pd.DataFrame) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    if hasattr(model, "predict_proba"):
+        proba = model.predict_proba(X)
+        classes = np.asarray(getattr(model, "classes_", np.arange(proba.shape[1])))
+        return classes[proba.argmax(axis=1)], proba
+    return np.asarray(model.predict(X)), None
+
+
+def format_predictions(model: Any, labels: np.ndarray, proba: Optional[np.ndarray]) -> Dict[str, Any]:
+    classes = getattr(model, "classes_", None)
+    return {
+        "classes": np.asarray(classes).tolist() if classes is not None else None,
+        "labels": labels.tolist(),
+        "probabilities": proba.tolist() if proba is not None else None,
+    }
+
+
+class CompiledModel:
+    """A model's compiled scorer, standing in for the model wherever it is faster.
+
+    Linear scorers are used for any batch. Tree scorers evaluate every split in NumPy,
+    which wins over the library's per-call overhead for a few rows but not over its
+    native loops on big batches, so those load the full model (once, then cached).
+    """
+
+    def __init__(self, scorer: Any, load_model: Callable[[], Any]) -> None:
+        self.scorer = scorer
+        self.classes_ = scorer.classes_
+        self.max_rows = None if scorer.kind == "linear" else PREDICT_COMPILED_TREE_ROWS
+        self._load_model = load_model
+
+    def predict_proba(self, X: Any) -> np.ndarray:
+        if self.max_rows is None or len(X) <= self.max_rows:
+            return self.scorer.predict_proba(X)
+        return self._load_model().predict_proba(X)
+
+
+_compiled: Dict[str, CompiledModel] = {}
+
+
+def compiled_model(model_id: str, scorer: Any, load_model: Callable[[], Any]) -> CompiledModel:
+    # one instance per scorer, so the micro-batcher keeps its queue across requests
+    compiled = _compiled.get(model_id)
+    if compiled is None or compiled.scorer is not scorer:
+        compiled = _compiled[model_id] = CompiledModel(scorer, load_model)
+    return compiled
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-row requests into one vectorized predict_proba call.
+
+    A batch is flushed when it reaches ``max_batch`` rows or ``max_wait_ms`` after its
+    first row arrived, whichever comes first. Scoring runs on the default executor so
+    the event loop keeps accepting rows meanwhile.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        features: List[str],
+        max_batch: int = PREDICT_MAX_BATCH,
+        max_wait_ms: float = PREDICT_MAX_WAIT_MS,
+    ) -> None:
+        self.model = model
+        self.features = features
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max(max_wait_ms, 0) / 1000
+        self._queue: "asyncio.Queue[Tuple[pd.DataFrame, asyncio.Future]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, X: pd.DataFrame) -> Tuple[Any, Optional[List[float]]]:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((X, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            X = pd.concat([x for x, _ in batch], ignore_index=True)
+            try:
+                labels, proba = await loop.run_in_executor(None, predict_frame, self.model, X)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    row_proba = proba[i].tolist() if proba is not None else None
+                    future.set_result((labels[i:i + 1].tolist()[0], row_proba))
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+_batchers: Dict[str, MicroBatcher] = {}
+
+
+def get_batcher(model_id: str, model: Any, features: List[str]) -> MicroBatcher:
+    batcher = _batchers.get(model_id)
+    if batcher is None or batcher.model is not model:
+        if batcher is not None:
+            batcher.stop()
+        batcher = MicroBatcher(model, features)
+        _batchers[model_id] = batcher
+    return batcher
+
+
+def stop_batchers() -> None:
+    for batcher in _batchers.values():
+        batcher.stop()
+    _batchers.clear()
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+import os
+import zlib
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+import pandas as pd
+
+from app.lazy import optional_import
+from app.profiling import DatasetProfiler
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+CSV_CHUNK_ROWS = int(os.environ.get("CSV_CHUNK_ROWS", "100000"))
+# accepted uploads by file name suffix; every one is stored as CSV
+UPLOAD_SUFFIXES = (".csv", ".csv.gz", ".csv.zst", ".parquet")
+PARQUET_BATCH_ROWS = 65536
+
+_GZIP_WBITS = zlib.MAX_WBITS | 16
+# zstd's decompressobj has no output limit; feeding it small slices bounds what one call inflates
+_ZSTD_SLICE_BYTES = 64 * 1024
+
+
+class UploadError(ValueError):
+    """An upload that cannot be decoded into CSV."""
+
+
+def upload_suffix(file_name: str) -> Optional[str]:
+    name = file_name.lower()
+    return next((s for s in UPLOAD_SUFFIXES if name.endswith(s)), None)
+
+
+class _HashingWriter(io.RawIOBase):
+    """Writes to ``f`` while counting and hashing the bytes."""
+
+    def __init__(self, f: Any) -> None:
+        self.f = f
+        self.size = 0
+        self.digest = hashlib.sha256()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self.f.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+
+class _GzipWriter:
+    """Decompresses gzip blocks into ``out`` as they arrive, including files of several members."""
+
+    def __init__(self, out: Any) -> None:
+        self.out = out
+        self._d = zlib.decompressobj(_GZIP_WBITS)
+
+    def write(self, data: bytes) -> None:
+        while data:
+            if self._d.eof:
+                self._d = zlib.decompressobj(_GZIP_WBITS)
+            # bounded output per call, so a highly compressed block is never inflated in one piece
+            self.out.write(self._d.decompress(data, UPLOAD_CHUNK_BYTES))
+            data = self._d.unconsumed_tail or (self._d.unused_data if self._d.eof else b"")
+
+    def close(self) -> None:
+        self.out.write(self._d.flush())
+        if not self._d.eof:
+            raise UploadError("Truncated gzip stream")
+
+
+class _ZstdWriter:
+    """Decompresses zstd frames into ``out`` as they arrive, including files of several frames."""
+
+    def __init__(self, out: Any, zstandard: Any) -> None:
+        self.out = out
+        self._new = zstandard.ZstdDecompressor().decompressobj
+        self._d = self._new()
+
+    def write(self, data: bytes) -> None:
+        for start in range(0, len(data), _ZSTD_SLICE_BYTES):
+            piece = data[start:start + _ZSTD_SLICE_BYTES]
+            while piece:
+                if self._d.eof:
+                    self._d = self._new()
+                self.out.write(self._d.decompress(piece))
+                piece = self._d.unused_data if self._d.eof else b""
+
+    def close(self) -> None:
+        if not self._d.eof:
+            raise UploadError("Truncated zstd stream")
+
+
+def _decoder(suffix: str, out: Any) -> Any:
+    """A writer that takes the uploaded bytes and writes the CSV they encode to ``out``."""
+    if suffix == ".csv.gz":
+        return _GzipWriter(out)
+    if suffix == ".csv.zst":
+        zstandard = optional_import("zstandard")
+        if zstandard is None:
+            raise UploadError("Zstandard uploads need the zstandard package")
+        return _ZstdWriter(out, zstandard)
+    return out
+
+
+async def _receive(file: Any, writer: Any, chunk_size: int) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        block = await file.read(chunk_size)
+        if not block:
+            break
+        # decompressing, hashing and writing run in the executor, off the event loop
+        await loop.run_in_executor(None, writer.write, block)
+
+
+def parquet_to_csv(path: Path, out: Any, batch_rows: int = PARQUET_BATCH_ROWS) -> None:
+    """Write a Parquet file to ``out`` as CSV, ``batch_rows`` rows at a time."""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(str(path))
+    with pa_csv.CSVWriter(pa.PythonFile(out, mode="w"), parquet.schema_arrow) as writer:
+        for batch in parquet.iter_batches(batch_size=batch_rows):
+            writer.write_batch(batch)
+
+
+async def save_upload(
+    file: Any,
+    path: Path,
+    suffix: str = ".csv",
+    chunk_size: int = UPLOAD_CHUNK_BYTES,
+) -> Tuple[int, str]:
+    """Decode an uploaded file into CSV at ``path`` one chunk at a time; returns the CSV's size in bytes and SHA-256.
+
+    Compressed CSV is decompressed as it arrives. Parquet keeps its schema at the
+    end of the file, so it is received into a temporary file first and converted
+    batch by batch from there.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    raw_path = path.with_name(path.name + ".parquet")
+    loop = asyncio.get_running_loop()
+    try:
+        with open(path, "wb") as f:
+            out = _HashingWriter(f)
+            if suffix == ".parquet":
+                with open(raw_path, "wb") as raw:
+                    await _receive(file, raw, chunk_size)
+                await loop.run_in_executor(None, parquet_to_csv, raw_path, out)
+            else:
+                decoder = _decoder(suffix, out)
+                await _receive(file, decoder, chunk_size)
+                if decoder is not out:
+                    await loop.run_in_executor(None, decoder.close)
+    except UploadError:
+        raise
+    except Exception as e:
+        # corrupt compressed streams and unreadable Parquet files
+        raise UploadError(f"Failed to decode {suffix} upload: {e}")
+    finally:
+        raw_path.unlink(missing_ok=True)
+    return out.size, out.digest.hexdigest()
+
+
+def scan_csv(path: Path, chunk_rows: int = CSV_CHUNK_ROWS) -> DatasetProfiler:
+    """Profile a CSV with chunked ``read_csv`` so memory stays bounded by ``chunk_rows``."""
+    profiler = DatasetProfiler()
+    with pd.read_csv(path, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            profiler.update(chunk)
+    return profiler
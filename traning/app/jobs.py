@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.schemas import TrainRequest, TrainResponse
+from app.storage import DATA_DIR, load_json, save_json, state
+from app.training import STAGES, publish_training, run_training
+
+JOBS_DIR = DATA_DIR / "jobs"
+JOBS_PATH = DATA_DIR / "jobs.json"
+
+TRAIN_WORKERS = int(os.environ.get("TRAIN_WORKERS", "2"))
+MAX_FINISHED_JOBS = 100
+
+
+class JobNotFoundError(KeyError):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _run_job(job_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker-process entry point. Stage changes go to a progress file the API polls."""
+    progress_path = JOBS_DIR / f"{job_id}.json"
+    cancel_path = JOBS_DIR / f"{job_id}.cancel"
+
+    def report(stage: str) -> None:
+        # cancellation takes effect at the next stage boundary
+        if cancel_path.exists():
+            raise JobCancelled(f"Job {job_id} cancelled")
+        save_json(progress_path, {"stage": stage, "updated_at": _now()})
+
+    entry, resp = run_training(TrainRequest(**params), progress=report)
+    return {"entry": entry, "response": resp.model_dump()}
+
+
+class TrainingJobs:
+    """Runs training requests in a process pool so the event loop never blocks on a fit.
+
+    Job records live in the shared state store, so any API worker can report on or
+    cancel a job; only the worker that submitted it holds its future.
+    """
+
+    def __init__(self, workers: int = TRAIN_WORKERS) -> None:
+        self.workers = max(workers, 1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[str, Future] = {}
+        # events of requests waiting on a job, set once its record is final
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _save(job_id: str, fields: Dict[str, Any]) -> None:
+        def apply(jobs: Dict[str, Dict[str, Any]]) -> None:
+            jobs.setdefault(job_id, {}).update(fields)
+            finished = [k for k, j in jobs.items() if j.get("finished_at")]
+            for k in finished[: max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+                del jobs[k]
+
+        state.update(JOBS_PATH, apply)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def prewarm(self, fn: Callable[..., Any], *args: Any) -> List[Any]:
+        """Start the worker processes now by running ``fn(*args)`` on the pool, once per worker."""
+        with self._lock:
+            futures = [self._pool().submit(fn, *args) for _ in range(self.workers)]
+        return [f.result() for f in futures]
+
+    def submit(self, req: TrainRequest) -> Dict[str, Any]:
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "stage": None,
+            "progress": 0.0,
+            "request": req.model_dump(),
+            "algorithm": None,
+            "submitted_at": _now(),
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        self._save(job_id, job)
+        with self._lock:
+            future = self._pool().submit(_run_job, job_id, req.model_dump())
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return dict(job)
+
+    def _finish(self, job_id: str, future: Future) -> None:
+        status, result, error = "done", None, None
+        if future.cancelled():
+            status = "cancelled"
+        else:
+            exc = future.exception()
+            if isinstance(exc, JobCancelled):
+                status = "cancelled"
+            elif exc is not None:
+                status, error = "failed", {"type": type(exc).__name__, "message": str(exc)}
+            else:
+                out = future.result()
+                resp = TrainResponse(**out["response"])
+                try:
+                    publish_training(out["entry"], resp)
+                    result = out["response"]
+                except Exception as e:
+                    status, error = "failed", {"type": type(e).__name__, "message": str(e)}
+
+        fields: Dict[str, Any] = {"status": status, "result": result, "error": error, "finished_at": _now()}
+        if status == "done":
+            # may differ from request.model: out of core, sklearn_logreg trains as sklearn_sgd
+            fields.update(stage=STAGES[-1], progress=1.0, algorithm=result["algorithm"])
+        self._save(job_id, fields)
+        with self._lock:
+            self._futures.pop(job_id, None)
+        (JOBS_DIR / f"{job_id}.json").unlink(missing_ok=True)
+        (JOBS_DIR / f"{job_id}.cancel").unlink(missing_ok=True)
+        with self._lock:
+            waiters = self._waiters.pop(job_id, [])
+        for loop, finished in waiters:
+            loop.call_soon_threadsafe(finished.set)
+
+    def get(self, job_id: str) -> Dict[str, Any]:
+        return self._overlay(job_id, state.get(JOBS_PATH).get(job_id))
+
+    @staticmethod
+    def _overlay(job_id: str, job: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """The stored record with the running stage from the worker's progress file."""
+        if job is None:
+            raise JobNotFoundError(job_id)
+        if job["finished_at"] is None:
+            stage = load_json(JOBS_DIR / f"{job_id}.json").get("stage")
+            if stage:
+                if job["status"] == "queued":
+                    job["status"] = "running"
+                job["stage"] = stage
+                job["progress"] = round(STAGES.index(stage) / len(STAGES), 2) if stage in STAGES else 0.0
+        return job
+
+    def list(self) -> List[Dict[str, Any]]:
+        jobs = state.get(JOBS_PATH)
+        return [self._overlay(job_id, job) for job_id, job in reversed(list(jobs.items()))]
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        job = self.get(job_id)
+        with self._lock:
+            future = self._futures.get(job_id)
+        if job["finished_at"] is None and (future is None or not future.cancel()):
+            # a job submitted by another worker, or already running: stop it at its next stage
+            (JOBS_DIR / f"{job_id}.cancel").touch()
+
+            def mark(jobs: Dict[str, Dict[str, Any]]) -> None:
+                if job_id in jobs and not jobs[job_id].get("finished_at"):
+                    jobs[job_id]["status"] = "cancelling"
+
+            state.update(JOBS_PATH, mark)
+        return self.get(job_id)
+
+    async def wait(self, job_id: str) -> Dict[str, Any]:
+        """Wait until a job submitted by this worker is published or has failed, and return its record.
+
+        A failure is not raised: its type and message are in the record's ``error``.
+        The done callback wakes the waiter once the record is final, so nothing polls.
+        """
+        loop = asyncio.get_running_loop()
+        finished = asyncio.Event()
+        with self._lock:
+            if job_id in self._futures:
+                self._waiters.setdefault(job_id, []).append((loop, finished))
+            else:
+                finished.set()
+        await finished.wait()
+        return await loop.run_in_executor(None, self.get, job_id)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+training_jobs = TrainingJobs()
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import importlib
+import threading
+from functools import lru_cache
+from types import ModuleType
+from typing import Any, Dict, Iterable, List, Optional
+
+_pyplot_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def optional_import(name: str) -> Optional[ModuleType]:
+    """Import ``name`` on first use; None when it is not installed (or fails to import)."""
+    try:
+        return importlib.import_module(name)
+    except Exception:
+        return None
+
+
+def pyplot() -> Any:
+    """matplotlib.pyplot on the non-interactive Agg backend, imported on first use."""
+    with _pyplot_lock:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    return plt
+
+
+def preload(names: Iterable[str]) -> Dict[str, List[str]]:
+    """Import ``names`` now instead of on first use; reports which were loaded and which are missing."""
+    loaded: List[str] = []
+    missing: List[str] = []
+    for name in names:
+        (loaded if optional_import(name) is not None else missing).append(name)
+    return {"loaded": loaded, "missing": missing}
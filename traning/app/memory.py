@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    import resource  # type: ignore
+except ImportError:  # pragma: no cover - Windows
+    resource = None  # type: ignore
+
+PROC_STATUS = Path("/proc/self/status")
+PROC_CLEAR_REFS = Path("/proc/self/clear_refs")
+
+
+def _proc_status_mb(field: str) -> Optional[float]:
+    try:
+        for line in PROC_STATUS.read_text().splitlines():
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size of this process, where the platform exposes it."""
+    return _proc_status_mb("VmRSS")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size since the last ``reset_peak_rss`` (or process start)."""
+    peak = _proc_status_mb("VmHWM")
+    if peak is None and resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        peak = maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+    return peak
+
+
+def reset_peak_rss() -> bool:
+    """Restart peak tracking so a worker process reports each run separately (Linux only)."""
+    try:
+        PROC_CLEAR_REFS.write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def memory_report(baseline_mb: Optional[float], **sizes: float) -> Dict[str, Optional[float]]:
+    """Peak figures for one run, rounded for the API; sizes are extra named MB values."""
+    peak = peak_rss_mb()
+    report = {
+        "baseline_rss_mb": baseline_mb,
+        "peak_rss_mb": peak,
+        "peak_over_baseline_mb": peak - baseline_mb if peak is not None and baseline_mb is not None else None,
+        **sizes,
+    }
+    return {k: round(v, 2) if v is not None else None for k, v in report.items()}
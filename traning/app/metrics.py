@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# recent observations kept per series for the quantiles; count and sum cover every observation
+METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", "2048"))
+QUANTILES = (0.5, 0.95, 0.99)
+
+METRIC_HELP = {
+    "http_request_duration_seconds": "Wall time of HTTP requests by route template and status.",
+    "training_stage_duration_seconds": "Wall time of each training stage, recorded when a run is published.",
+    "upload_stage_duration_seconds": "Wall time of each dataset upload stage.",
+    "plot_stage_duration_seconds": "Wall time of chart rendering stages on render-cache misses.",
+    "startup_step_duration_seconds": "Wall time of each background start-up step (preloading, prewarming).",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Summary:
+    def __init__(self, window: int = METRICS_WINDOW) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = deque(maxlen=max(window, 1))
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self) -> Dict[float, float]:
+        if not self.recent:
+            return {q: float("nan") for q in QUANTILES}
+        values = np.quantile(np.fromiter(self.recent, dtype=np.float64), QUANTILES)
+        return dict(zip(QUANTILES, values.tolist()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class MetricsRegistry:
+    """In-process latency summaries (count, sum, p50/p95/p99), rendered in Prometheus text format."""
+
+    def __init__(self, window: int = METRICS_WINDOW) -> None:
+        self.window = window
+        self._series: Dict[str, Dict[LabelKey, Summary]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._series.setdefault(name, {})
+            summary = series.get(key)
+            if summary is None:
+                summary = series[key] = Summary(self.window)
+            summary.observe(seconds)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._series):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} summary")
+                for key, summary in sorted(self._series[name].items()):
+                    for q, value in summary.quantiles().items():
+                        lines.append(f"{name}{_labels(key, ('quantile', str(q)))} {value:.6g}")
+                    lines.append(f"{name}_sum{_labels(key)} {summary.sum:.6g}")
+                    lines.append(f"{name}_count{_labels(key)} {summary.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class StageTimer:
+    """Wall time per named stage. ``mark`` closes the running stage and opens the next one."""
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, float] = {}
+        self._current: Optional[str] = None
+        self._started = 0.0
+
+    def mark(self, name: str) -> None:
+        self.stop()
+        self._current = name
+        self._started = time.perf_counter()
+
+    def stop(self) -> None:
+        if self._current is not None:
+            elapsed = time.perf_counter() - self._started
+            self.stages[self._current] = self.stages.get(self._current, 0.0) + elapsed
+            self._current = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        self.mark(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def breakdown(self) -> Dict[str, float]:
+        self.stop()
+        return {k: round(v, 6) for k, v in self.stages.items()}
+
+    def observe(self, name: str, **labels: str) -> Dict[str, float]:
+        """Record every stage in the ``name`` summary and return the breakdown."""
+        stages = self.breakdown()
+        for stage, seconds in stages.items():
+            metrics.observe(name, seconds, stage=stage, **labels)
+        return stages
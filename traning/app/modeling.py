@@ -1,42 +1,59 @@
 from __future__ import annotations
 
-from typing import Dict, Tuple, List, Optional
-import joblib
+import copy
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple, List, Optional
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
-from sklearn.linear_model import LogisticRegression
-from sklearn.pipeline import Pipeline
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
 
-try:
-    from xgboost import XGBClassifier  # type: ignore
-except Exception:  # pragma: no cover
-    XGBClassifier = None  # type: ignore
+from app.evaluation import Evaluation, confusion_counts, metrics_from_counts
+from app.lazy import optional_import
+from app.metrics import StageTimer
+from app.profiling import infer_target, numeric_columns
+from app.scorer import UnsupportedModel, compile_scorer, save_scorer
 
-try:
-    from lightgbm import LGBMClassifier  # type: ignore
-except Exception:  # pragma: no cover
-    LGBMClassifier = None  # type: ignore
+# scikit-learn, joblib, xgboost and lightgbm are imported where they are used, so importing
+# this module (and starting the API) stays cheap; app.startup preloads them in the background
+
+# trees added to a boosted model per incremental update
+INCREMENTAL_BOOST_ROUNDS = int(os.environ.get("INCREMENTAL_BOOST_ROUNDS", "50"))
+# largest probability difference allowed between a compiled scorer and its model
+SCORER_PARITY_TOL = float(os.environ.get("SCORER_PARITY_TOL", "1e-4"))
+# rows of real data, and as many generated probes, scored by the parity check
+SCORER_PARITY_ROWS = int(os.environ.get("SCORER_PARITY_ROWS", "256"))
 
 
 class TrainingError(Exception):
     pass
 
 
-def split_features_target(df: pd.DataFrame, target: str | None) -> Tuple[pd.DataFrame, pd.Series, str]:
-    target_col = target or _infer_target(df)
+def select_rows(
+    df: pd.DataFrame,
+    target: str | None,
+    profile: Dict[str, Any] | None = None,
+) -> Tuple[np.ndarray, np.ndarray, str, List[str]]:
+    """Usable row positions, their labels, the target name and the feature columns.
+
+    Nothing the size of the feature table is copied here; see ``build_feature_matrix``.
+    """
+    target_col = target or _infer_target(df, profile)
     if target_col not in df.columns:
         raise TrainingError(f"Target column '{target_col}' not found in dataset")
 
     # Use only numeric features for initial baseline model
-    numeric_df = df.select_dtypes(include=["number"])
-    if target_col in numeric_df.columns:
-        X = numeric_df.drop(columns=[target_col])
+    if profile:
+        feature_cols = [
+            c for c in numeric_columns(profile)
+            if c != target_col and c in df.columns and pd.api.types.is_numeric_dtype(df[c])
+        ]
     else:
-        X = numeric_df
+        feature_cols = [
+            c for c in df.columns
+            if c != target_col and pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])
+        ]
 
-    if X.shape[1] == 0:
+    if not feature_cols:
         raise TrainingError("No numeric feature columns found for training")
 
     y = df[target_col]
@@ -45,51 +62,90 @@ def split_features_target(df: pd.DataFrame, target: str | None) -> Tuple[pd.Data
         y = y.astype("category").cat.codes
 
     # Drop rows with NA in features or target
-    valid_mask = X.notna().all(axis=1) & y.notna()
-    X = X.loc[valid_mask]
-    y = y.loc[valid_mask]
+    valid = y.notna().to_numpy().copy()
+    for c in feature_cols:
+        valid &= df[c].notna().to_numpy()
+    rows = np.flatnonzero(valid)
+    y = y.to_numpy()[rows]
 
     # If target has a single class, try to synthesize a binary target from a numeric feature
-    if y.nunique() < 2:
-        for candidate in X.columns:
-            col = X[candidate]
-            if col.nunique() > 1:
-                median_val = float(col.median())
+    if np.unique(y).shape[0] < 2:
+        for candidate in feature_cols:
+            col = df[candidate].to_numpy(dtype=np.float64)[rows]
+            if np.unique(col).shape[0] > 1:
+                median_val = float(np.median(col))
                 y_synth = (col > median_val).astype(int)
-                if y_synth.nunique() == 2:
+                if np.unique(y_synth).shape[0] == 2:
                     y = y_synth
                     target_col = f"{candidate}_gt_{median_val:.3g}"
                     break
-        if y.nunique() < 2:
+        if np.unique(y).shape[0] < 2:
             raise TrainingError("Target must have at least two classes for classification")
 
-    return X, y, target_col
+    return rows, y, target_col, feature_cols
 
 
-def _infer_target(df: pd.DataFrame) -> str:
-    candidates = [
-        "target",
-        "label",
-        "y",
-        "class",
-        "passed",
-        "pass",
-        "is_pass",
-    ]
-    for c in candidates:
-        if c in df.columns:
-            return c
-    return df.columns[-1]
+def build_feature_matrix(df: pd.DataFrame, features: List[str], rows: np.ndarray) -> np.ndarray:
+    """One C-contiguous float32 matrix of ``features`` at ``rows``, filled a column at a time."""
+    X = np.empty((rows.shape[0], len(features)), dtype=np.float32)
+    for j, c in enumerate(features):
+        X[:, j] = df[c].to_numpy()[rows]
+    return X
 
 
-def train_model(
+def feature_frame(X: np.ndarray, features: List[str]) -> pd.DataFrame:
+    # a zero-copy view, so fitted models keep their feature names
+    return pd.DataFrame(X, columns=features, copy=False)
+
+
+def prepare_matrix(
     df: pd.DataFrame,
-    algorithm: str,
     target: str | None,
-    test_size: float,
-    random_state: int,
-) -> Tuple[object, Dict[str, float], List[str], str, List[int], List[int], Optional[List[float]]]:
-    X, y, target_col = split_features_target(df, target)
+    profile: Dict[str, Any] | None = None,
+    test_mask: pd.Series | None = None,
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], str, List[str]]:
+    """Everything training needs from a frame: X (float32), y, the testing-window flag of
+    each row (None for a random split), the target name and the feature columns."""
+    rows, y, target_col, features = select_rows(df, target, profile)
+    is_test = test_mask.to_numpy(dtype=bool)[rows] if test_mask is not None else None
+    return build_feature_matrix(df, features, rows), y, is_test, target_col, features
+
+
+def _infer_target(df: pd.DataFrame, profile: Dict[str, Any] | None = None) -> str:
+    if profile and profile.get("target_column") in df.columns:
+        return profile["target_column"]
+    return infer_target(list(df.columns))
+
+
+def classification_metrics(y_true: Any, y_pred: Any) -> Dict[str, float]:
+    """Accuracy, precision, recall and F1 from one confusion count over the labels seen."""
+    classes = np.union1d(np.asarray(y_true), np.asarray(y_pred)).tolist()
+    return metrics_from_counts(confusion_counts(y_true, y_pred, classes))
+
+
+def positive_scores(model: Any, X: Any) -> Optional[np.ndarray]:
+    """Score of the positive class in [0, 1] for binary models, or None."""
+    try:
+        if hasattr(model, "predict_proba"):
+            proba = model.predict_proba(X)
+            if proba.shape[1] == 2:
+                return proba[:, 1]
+        elif hasattr(model, "decision_function"):
+            scores = model.decision_function(X)
+            if scores.ndim == 1:
+                # Normalize to 0-1 range roughly
+                return (scores - scores.min()) / (scores.max() - scores.min() + 1e-9)
+    except Exception:
+        pass
+    return None
+
+
+def build_estimator(algorithm: str, random_state: int, n_jobs: int = 0) -> object:
+    """Unfitted estimator for ``algorithm``. ``n_jobs`` is the boosters' thread count; 0 uses all cores."""
+    if algorithm in ("sklearn_logreg", "sklearn_sgd"):
+        from sklearn.linear_model import LogisticRegression, SGDClassifier
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
 
     if algorithm == "sklearn_logreg":
         model = Pipeline(
@@ -98,23 +154,33 @@ def train_model(
                 ("clf", LogisticRegression(max_iter=1000, n_jobs=None)),
             ]
         )
+    elif algorithm == "sklearn_sgd":
+        # logistic loss fitted by SGD, so the model can be updated with partial_fit
+        model = Pipeline(
+            steps=[
+                ("scaler", StandardScaler()),
+                ("clf", SGDClassifier(loss="log_loss", random_state=random_state)),
+            ]
+        )
     elif algorithm == "xgboost":
-        if XGBClassifier is None:
+        xgboost = optional_import("xgboost")
+        if xgboost is None:
             raise TrainingError("xgboost is not installed")
-        model = XGBClassifier(
+        model = xgboost.XGBClassifier(
             n_estimators=300,
             max_depth=6,
             learning_rate=0.1,
             subsample=0.9,
             colsample_bytree=0.9,
             random_state=random_state,
-            n_jobs=0,
+            n_jobs=n_jobs,
             tree_method="hist",
         )
     elif algorithm == "lightgbm":
-        if LGBMClassifier is None:
+        lightgbm = optional_import("lightgbm")
+        if lightgbm is None:
             raise TrainingError("lightgbm is not installed")
-        model = LGBMClassifier(
+        model = lightgbm.LGBMClassifier(
             n_estimators=400,
             max_depth=-1,
             num_leaves=31,
@@ -122,49 +188,169 @@ def train_model(
             subsample=0.9,
             colsample_bytree=0.9,
             random_state=random_state,
-            n_jobs=0,
+            n_jobs=n_jobs,
         )
     else:
         raise TrainingError(f"Unknown algorithm: {algorithm}")
+    return model
+
+
+def train_prepared(
+    X: np.ndarray,
+    y: np.ndarray,
+    features: List[str],
+    target_col: str,
+    algorithm: str,
+    test_size: float,
+    random_state: int,
+    is_test: Optional[np.ndarray] = None,
+    progress: Callable[[str], None] | None = None,
+    timer: StageTimer | None = None,
+) -> Tuple[object, Dict[str, float], List[str], str, np.ndarray, np.ndarray, Optional[np.ndarray], Dict[str, Any]]:
+    """Fit and evaluate on a matrix built by ``prepare_matrix``; X may be memory-mapped.
+
+    Returns the model, its metrics, features and target, the held-out labels,
+    predictions and positive-class scores, and the evaluation bundle.
+    """
+    report = progress or (lambda stage: None)
+    timer = timer or StageTimer()
+
+    report("split")
+    timer.mark("prepare_features")
+    model = build_estimator(algorithm, random_state)
+    train_pos, test_pos = split_positions(y, test_size, random_state, is_test)
+    X_train = feature_frame(np.asarray(X[train_pos]), features)
+    X_test = feature_frame(np.asarray(X[test_pos]), features)
+    return _fit_and_evaluate(model, X_train, X_test, y, train_pos, test_pos, features, target_col, report, timer)
+
+
+def split_positions(
+    y: np.ndarray,
+    test_size: float,
+    random_state: int,
+    is_test: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions of the training and testing rows: the fixed windows, or a (stratified) random split."""
+    if is_test is not None:
+        is_test = np.asarray(is_test, dtype=bool)
+        train_pos, test_pos = np.flatnonzero(~is_test), np.flatnonzero(is_test)
+        if train_pos.shape[0] == 0 or test_pos.shape[0] == 0:
+            raise TrainingError("Training and testing windows must both contain usable rows")
+        return train_pos, test_pos
+    from sklearn.model_selection import train_test_split
+
+    stratify = y if np.unique(y).shape[0] < 50 else None
+    return train_test_split(np.arange(y.shape[0]), test_size=test_size, random_state=random_state, stratify=stratify)
 
-    stratify = y if y.nunique() < 50 else None
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=test_size, random_state=random_state, stratify=stratify
-    )
 
+def _fit_and_evaluate(
+    model: Any,
+    X_train: pd.DataFrame,
+    X_test: pd.DataFrame,
+    y: np.ndarray,
+    train_pos: np.ndarray,
+    test_pos: np.ndarray,
+    features: List[str],
+    target_col: str,
+    report: Callable[[str], None],
+    timer: StageTimer,
+) -> Tuple[object, Dict[str, float], List[str], str, np.ndarray, np.ndarray, Optional[np.ndarray], Dict[str, Any]]:
+    y_train, y_test = y[train_pos], y[test_pos]
+
+    report("fit")
+    timer.mark("fit")
     model.fit(X_train, y_train)
 
+    report("evaluate")
+    timer.mark("predict")
     y_pred = model.predict(X_test)
-    average = "binary" if y.nunique() == 2 else "macro"
-    metrics = {
-        "accuracy": float(accuracy_score(y_test, y_pred)),
-        "precision": float(precision_score(y_test, y_pred, zero_division=0, average=average)),
-        "recall": float(recall_score(y_test, y_pred, zero_division=0, average=average)),
-        "f1Score": float(f1_score(y_test, y_pred, zero_division=0, average=average)),
-    }
-
-    y_score: Optional[List[float]] = None
-    try:
-        # Prefer predict_proba for binary
-        if hasattr(model, "predict_proba"):
-            proba = model.predict_proba(X_test)
-            if proba.shape[1] >= 2:
-                y_score = proba[:, 1].tolist()
-        elif hasattr(model, "decision_function"):
-            scores = model.decision_function(X_test)
-            # Normalize to 0-1 range roughly
-            import numpy as np  # type: ignore
-            scores = (scores - scores.min()) / (scores.max() - scores.min() + 1e-9)
-            y_score = scores.tolist()
-    except Exception:
-        y_score = None
+    timer.mark("score")
+    y_score = positive_scores(model, X_test)
+    timer.mark("metrics")
+    # confusion matrix, metrics and binned ROC/PR curves in one pass over the test set
+    classes = getattr(model, "classes_", None)
+    evaluation = Evaluation(np.unique(y) if classes is None else classes).add(y_test, y_pred, y_score).bundle()
+    timer.stop()
+
+    return model, evaluation["metrics"], features, target_col, y_test, np.asarray(y_pred), y_score, evaluation
+
 
-    return model, metrics, list(X.columns), target_col, y_test.tolist(), y_pred.tolist(), y_score
+def update_model(model: object, algorithm: str, X: pd.DataFrame, y: pd.Series, random_state: int = 42) -> object:
+    """Return a copy of a fitted model updated with the new rows only.
+
+    SGD models update the scaler's running mean/variance, then call ``partial_fit``.
+    Boosted models get ``INCREMENTAL_BOOST_ROUNDS`` more trees fitted on the new rows.
+    ``sklearn_logreg`` has no incremental fit (a warm-started lbfgs fit converges to
+    the optimum of the new rows alone), so its models are not updated.
+    """
+    if algorithm == "sklearn_logreg":
+        raise TrainingError("sklearn_logreg models cannot be updated incrementally; train sklearn_sgd to update with partial_fit")
+    classes = list(getattr(model, "classes_", []))
+    seen = set(pd.unique(y).tolist())
+    unknown = seen - set(classes)
+    if unknown:
+        raise TrainingError(f"Update contains labels the model was not trained on: {sorted(unknown)}")
+    if algorithm != "sklearn_sgd" and len(seen) < len(classes):
+        raise TrainingError(f"Updating a {algorithm} model needs rows of every class; use sklearn_sgd for partial batches")
+    # same float32 layout the model was trained on
+    X = feature_frame(np.ascontiguousarray(X.to_numpy(dtype=np.float32)), list(X.columns))
+    y = np.asarray(y)
+
+    if algorithm == "sklearn_sgd":
+        model = copy.deepcopy(model)
+        scaler, clf = model.named_steps["scaler"], model.named_steps["clf"]
+        scaler.partial_fit(X)
+        clf.partial_fit(scaler.transform(X), y, classes=clf.classes_)
+        return model
+
+    updated = build_estimator(algorithm, random_state)
+    updated.set_params(n_estimators=INCREMENTAL_BOOST_ROUNDS)
+    if algorithm == "xgboost":
+        updated.fit(X, y, xgb_model=model.get_booster())
+    elif algorithm == "lightgbm":
+        updated.fit(X, y, init_model=model.booster_)
+    else:
+        raise TrainingError(f"Cannot update {algorithm} models incrementally")
+    return updated
 
 
 def save_model(model: object, path: str) -> None:
+    import joblib
+
     joblib.dump(model, path)
 
 
-def load_model(path: str) -> object:
-    return joblib.load(path)
+def load_model(path: str, mmap_mode: str | None = None) -> object:
+    import joblib
+
+    return joblib.load(path, mmap_mode=mmap_mode)
+
+
+def export_scorer(
+    model: object,
+    algorithm: str,
+    features: List[str],
+    path: Path,
+    sample: Any = None,
+) -> Dict[str, Any]:
+    """Compile ``model`` into a NumPy scorer at ``path`` if it reproduces the model's probabilities.
+
+    The parity check scores up to ``SCORER_PARITY_ROWS`` rows of ``sample`` plus generated
+    probes (split thresholds and their neighbours, for trees). Returns what was written,
+    or the reason nothing was.
+    """
+    try:
+        scorer = compile_scorer(model, algorithm, len(features))
+    except UnsupportedModel as e:
+        return {"error": f"not compiled: {e}"}
+
+    X = scorer.probe_rows(SCORER_PARITY_ROWS, len(features), np.random.default_rng(0))
+    if sample is not None and len(sample):
+        X = np.vstack([np.asarray(sample, dtype=np.float32)[:SCORER_PARITY_ROWS], X])
+    expected = np.asarray(model.predict_proba(feature_frame(X, features)), dtype=np.float64)
+    diff = float(np.abs(expected - scorer.predict_proba(X)).max())
+    if not diff <= SCORER_PARITY_TOL:
+        return {"error": f"parity check failed: max abs difference {diff:.3g}", "max_abs_diff": diff}
+
+    save_scorer(scorer, path)
+    return {"path": path.name, "kind": scorer.kind, "max_abs_diff": diff}
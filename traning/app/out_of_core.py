@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.dataset import DatasetChunks
+from app.evaluation import Evaluation
+from app.lazy import optional_import
+from app.metrics import StageTimer
+from app.modeling import TrainingError, build_estimator, feature_frame
+from app.profiling import infer_target, numeric_columns
+
+# memory the training process may use for chunks and matrices; larger datasets train out of core
+TRAIN_MEMORY_BUDGET_MB = float(os.environ.get("TRAIN_MEMORY_BUDGET_MB", "1024"))
+OUT_OF_CORE_EPOCHS = int(os.environ.get("OUT_OF_CORE_EPOCHS", "2"))
+# held-out predictions kept (reservoir-sampled) when raw test predictions are saved
+OUT_OF_CORE_EVAL_SAMPLE = int(os.environ.get("OUT_OF_CORE_EVAL_SAMPLE", "100000"))
+
+# in-memory training holds the downcast frame, the float32 matrix and the estimator's own copy
+IN_MEMORY_BYTES_PER_VALUE = 12
+# a chunk is held as a frame, a float32 matrix and a scaled copy at the same time
+CHUNK_BYTES_PER_VALUE = 16
+CHUNK_BUDGET_SHARE = 0.25
+
+# LogisticRegression cannot learn incrementally; out of core the linear path is SGD on log loss
+OUT_OF_CORE_ALGORITHMS = {"sklearn_logreg": "sklearn_sgd"}
+
+TRAIN, TEST = 1, 2
+
+
+def estimated_in_memory_mb(profile: Dict[str, Any], columns: Optional[List[str]]) -> float:
+    n_columns = len(columns) if columns else len(profile.get("columns") or {})
+    return (profile.get("records") or 0) * n_columns * IN_MEMORY_BYTES_PER_VALUE / (1024 * 1024)
+
+
+def chunk_rows_for(n_columns: int, budget_mb: float = TRAIN_MEMORY_BUDGET_MB) -> int:
+    budget = budget_mb * 1024 * 1024 * CHUNK_BUDGET_SHARE
+    return max(int(budget / (max(n_columns, 1) * CHUNK_BYTES_PER_VALUE)), 1000)
+
+
+def _hashed_holdout(rows: np.ndarray, test_size: float, seed: int) -> np.ndarray:
+    """Deterministic per-row coin flips (splitmix64 of row number and seed), the same on every pass."""
+    with np.errstate(over="ignore"):
+        z = rows.astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53) < test_size
+
+
+class _Reservoir:
+    """Uniform fixed-size sample of a stream of rows (algorithm R, a chunk at a time)."""
+
+    def __init__(self, size: int, seed: int) -> None:
+        self.size = max(size, 1)
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+        self.columns: Dict[str, np.ndarray] = {}
+
+    def add(self, **columns: np.ndarray) -> None:
+        n = next(iter(columns.values())).shape[0]
+        if n == 0:
+            return
+        if not self.columns:
+            self.columns = {k: np.empty(self.size, dtype=v.dtype) for k, v in columns.items()}
+        positions = self.seen + np.arange(n)
+        # fill the free slots first, then replace with probability size / (position + 1)
+        free = positions < self.size
+        slots = np.where(free, positions, self.rng.integers(0, positions + 1))
+        keep = slots < self.size
+        for k, v in columns.items():
+            self.columns[k][slots[keep]] = v[keep]
+        self.seen += n
+
+    def sample(self, key: str) -> np.ndarray:
+        return self.columns[key][: min(self.seen, self.size)] if self.columns else np.empty(0)
+
+
+class BoosterClassifier:
+    """A booster trained through the library's native (external-memory) API, with the
+    ``classes_`` / ``predict`` / ``predict_proba`` surface the rest of the app uses."""
+
+    def __init__(self, library: str, booster: Any, classes: np.ndarray, features: List[str]) -> None:
+        self.library = library
+        self.booster = booster
+        self.classes_ = np.asarray(classes)
+        self.feature_names_in_ = np.asarray(features, dtype=object)
+        self.n_features_in_ = len(features)
+
+    @property
+    def booster_(self) -> Any:
+        return self.booster
+
+    def get_booster(self) -> Any:
+        return self.booster
+
+    def predict_proba(self, X: Any) -> np.ndarray:
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+        if self.library == "xgboost":
+            raw = self.booster.inplace_predict(X)
+        else:
+            raw = self.booster.predict(X)
+        raw = np.asarray(raw, dtype=np.float64)
+        if raw.ndim == 1:
+            raw = np.column_stack([1 - raw, raw])
+        return raw
+
+    def predict(self, X: Any) -> np.ndarray:
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+class _ChunkStream:
+    """Per-chunk feature matrices and labels of one split, in a fixed row order."""
+
+    def __init__(
+        self,
+        source: DatasetChunks,
+        features: List[str],
+        target_col: str,
+        roles: Callable[[int, int], np.ndarray],
+        encode: Optional[np.ndarray],
+    ) -> None:
+        self.source = source
+        self.features = features
+        self.target_col = target_col
+        self.roles = roles
+        self.encode = encode
+        # single-slot cache: random access from the booster libraries is chunk-sequential
+        self._cached: Optional[Tuple[int, int, np.ndarray, np.ndarray]] = None
+
+    def _rows(self, offset: int, df: pd.DataFrame, role: int) -> np.ndarray:
+        valid = df[self.target_col].notna().to_numpy().copy()
+        for c in self.features:
+            valid &= df[c].notna().to_numpy()
+        valid &= self.roles(offset, df.shape[0]) == role
+        return np.flatnonzero(valid)
+
+    def labels(self, offset: int, df: pd.DataFrame, role: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if rows is None:
+            rows = self._rows(offset, df, role)
+        y = df[self.target_col].to_numpy()[rows]
+        return np.searchsorted(self.encode, y) if self.encode is not None else y
+
+    def prepare(self, offset: int, df: pd.DataFrame, role: int) -> Tuple[np.ndarray, np.ndarray]:
+        rows = self._rows(offset, df, role)
+        X = np.empty((rows.shape[0], len(self.features)), dtype=np.float32)
+        for j, c in enumerate(self.features):
+            X[:, j] = df[c].to_numpy()[rows]
+        return X, self.labels(offset, df, role, rows)
+
+    def __iter__(self) -> Iterator[Tuple[int, pd.DataFrame]]:
+        return iter(self.source)
+
+    def split(self, i: int, role: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self._cached is None or self._cached[:2] != (i, role):
+            X, y = self.prepare(i * self.source.chunk_rows, self.source.chunk(i), role)
+            self._cached = (i, role, X, y)
+        return self._cached[2], self._cached[3]
+
+
+def _fit_linear(stream: _ChunkStream, model: Any, classes: np.ndarray, random_state: int, report: Callable[[str], None]) -> Any:
+    scaler, clf = model.named_steps["scaler"], model.named_steps["clf"]
+    rng = np.random.default_rng(random_state)
+    for offset, df in stream:
+        X, _ = stream.prepare(offset, df, TRAIN)
+        if X.shape[0]:
+            scaler.partial_fit(feature_frame(X, stream.features))
+    report("fit")
+    for _ in range(max(OUT_OF_CORE_EPOCHS, 1)):
+        for offset, df in stream:
+            X, y = stream.prepare(offset, df, TRAIN)
+            if X.shape[0] == 0:
+                continue
+            order = rng.permutation(X.shape[0])
+            Xs = scaler.transform(feature_frame(X[order], stream.features))
+            clf.partial_fit(Xs, y[order], classes=classes)
+    return model
+
+
+def _fit_lightgbm(stream: _ChunkStream, model: Any, train_counts: List[int], labels: np.ndarray, n_classes: int) -> Any:
+    lgb = optional_import("lightgbm")
+
+    class Chunk(lgb.Sequence):
+        def __init__(self, i: int, rows: int) -> None:
+            self.i = i
+            self.rows = rows
+            self.batch_size = max(rows, 1)
+
+        def __len__(self) -> int:
+            return self.rows
+
+        def __getitem__(self, idx: Any) -> np.ndarray:
+            # LightGBM samples and pushes rows as float64
+            return np.asarray(stream.split(self.i, TRAIN)[0][idx], dtype=np.float64)
+
+    params = {
+        k: v for k, v in model.get_params().items()
+        if v is not None and k not in ("n_estimators", "class_weight", "importance_type")
+    }
+    params["objective"] = "binary" if n_classes == 2 else "multiclass"
+    if n_classes > 2:
+        params["num_class"] = n_classes
+    seqs = [Chunk(i, n) for i, n in enumerate(train_counts) if n]
+    dtrain = lgb.Dataset(seqs, label=labels, feature_name=stream.features, free_raw_data=True)
+    return lgb.train(params, dtrain, num_boost_round=model.n_estimators)
+
+
+def _fit_xgboost(stream: _ChunkStream, model: Any, train_counts: List[int], n_classes: int, cache_dir: str) -> Any:
+    xgb = optional_import("xgboost")
+    chunks = [i for i, n in enumerate(train_counts) if n]
+
+    class Chunks(xgb.DataIter):
+        def __init__(self) -> None:
+            super().__init__(cache_prefix=os.path.join(cache_dir, "train"))
+            self._pos = 0
+
+        def next(self, input_data: Callable) -> bool:
+            if self._pos == len(chunks):
+                return False
+            X, y = stream.split(chunks[self._pos], TRAIN)
+            input_data(data=feature_frame(X, stream.features), label=y)
+            self._pos += 1
+            return True
+
+        def reset(self) -> None:
+            self._pos = 0
+
+    params = model.get_xgb_params()
+    if n_classes > 2:
+        params.update(objective="multi:softprob", num_class=n_classes)
+    else:
+        params["objective"] = "binary:logistic"
+    matrix = getattr(xgb, "ExtMemQuantileDMatrix", None)
+    dtrain = matrix(Chunks()) if matrix is not None else xgb.DMatrix(Chunks())
+    return xgb.train(params, dtrain, num_boost_round=model.n_estimators)
+
+
+def _roles(
+    source: DatasetChunks,
+    test_size: float,
+    random_state: int,
+    windows: Optional[Tuple[np.ndarray, np.ndarray]],
+) -> Callable[[int, int], np.ndarray]:
+    if windows is not None:
+        # one byte per row marks the training and testing windows
+        assignment = np.zeros(source.rows, dtype=np.uint8)
+        assignment[windows[0]] = TRAIN
+        assignment[windows[1]] = TEST
+
+        def roles(offset: int, n: int) -> np.ndarray:
+            return assignment[offset:offset + n]
+    else:
+        def roles(offset: int, n: int) -> np.ndarray:
+            held_out = _hashed_holdout(np.arange(offset, offset + n), test_size, random_state)
+            return np.where(held_out, TEST, TRAIN).astype(np.uint8)
+    return roles
+
+
+def _evaluate(stream: _ChunkStream, model: Any, random_state: int) -> Tuple[Evaluation, _Reservoir]:
+    """Count every held-out row of the stream, keeping a reservoir sample of the predictions."""
+    model_classes = np.asarray(model.classes_)
+    evaluation = Evaluation(model_classes)
+    reservoir = _Reservoir(OUT_OF_CORE_EVAL_SAMPLE, random_state)
+    for offset, df in stream:
+        X, y = stream.prepare(offset, df, TEST)
+        if X.shape[0] == 0:
+            continue
+        proba = model.predict_proba(feature_frame(X, stream.features))
+        y_pred = model_classes[proba.argmax(axis=1)]
+        y_score = proba[:, 1] if proba.shape[1] == 2 else None
+        evaluation.add(y, y_pred, y_score)
+        columns_ = {"y_true": y, "y_pred": y_pred}
+        if y_score is not None:
+            columns_["y_score"] = y_score.astype(np.float32)
+        reservoir.add(**columns_)
+    if evaluation.counts.sum() == 0:
+        raise TrainingError("Hold-out set contains no usable rows")
+    return evaluation, reservoir
+
+
+def evaluate_out_of_core(
+    source: DatasetChunks,
+    model: Any,
+    features: List[str],
+    target_col: str,
+    test_size: float,
+    random_state: int,
+    windows: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Dict[str, Any]:
+    """Evaluation bundle of ``model`` on the hold-out set ``train_out_of_core`` used with the same arguments."""
+    # labels are compared as stored: models of non-numeric targets learned codes and cannot be updated
+    stream = _ChunkStream(source, features, target_col, _roles(source, test_size, random_state, windows), encode=None)
+    return _evaluate(stream, model, random_state)[0].bundle()
+
+
+def train_out_of_core(
+    source: DatasetChunks,
+    algorithm: str,
+    target: str | None,
+    test_size: float,
+    random_state: int,
+    profile: Dict[str, Any],
+    progress: Callable[[str], None] | None = None,
+    windows: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    timer: Optional[StageTimer] = None,
+) -> Tuple[object, Dict[str, float], List[str], str, np.ndarray, np.ndarray, Optional[np.ndarray], Dict[str, Any]]:
+    """Train from fixed-size chunks so memory is bounded by the chunk size, not the file.
+
+    The hold-out set is the testing window when ``windows`` is given, else a hashed
+    ``test_size`` share of rows. The evaluation bundle counts every held-out row;
+    the returned labels and scores are a reservoir sample of them. Returns what
+    ``train_prepared`` returns.
+    """
+    report = progress or (lambda stage: None)
+    timer = timer or StageTimer()
+    if algorithm in OUT_OF_CORE_ALGORITHMS:
+        raise TrainingError(f"{algorithm} cannot be trained out of core; use {OUT_OF_CORE_ALGORITHMS[algorithm]}")
+
+    report("split")
+    columns = profile.get("columns") or {}
+    target_col = target or profile.get("target_column") or infer_target(list(columns))
+    if target_col not in columns:
+        raise TrainingError(f"Target column '{target_col}' not found in dataset")
+    features = [c for c in numeric_columns(profile) if c != target_col]
+    if not features:
+        raise TrainingError("No numeric feature columns found for training")
+
+    roles = _roles(source, test_size, random_state, windows)
+
+    # first pass: the label set, and which rows of each chunk are usable for training
+    timer.mark("scan")
+    stream = _ChunkStream(source, features, target_col, roles, encode=None)
+    seen: set = set()
+    train_counts: List[int] = []
+    train_labels: List[np.ndarray] = []
+    boosted = algorithm in ("xgboost", "lightgbm")
+    for offset, df in stream:
+        y_train = stream.labels(offset, df, TRAIN)
+        y_test = stream.labels(offset, df, TEST)
+        seen.update(pd.unique(y_train).tolist())
+        seen.update(pd.unique(y_test).tolist())
+        train_counts.append(int(y_train.shape[0]))
+        if boosted:
+            train_labels.append(y_train)
+    if len(seen) < 2:
+        raise TrainingError("Target must have at least two classes for classification")
+    if sum(train_counts) == 0:
+        raise TrainingError("No usable training rows")
+
+    raw_classes = np.array(sorted(seen))
+    numeric = raw_classes.dtype.kind in "biuf"
+    # non-numeric targets become integer codes, as in select_rows
+    classes = raw_classes if numeric else np.arange(raw_classes.shape[0])
+    label_codes = None if numeric else raw_classes
+    model = build_estimator(algorithm, random_state)
+
+    timer.mark("fit")
+    if algorithm == "sklearn_sgd":
+        stream.encode = label_codes
+        model = _fit_linear(stream, model, classes, random_state, report)
+    elif algorithm in ("lightgbm", "xgboost"):
+        report("fit")
+        # the native APIs take labels as 0..k-1
+        stream.encode = raw_classes
+        if algorithm == "lightgbm":
+            labels = np.searchsorted(raw_classes, np.concatenate(train_labels))
+            del train_labels
+            booster = _fit_lightgbm(stream, model, train_counts, labels, classes.shape[0])
+        else:
+            with tempfile.TemporaryDirectory(prefix="xgb-extmem-") as cache_dir:
+                booster = _fit_xgboost(stream, model, train_counts, classes.shape[0], cache_dir)
+        model = BoosterClassifier(algorithm, booster, classes, features)
+    else:
+        raise TrainingError(f"Unknown algorithm: {algorithm}")
+
+    report("evaluate")
+    timer.mark("evaluate")
+    stream.encode = label_codes
+    evaluation, reservoir = _evaluate(stream, model, random_state)
+    timer.stop()
+
+    bundle = evaluation.bundle()
+    y_score = reservoir.sample("y_score") if "y_score" in reservoir.columns else None
+    return (
+        model,
+        bundle["metrics"],
+        features,
+        target_col,
+        reservoir.sample("y_true"),
+        reservoir.sample("y_pred"),
+        y_score,
+        bundle,
+    )
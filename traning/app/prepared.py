@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.storage import DATA_DIR, load_arrays, load_json, save_arrays, save_json
+
+PREPARED_DIR = DATA_DIR / "prepared"
+# disk budget for cached feature matrices, least recently used evicted first (0 disables the cache)
+PREPARED_CACHE_MB = float(os.environ.get("PREPARED_CACHE_MB", "2048"))
+# bump whenever row selection, target handling or the matrix layout changes
+PREP_VERSION = 1
+
+_lock = threading.Lock()
+
+
+class PreparedData:
+    """A training matrix ready to fit: X (float32, memory-mapped when read from the cache),
+    labels, the testing-window flag of each row, the target name and the feature columns.
+    ``cached`` is True when it was found in the cache rather than prepared by this call."""
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        y: np.ndarray,
+        is_test: Optional[np.ndarray],
+        target_col: str,
+        features: List[str],
+        cached: bool = False,
+    ) -> None:
+        self.X = X
+        self.y = y
+        self.is_test = is_test
+        self.target_col = target_col
+        self.features = features
+        self.cached = cached
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.X.nbytes + self.y.nbytes)
+
+
+def prepared_key(dataset_hash: str, target: Optional[str], windows: Optional[Tuple[np.ndarray, np.ndarray]]) -> str:
+    """Cache key: dataset content, requested target, preparation version and the rows selected.
+
+    The testing/training windows are part of the key because the rows in the matrix
+    (and a synthesized target) depend on them; a random split keeps every usable row.
+    """
+    digest = hashlib.sha256(json.dumps([PREP_VERSION, dataset_hash, target or ""]).encode())
+    if windows is not None:
+        for rows in windows:
+            digest.update(b"|")
+            digest.update(np.ascontiguousarray(rows, dtype=np.int64).tobytes())
+    return digest.hexdigest()[:32]
+
+
+def _paths(key: str) -> Tuple[Path, Path]:
+    return PREPARED_DIR / f"{key}.npz", PREPARED_DIR / f"{key}.json"
+
+
+def load_prepared(key: str) -> Optional[PreparedData]:
+    """The cached matrix for ``key``, memory-mapped, or None on a miss."""
+    if PREPARED_CACHE_MB <= 0:
+        return None
+    arrays_path, meta_path = _paths(key)
+    # the metadata is written last, so its presence marks a complete entry
+    meta = load_json(meta_path)
+    if not meta or meta.get("version") != PREP_VERSION:
+        return None
+    try:
+        arrays = load_arrays(arrays_path)
+        os.utime(meta_path)
+    except (OSError, ValueError):
+        return None
+    if "X" not in arrays or "y" not in arrays:
+        return None
+    return PreparedData(arrays["X"], arrays["y"], arrays.get("is_test"), meta["target"], meta["features"], cached=True)
+
+
+def save_prepared(key: str, data: PreparedData) -> PreparedData:
+    """Write ``data`` under ``key`` and return it re-opened from disk, so the in-memory
+    matrix can be dropped; returns ``data`` itself when it cannot or need not be cached."""
+    if PREPARED_CACHE_MB <= 0 or data.nbytes > PREPARED_CACHE_MB * 1024 * 1024 or data.y.dtype.hasobject:
+        return data
+    arrays_path, meta_path = _paths(key)
+    arrays: Dict[str, Any] = {"X": data.X, "y": data.y}
+    if data.is_test is not None:
+        arrays["is_test"] = data.is_test
+    try:
+        save_arrays(arrays_path, arrays)
+        save_json(meta_path, {
+            "version": PREP_VERSION,
+            "target": data.target_col,
+            "features": data.features,
+            "rows": int(data.X.shape[0]),
+        })
+    except OSError:
+        return data
+    evict(keep=key)
+    reopened = load_prepared(key)
+    if reopened is None:
+        return data
+    reopened.cached = False
+    return reopened
+
+
+def evict(keep: Optional[str] = None) -> List[str]:
+    """Remove least recently used entries until the cache fits ``PREPARED_CACHE_MB``."""
+    budget = PREPARED_CACHE_MB * 1024 * 1024
+    removed: List[str] = []
+    with _lock:
+        entries = []
+        for meta_path in PREPARED_DIR.glob("*.json"):
+            arrays_path = meta_path.with_suffix(".npz")
+            try:
+                entries.append((meta_path.stat().st_mtime, meta_path.stem, arrays_path.stat().st_size))
+            except OSError:
+                continue
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= budget:
+                break
+            if key == keep:
+                continue
+            arrays_path, meta_path = _paths(key)
+            meta_path.unlink(missing_ok=True)
+            arrays_path.unlink(missing_ok=True)
+            total -= size
+            removed.append(key)
+    return removed
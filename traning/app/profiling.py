@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import os
+import warnings
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+from app.storage import DATA_DIR
+
+PROFILE_PATH = DATA_DIR / "profile.json"
+
+PROFILE_SAMPLE_ROWS = int(os.environ.get("PROFILE_SAMPLE_ROWS", "10000"))
+# share of non-null sample values that must parse before a column counts as a timestamp
+DATETIME_MIN_PARSED = 0.9
+
+TARGET_CANDIDATES = ["target", "label", "y", "class", "passed", "pass", "is_pass"]
+POSITIVE_LABELS = ["1", "true", "pass"]
+
+
+def infer_target(columns: List[str]) -> Optional[str]:
+    for c in TARGET_CANDIDATES:
+        if c in columns:
+            return c
+    return columns[-1] if columns else None
+
+
+def _column_kind(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series):
+        return "boolean"
+    if pd.api.types.is_numeric_dtype(series):
+        return "numeric"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    return "categorical"
+
+
+def _sniff_datetime(series: pd.Series) -> Optional[Dict[str, Any]]:
+    """Check a bounded sample of a text column; return its datetime format if it parses."""
+    values = series.dropna()
+    if values.empty:
+        return None
+    fmt = guess_datetime_format(str(values.iloc[0]))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        parsed = pd.to_datetime(values, errors="coerce", format=fmt)
+    if parsed.notna().mean() < DATETIME_MIN_PARSED:
+        return None
+    return {"format": fmt}
+
+
+def parse_datetime(series: pd.Series, fmt: Optional[str] = None) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return pd.to_datetime(series, errors="coerce", format=fmt)
+
+
+class DatasetProfiler:
+    """Infers column roles from the first rows, then confirms them over every chunk.
+
+    Only the sampled rows are tried as dates; the full pass parses the chosen
+    timestamp column alone and accumulates row, null and pass counts.
+    """
+
+    def __init__(self, sample_rows: int = PROFILE_SAMPLE_ROWS) -> None:
+        self.sample_rows = sample_rows
+        self.records = 0
+        self.columns: List[str] = []
+        self.kinds: Dict[str, str] = {}
+        self.nulls: Dict[str, int] = {}
+        self.time_column: Optional[str] = None
+        self.time_format: Optional[str] = None
+        self.time_min: Optional[pd.Timestamp] = None
+        self.time_max: Optional[pd.Timestamp] = None
+        self.target_column: Optional[str] = None
+        self.positive = 0
+
+    def _infer(self, sample: pd.DataFrame) -> None:
+        self.columns = [str(c) for c in sample.columns]
+        self.kinds = {c: _column_kind(sample[c]) for c in self.columns}
+        self.nulls = {c: 0 for c in self.columns}
+        self.target_column = infer_target(self.columns)
+        for col in self.columns:
+            kind = self.kinds[col]
+            if kind == "datetime":
+                self.time_column = col
+                break
+            if kind != "categorical":
+                continue
+            sniffed = _sniff_datetime(sample[col])
+            if sniffed is not None:
+                self.kinds[col] = "datetime"
+                self.time_column = col
+                self.time_format = sniffed["format"]
+                break
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        if not self.columns:
+            self._infer(chunk.head(self.sample_rows))
+        self.records += int(chunk.shape[0])
+
+        for col in self.columns:
+            series = chunk[col]
+            self.nulls[col] += int(series.isna().sum())
+            if self.kinds[col] in ("numeric", "boolean") and _column_kind(series) != self.kinds[col]:
+                self.kinds[col] = "categorical"
+
+        if self.target_column in TARGET_CANDIDATES:
+            col = chunk[self.target_column]
+            try:
+                if col.dtype != "object":
+                    self.positive += int((col == 1).sum())
+                else:
+                    self.positive += int(col.astype(str).str.lower().isin(POSITIVE_LABELS).sum())
+            except Exception:
+                pass
+
+        if self.time_column is not None:
+            parsed = parse_datetime(chunk[self.time_column], self.time_format)
+            if parsed.notna().any():
+                lo, hi = parsed.min(), parsed.max()
+                self.time_min = lo if self.time_min is None else min(lo, self.time_min)
+                self.time_max = hi if self.time_max is None else max(hi, self.time_max)
+
+    def profile(self) -> Dict[str, Any]:
+        time_column = self.time_column if self.time_min is not None else None
+        records = max(self.records, 1)
+        return {
+            "records": self.records,
+            "time_column": time_column,
+            "time_format": self.time_format if time_column else None,
+            "target_column": self.target_column,
+            "columns": {
+                c: {
+                    "kind": self.kinds[c] if c != self.time_column or time_column else "categorical",
+                    "null_rate": round(self.nulls[c] / records, 6),
+                }
+                for c in self.columns
+            },
+        }
+
+    def metadata(self, file_name: str, file_size: int) -> Dict[str, Any]:
+        n_cols = len(self.columns)
+        pass_rate = 0
+        if self.target_column in TARGET_CANDIDATES:
+            pass_rate = int(round(100 * self.positive / max(self.records, 1)))
+        has_dates = self.time_min is not None
+        return {
+            "fileName": file_name,
+            "fileSize": f"{file_size / (1024*1024):.2f} MB",
+            "records": self.records,
+            "features": n_cols - 1 if n_cols > 0 else 0,
+            "passRate": pass_rate,
+            "dateRange": {
+                "start": str(self.time_min.date()) if has_dates else "",
+                "end": str(self.time_max.date()) if has_dates else "",
+            },
+        }
+
+
+def numeric_columns(profile: Dict[str, Any]) -> List[str]:
+    return [c for c, info in (profile.get("columns") or {}).items() if info.get("kind") == "numeric"]
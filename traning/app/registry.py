@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.modeling import export_scorer, load_model, save_model
+from app.scorer import load_scorer
+from app.storage import MODELS_DIR, state
+
+REGISTRY_PATH = MODELS_DIR / "registry.json"
+
+MODEL_CACHE_SIZE = int(os.environ.get("MODEL_CACHE_SIZE", "4"))
+# models larger than this are memory-mapped instead of copied into RAM (0 disables)
+MODEL_MMAP_THRESHOLD_MB = float(os.environ.get("MODEL_MMAP_THRESHOLD_MB", "0"))
+
+
+class ModelNotFoundError(KeyError):
+    pass
+
+
+def make_model_id(algorithm: str, dataset_hash: str, created_at: datetime) -> str:
+    return f"{algorithm}-{dataset_hash[:12]}-{created_at.strftime('%Y%m%dT%H%M%S%fZ')}"
+
+
+class ModelRegistry:
+    """Versioned model artifacts on disk plus an LRU cache of loaded models.
+
+    The index lives in the shared state store, so every API worker sees the same models.
+    """
+
+    def __init__(self, root: Path, index_path: Path, cache_size: int = MODEL_CACHE_SIZE) -> None:
+        self.root = root
+        self.index_path = index_path
+        self.cache_size = max(cache_size, 0)
+        self._cache: "OrderedDict[str, object]" = OrderedDict()
+        self._scorers: Dict[str, object] = {}
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._index_version = 0
+        self._lock = threading.RLock()
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        # the index grows with every version: parse it again only when some worker wrote it
+        version = state.version(self.index_path)
+        if not version or version != self._index_version:
+            self._index = self._adopt_legacy(state.get(self.index_path))
+            self._index_version = version
+        return self._index
+
+    def _adopt_legacy(self, index: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        if not index and not state.version(self.index_path):
+            # adopt artifacts written before the registry existed
+            for path in sorted(self.root.glob("*.joblib")):
+                index[path.stem] = {
+                    "model_id": path.stem,
+                    "algorithm": path.stem,
+                    "dataset_hash": "",
+                    "created_at": datetime.fromtimestamp(path.stat().st_mtime, timezone.utc).isoformat(),
+                    "path": path.name,
+                }
+        return index
+
+    def path_for(self, model_id: str) -> Path:
+        return self.root / self.get(model_id)["path"]
+
+    def save_artifact(
+        self,
+        model: object,
+        algorithm: str,
+        dataset_hash: str,
+        sample: Any = None,
+        **info: Any,
+    ) -> Dict[str, Any]:
+        """Write the model under a new id and return its entry without indexing it.
+
+        Training workers call this; the API process indexes the entry with ``add``.
+        A compiled NumPy scorer is exported next to the model when it passes the
+        parity check on ``sample`` (rows of the model's features).
+        """
+        created_at = datetime.now(timezone.utc)
+        model_id = make_model_id(algorithm, dataset_hash, created_at)
+        path = self.root / f"{model_id}.joblib"
+        save_model(model, str(path))
+        if info.get("features"):
+            info["scorer"] = export_scorer(
+                model, algorithm, info["features"], self.root / f"{model_id}.scorer.npz", sample,
+            )
+
+        return {
+            "model_id": model_id,
+            "algorithm": algorithm,
+            "dataset_hash": dataset_hash,
+            "created_at": created_at.isoformat(),
+            "path": path.name,
+            "size_bytes": path.stat().st_size,
+            **info,
+        }
+
+    def add(self, entry: Dict[str, Any], model: Optional[object] = None) -> None:
+        def insert(index: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+            index = self._adopt_legacy(index)
+            index[entry["model_id"]] = entry
+            return index
+
+        with self._lock:
+            state.update(self.index_path, insert)
+            if model is not None:
+                self._put(entry["model_id"], model)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._load_index().values())
+        return sorted(entries, key=lambda e: e.get("created_at", ""), reverse=True)
+
+    def get(self, model_id: str) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._load_index().get(model_id)
+        if entry is None:
+            raise ModelNotFoundError(model_id)
+        return entry
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        entries = self.list()
+        return entries[0] if entries else None
+
+    def delete(self, model_id: str) -> Dict[str, Any]:
+        removed: Dict[str, Dict[str, Any]] = {}
+
+        def remove(index: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+            index = self._adopt_legacy(index)
+            if model_id not in index:
+                raise ModelNotFoundError(model_id)
+            removed["entry"] = index.pop(model_id)
+            return index
+
+        with self._lock:
+            state.update(self.index_path, remove)
+            entry = removed["entry"]
+            self._cache.pop(model_id, None)
+            self._scorers.pop(model_id, None)
+        (self.root / entry["path"]).unlink(missing_ok=True)
+        scorer_path = (entry.get("scorer") or {}).get("path")
+        if scorer_path:
+            (self.root / scorer_path).unlink(missing_ok=True)
+        return entry
+
+    def load(self, model_id: str, mmap: Optional[bool] = None) -> object:
+        """Return the deserialized model, loading it from disk at most once while cached."""
+        with self._lock:
+            if model_id in self._cache:
+                self._cache.move_to_end(model_id)
+                return self._cache[model_id]
+
+        path = self.path_for(model_id)
+        if not path.exists():
+            raise ModelNotFoundError(model_id)
+        if mmap is None:
+            mmap = MODEL_MMAP_THRESHOLD_MB > 0 and path.stat().st_size > MODEL_MMAP_THRESHOLD_MB * 1024 * 1024
+        model = load_model(str(path), mmap_mode="r" if mmap else None)
+
+        with self._lock:
+            self._put(model_id, model)
+        return model
+
+    def load_scorer(self, model_id: str) -> Optional[object]:
+        """The model's compiled NumPy scorer, or None when it was not exported."""
+        with self._lock:
+            if model_id in self._scorers:
+                return self._scorers[model_id]
+        scorer_path = (self.get(model_id).get("scorer") or {}).get("path")
+        scorer = None
+        if scorer_path and (self.root / scorer_path).exists():
+            scorer = load_scorer(self.root / scorer_path)
+        with self._lock:
+            # scorers are a few KB to a few MB; they stay loaded until the model is deleted
+            self._scorers[model_id] = scorer
+        return scorer
+
+    def cached_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._cache.keys())
+
+    def _put(self, model_id: str, model: object) -> None:
+        if self.cache_size == 0:
+            return
+        self._cache[model_id] = model
+        self._cache.move_to_end(model_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+registry = ModelRegistry(MODELS_DIR, REGISTRY_PATH)
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+RENDER_CACHE_ENTRIES = int(os.environ.get("RENDER_CACHE_ENTRIES", "32"))
+RENDER_CACHE_MB = float(os.environ.get("RENDER_CACHE_MB", "32"))
+
+
+def render_key(*parts: Any) -> str:
+    """Content address for a chart: a hash of everything its pixels depend on."""
+    blob = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+class RenderCache:
+    """Bounded LRU of rendered images, served with strong ETags."""
+
+    def __init__(self, max_entries: int = RENDER_CACHE_ENTRIES, max_bytes: int = int(RENDER_CACHE_MB * 1024 * 1024)) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(key: str) -> str:
+        return f'"{key}"'
+
+    def _not_modified(self, request: Request, key: str) -> bool:
+        header = request.headers.get("if-none-match")
+        if not header:
+            return False
+        tags = [t.strip() for t in header.split(",")]
+        return "*" in tags or self.etag(key) in tags
+
+    def lookup(self, request: Request, key: str, media_type: str = "image/png") -> Optional[Response]:
+        """A 304 or cached response for ``key``, or None when it has to be rendered."""
+        if self._not_modified(request, key):
+            return Response(status_code=304, headers=self._headers(key))
+        with self._lock:
+            content = self._items.get(key)
+            if content is None:
+                return None
+            self._items.move_to_end(key)
+        return Response(content=content, media_type=media_type, headers=self._headers(key))
+
+    def store(self, key: str, content: bytes, media_type: str = "image/png") -> Response:
+        with self._lock:
+            if key not in self._items and len(content) <= self.max_bytes:
+                self._items[key] = content
+                self._size += len(content)
+                while len(self._items) > self.max_entries or self._size > self.max_bytes:
+                    _, evicted = self._items.popitem(last=False)
+                    self._size -= len(evicted)
+        return Response(content=content, media_type=media_type, headers=self._headers(key))
+
+    def _headers(self, key: str) -> dict:
+        # clients may keep the image but must revalidate, which is a cheap 304
+        return {"ETag": self.etag(key), "Cache-Control": "no-cache"}
+
+
+render_cache = RenderCache()
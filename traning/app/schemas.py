@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Literal, List
+from typing import Dict, Optional, Literal, List
 
 
 class DatasetInfo(BaseModel):
@@ -9,6 +9,8 @@ class DatasetInfo(BaseModel):
     features: int
     passRate: int = Field(0, ge=0, le=100)
     dateRange: dict
+    # content-hash id in the dataset store
+    datasetId: Optional[str] = None
 
 
 class DateRangePeriod(BaseModel):
@@ -24,10 +26,29 @@ class DateRanges(BaseModel):
 
 
 class TrainRequest(BaseModel):
-    model: Literal["sklearn_logreg", "xgboost", "lightgbm"] = "sklearn_logreg"
+    model: Literal["sklearn_logreg", "sklearn_sgd", "xgboost", "lightgbm"] = "sklearn_logreg"
     target: Optional[str] = None
     test_size: float = Field(0.2, gt=0, lt=1)
     random_state: int = 42
+    # "date_ranges" fits on the training window and evaluates on the testing window;
+    # "auto" does so whenever both windows contain rows, else splits at random
+    split: Literal["auto", "random", "date_ranges"] = "auto"
+    # stream the dataset in chunks instead of loading it; None decides from TRAIN_MEMORY_BUDGET_MB
+    out_of_core: Optional[bool] = None
+    # stored dataset to train on; None uses the current (last uploaded) one
+    dataset_id: Optional[str] = None
+
+
+class TournamentRequest(BaseModel):
+    models: List[Literal["sklearn_logreg", "sklearn_sgd", "xgboost", "lightgbm"]] = Field(
+        default_factory=lambda: ["sklearn_logreg", "xgboost", "lightgbm"], min_length=1
+    )
+    target: Optional[str] = None
+    cv_folds: int = Field(5, ge=2, le=20)
+    random_state: int = 42
+    # with date ranges in use only the training window is cross-validated
+    split: Literal["auto", "random", "date_ranges"] = "auto"
+    dataset_id: Optional[str] = None
 
 
 class TrainMetrics(BaseModel):
@@ -35,6 +56,8 @@ class TrainMetrics(BaseModel):
     precision: float
     recall: float
     f1Score: float
+    rocAuc: Optional[float] = None
+    averagePrecision: Optional[float] = None
     trainingData: str = ""
     validationData: str = ""
     simulationData: str = ""
@@ -46,3 +69,30 @@ class TrainResponse(BaseModel):
     metrics: TrainMetrics
     features: List[str]
     target: str
+    # resident memory of the training process, in MB
+    memory: Optional[Dict[str, Optional[float]]] = None
+    # wall seconds per training stage
+    stages: Optional[Dict[str, float]] = None
+    dataset_id: Optional[str] = None
+    # the requested model when another was trained (out of core, sklearn_logreg trains as sklearn_sgd)
+    requested_model: Optional[str] = None
+
+
+class LeaderboardEntry(BaseModel):
+    rank: Optional[int] = None
+    algorithm: str
+    metrics: Dict[str, float] = {}
+    metrics_std: Dict[str, float] = {}
+    fit_seconds: float = 0.0
+    predict_seconds: float = 0.0
+    error: Optional[str] = None
+
+
+class TournamentResponse(BaseModel):
+    target: str
+    features: List[str]
+    rows: int
+    cv_folds: int
+    wall_seconds: float
+    dataset_id: Optional[str] = None
+    leaderboard: List[LeaderboardEntry]
@@ -0,0 +1,448 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# Plain NumPy scorers compiled from trained models. Nothing here imports sklearn,
+# xgboost or lightgbm: compiling only reads attributes of an already-loaded model,
+# and scoring a saved scorer needs numpy alone.
+
+SCORER_FORMAT = 1
+
+# node comparison used to send a row to the left child
+_LESS = "lt"  # xgboost: x < threshold
+_LESS_EQUAL = "le"  # lightgbm: x <= threshold
+
+# missing input at a node: NaN is read as 0 / zero and NaN take the default branch / NaN does
+_MISSING_NONE, _MISSING_ZERO, _MISSING_NAN = 0, 1, 2
+_LGB_MISSING = {"None": _MISSING_NONE, "Zero": _MISSING_ZERO, "NaN": _MISSING_NAN}
+# lightgbm reads any input this close to zero as zero (kZeroThreshold, a float literal)
+_LGB_ZERO = float(np.float32(1e-35))
+
+_MAX_LEAVES = 64
+_ALL_LEAVES = np.uint64(2 ** 64 - 1)
+# (row, split) cells evaluated at once; bounds the scratch memory of large batches
+_TREE_CHUNK_CELLS = 1 << 20
+
+
+class UnsupportedModel(Exception):
+    pass
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    # same value as 1 / (1 + exp(-z)), without overflowing for large |z|
+    return 0.5 * (1.0 + np.tanh(0.5 * z))
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def _link(margin: np.ndarray, link: str) -> np.ndarray:
+    if margin.shape[1] == 1:
+        p = _sigmoid(margin[:, 0])
+        return np.column_stack([1 - p, p])
+    if link == "softmax":
+        return _softmax(margin)
+    # one-vs-rest: independent sigmoids, normalized
+    p = _sigmoid(margin)
+    return p / p.sum(axis=1, keepdims=True)
+
+
+class _Scorer:
+    kind = ""
+
+    def __init__(self, classes: List[Any], link: str, dtype: str) -> None:
+        self.classes_ = np.asarray(classes)
+        self.link = link
+        self.dtype = np.dtype(dtype)
+
+    def _rows(self, X: Any) -> np.ndarray:
+        X = np.asarray(X, dtype=self.dtype)
+        return X.reshape(1, -1) if X.ndim == 1 else X
+
+    def decision_function(self, X: Any) -> np.ndarray:
+        raise NotImplementedError
+
+    def predict_proba(self, X: Any) -> np.ndarray:
+        return _link(self.decision_function(X), self.link)
+
+    def predict(self, X: Any) -> np.ndarray:
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def probe_rows(self, n: int, n_features: int, rng: np.random.Generator) -> np.ndarray:
+        raise NotImplementedError
+
+    def _meta(self) -> Dict[str, Any]:
+        return {"format": SCORER_FORMAT, "kind": self.kind, "classes": self.classes_.tolist(), "link": self.link,
+                "dtype": self.dtype.name}
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        raise NotImplementedError
+
+
+class LinearScorer(_Scorer):
+    """A scaler folded into the linear model: ``X @ weights.T + bias``, all float32."""
+
+    kind = "linear"
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, classes: List[Any], link: str) -> None:
+        super().__init__(classes, link, "float32")
+        self.weights = np.ascontiguousarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+
+    def decision_function(self, X: Any) -> np.ndarray:
+        return self._rows(X) @ self.weights.T + self.bias
+
+    def probe_rows(self, n: int, n_features: int, rng: np.random.Generator) -> np.ndarray:
+        return rng.standard_normal((n, n_features)).astype(np.float32)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"weights": self.weights, "bias": self.bias}
+
+
+class TreeScorer(_Scorer):
+    """A tree ensemble flattened into arrays of split nodes, scored without walking the trees.
+
+    Leaves are numbered left to right within each tree (at most 64), and every split
+    holds a bitmask of the leaves that stay reachable when a row goes right. ANDing
+    the masks of all splits a row goes right at leaves the row's exit leaf as the
+    lowest set bit, so a batch costs a fixed number of array operations however deep
+    the trees are. ``bias`` holds each class's base margin.
+    """
+
+    kind = "trees"
+
+    def __init__(
+        self,
+        nodes: Dict[str, np.ndarray],
+        starts: np.ndarray,
+        leaf_value: np.ndarray,
+        tree_class: np.ndarray,
+        bias: np.ndarray,
+        decision: str,
+        classes: List[Any],
+        link: str,
+        dtype: str,
+    ) -> None:
+        super().__init__(classes, link, dtype)
+        self.feature = nodes["feature"].astype(np.intp)
+        # xgboost compares in float32; lightgbm compares the input, cast to double, against double thresholds
+        self.threshold = nodes["threshold"].astype(np.float32 if decision == _LESS else np.float64)
+        self.mask = nodes["mask"].astype(np.uint64)
+        self.default_left = nodes["default_left"].astype(bool)
+        self.missing = nodes["missing"].astype(np.int8)
+        self.starts = np.asarray(starts, dtype=np.intp)
+        self.leaf_value = np.asarray(leaf_value, dtype=np.float64)
+        self.tree_class = np.asarray(tree_class, dtype=np.intp)
+        self.bias = np.asarray(bias, dtype=np.float64)
+        self.decision = decision
+        n_trees = self.starts.shape[0]
+        # sums leaf values per class in one matmul
+        self._class_map = np.zeros((n_trees, self.bias.shape[0]))
+        self._class_map[np.arange(n_trees), self.tree_class] = 1.0
+        self._trees = np.arange(n_trees)
+        self._zero_missing = bool((self.missing == _MISSING_ZERO).any())
+        self._chunk_rows = max(1, _TREE_CHUNK_CELLS // max(self.feature.shape[0], 1))
+
+    def leaf_sum(self, X: Any) -> np.ndarray:
+        X = self._rows(X)
+        if self.decision == _LESS_EQUAL:
+            X = np.where(np.abs(X) <= _LGB_ZERO, 0, X)
+        out = np.empty((X.shape[0], self.bias.shape[0]))
+        for start in range(0, X.shape[0], self._chunk_rows):
+            stop = start + self._chunk_rows
+            out[start:stop] = self._leaf_sum(X[start:stop])
+        return out
+
+    def _leaf_sum(self, X: np.ndarray) -> np.ndarray:
+        x = X[:, self.feature]
+        missing = None
+        if self._zero_missing or np.isnan(x).any():
+            x, missing = self._missing(x)
+        right = x >= self.threshold if self.decision == _LESS else x > self.threshold
+        if missing is not None:
+            right = np.where(missing, ~self.default_left, right)
+        reachable = np.bitwise_and.reduceat(np.where(right, self.mask, _ALL_LEAVES), self.starts, axis=1)
+        exit_leaf = np.log2(reachable & (~reachable + np.uint64(1))).astype(np.intp)
+        return self.leaf_value[self._trees, exit_leaf] @ self._class_map
+
+    def _missing(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Input with NaN read as 0 where the node says so, and which cells take the default branch."""
+        nan = np.isnan(x)
+        missing = (nan & (self.missing != _MISSING_NONE)) | ((self.missing == _MISSING_ZERO) & (x == 0))
+        return np.where(nan, 0, x), missing
+
+    def decision_function(self, X: Any) -> np.ndarray:
+        return self.leaf_sum(X) + self.bias
+
+    def probe_rows(self, n: int, n_features: int, rng: np.random.Generator) -> np.ndarray:
+        """Rows made of split thresholds and their float neighbours, to exercise both sides of every split."""
+        X = np.zeros((n, n_features), dtype=self.dtype)
+        limit = np.finfo(self.dtype).max
+        for f in range(n_features):
+            cuts = self.threshold[self.feature == f]
+            cuts = np.clip(cuts[np.isfinite(cuts)], -limit, limit).astype(self.dtype)
+            if cuts.shape[0] == 0:
+                continue
+            picked = cuts[rng.integers(0, cuts.shape[0], n)]
+            step = rng.integers(-1, 2, n)
+            X[:, f] = np.where(step < 0, np.nextafter(picked, -np.inf), np.where(step > 0, np.nextafter(picked, np.inf), picked))
+        return X
+
+    def _meta(self) -> Dict[str, Any]:
+        return {**super()._meta(), "decision": self.decision}
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "mask": self.mask,
+            "default_left": self.default_left,
+            "missing": self.missing,
+            "starts": self.starts,
+            "leaf_value": self.leaf_value,
+            "tree_class": self.tree_class,
+            "bias": self.bias,
+        }
+
+
+# ---------------- compiling ----------------
+
+def _compile_linear(model: Any) -> LinearScorer:
+    steps = getattr(model, "named_steps", None) or {}
+    scaler, clf = steps.get("scaler"), steps.get("clf")
+    if clf is None or not hasattr(clf, "coef_"):
+        raise UnsupportedModel("expected a scaler + linear classifier pipeline")
+    coef = np.asarray(clf.coef_, dtype=np.float64)
+    intercept = np.asarray(clf.intercept_, dtype=np.float64)
+    mean = getattr(scaler, "mean_", None)
+    scale = getattr(scaler, "scale_", None)
+    weights = coef / scale if scale is not None else coef
+    bias = intercept - weights @ mean if mean is not None else intercept
+    link = "ovr" if type(clf).__name__ == "SGDClassifier" else "softmax"
+    return LinearScorer(weights, bias, np.asarray(clf.classes_).tolist(), link)
+
+
+class _NodeBuffer:
+    def __init__(self) -> None:
+        self.columns: Dict[str, List[Any]] = {
+            k: [] for k in ("feature", "threshold", "left", "right", "default_left", "missing", "value")
+        }
+
+    def __len__(self) -> int:
+        return len(self.columns["feature"])
+
+    def add(self, **node: Any) -> int:
+        for key, values in self.columns.items():
+            values.append(node[key])
+        return len(self) - 1
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {k: np.asarray(v) for k, v in self.columns.items()}
+
+
+def _xgboost_trees(booster: Any) -> Tuple[_NodeBuffer, List[int], List[int], int, str]:
+    learner = json.loads(booster.save_raw("json"))["learner"]
+    objective = learner["objective"]["name"]
+    if objective == "binary:logistic":
+        n_groups, link = 1, "softmax"
+    elif objective in ("multi:softprob", "multi:softmax"):
+        n_groups, link = int(learner["learner_model_param"]["num_class"]), "softmax"
+    else:
+        raise UnsupportedModel(f"xgboost objective {objective}")
+    model = learner["gradient_booster"].get("model")
+    if model is None:
+        raise UnsupportedModel("xgboost booster without trees")
+
+    buffer, roots = _NodeBuffer(), []
+    for tree in model["trees"]:
+        if any(int(t) != 0 for t in tree.get("split_type", [])):
+            raise UnsupportedModel("categorical xgboost splits")
+        left, right = tree["left_children"], tree["right_children"]
+        offset = len(buffer)
+        roots.append(offset)
+        for i, cond in enumerate(tree["split_conditions"]):
+            leaf = left[i] == -1
+            buffer.add(
+                feature=-1 if leaf else tree["split_indices"][i],
+                threshold=0.0 if leaf else cond,
+                left=offset + (i if leaf else left[i]),
+                right=offset + (i if leaf else right[i]),
+                default_left=bool(tree["default_left"][i]),
+                missing=_MISSING_NAN,
+                value=cond if leaf else 0.0,
+            )
+    tree_class = [int(c) for c in model.get("tree_info", [0] * len(roots))]
+    return buffer, roots, tree_class, n_groups, link
+
+
+def _lightgbm_trees(booster: Any) -> Tuple[_NodeBuffer, List[int], List[int], int, str]:
+    dump = booster.dump_model()
+    objective = str(dump.get("objective", ""))
+    name = objective.split(" ")[0]
+    if name == "binary":
+        n_groups = 1
+    elif name in ("multiclass", "softmax"):
+        n_groups = int(dump["num_class"])
+    else:
+        raise UnsupportedModel(f"lightgbm objective {objective}")
+    if dump.get("average_output"):
+        raise UnsupportedModel("lightgbm random forest mode")
+    sigmoid = 1.0
+    for part in objective.split(" ")[1:]:
+        if part.startswith("sigmoid:"):
+            sigmoid = float(part.split(":", 1)[1])
+    if sigmoid != 1.0:
+        raise UnsupportedModel(f"lightgbm sigmoid scale {sigmoid}")
+
+    buffer, roots, tree_class = _NodeBuffer(), [], []
+    per_iteration = int(dump.get("num_tree_per_iteration", n_groups))
+    for info in dump["tree_info"]:
+        roots.append(len(buffer))
+        tree_class.append(int(info["tree_index"]) % per_iteration)
+        _add_lightgbm_node(buffer, info["tree_structure"])
+    return buffer, roots, tree_class, n_groups, "softmax"
+
+
+def _add_lightgbm_node(buffer: _NodeBuffer, node: Dict[str, Any]) -> None:
+    """Append ``node`` and its subtree depth-first."""
+    if "split_index" not in node:
+        index = len(buffer)
+        buffer.add(feature=-1, threshold=0.0, left=index, right=index, default_left=True,
+                   missing=_MISSING_NONE, value=float(node.get("leaf_value", 0.0)))
+        return
+    if node.get("decision_type") != "<=":
+        raise UnsupportedModel(f"lightgbm split {node.get('decision_type')}")
+    index = buffer.add(
+        feature=int(node["split_feature"]),
+        threshold=float(node["threshold"]),
+        left=-1,
+        right=-1,
+        default_left=bool(node.get("default_left", True)),
+        missing=_LGB_MISSING.get(node.get("missing_type", "None"), _MISSING_NONE),
+        value=0.0,
+    )
+    buffer.columns["left"][index] = len(buffer)
+    _add_lightgbm_node(buffer, node["left_child"])
+    buffer.columns["right"][index] = len(buffer)
+    _add_lightgbm_node(buffer, node["right_child"])
+
+
+def _split_masks(
+    walk: Dict[str, np.ndarray], roots: List[int]
+) -> Tuple[Dict[str, np.ndarray], List[int], np.ndarray]:
+    """Turn linked trees into the split arrays of ``TreeScorer``: leaves numbered left
+    to right, and each split's mask clearing the leaves of its left subtree."""
+    splits: Dict[str, List[Any]] = {k: [] for k in ("feature", "threshold", "mask", "default_left", "missing")}
+    starts: List[int] = []
+    tree_leaves: List[List[float]] = []
+
+    def visit(i: int, leaves: List[float]) -> Tuple[int, int]:
+        if walk["feature"][i] < 0:
+            leaves.append(float(walk["value"][i]))
+            return len(leaves) - 1, len(leaves)
+        k = len(splits["feature"])
+        for key in ("feature", "threshold", "default_left", "missing"):
+            splits[key].append(walk[key][i])
+        splits["mask"].append(0)
+        lo, mid = visit(int(walk["left"][i]), leaves)
+        _, hi = visit(int(walk["right"][i]), leaves)
+        splits["mask"][k] = (2 ** 64 - 1) ^ ((1 << mid) - (1 << lo))
+        return lo, hi
+
+    for root in roots:
+        starts.append(len(splits["feature"]))
+        leaves: List[float] = []
+        visit(root, leaves)
+        if len(leaves) > _MAX_LEAVES:
+            raise UnsupportedModel(f"tree with {len(leaves)} leaves (at most {_MAX_LEAVES})")
+        if starts[-1] == len(splits["feature"]):
+            # a single-leaf tree still needs one split for reduceat; this one never clears a leaf
+            for key, value in (("feature", 0), ("threshold", np.inf), ("default_left", True),
+                               ("missing", _MISSING_NONE), ("mask", 2 ** 64 - 1)):
+                splits[key].append(value)
+        tree_leaves.append(leaves)
+
+    leaf_value = np.zeros((len(tree_leaves), max(len(v) for v in tree_leaves)))
+    for t, values in enumerate(tree_leaves):
+        leaf_value[t, :len(values)] = values
+    nodes = {k: np.asarray(v, dtype=np.uint64 if k == "mask" else None) for k, v in splits.items()}
+    return nodes, starts, leaf_value
+
+
+def _booster_margin(library: str, booster: Any, X: np.ndarray) -> np.ndarray:
+    if library == "xgboost":
+        margin = booster.inplace_predict(X, predict_type="margin")
+    else:
+        margin = booster.predict(X, raw_score=True)
+    margin = np.asarray(margin, dtype=np.float64)
+    return margin.reshape(X.shape[0], -1)
+
+
+def _compile_trees(model: Any, library: str, n_features: int) -> TreeScorer:
+    if library == "xgboost":
+        booster = model.get_booster()
+        buffer, roots, tree_class, n_groups, link = _xgboost_trees(booster)
+        dtype, decision = "float32", _LESS
+    else:
+        booster = getattr(model, "booster_", None)
+        if booster is None:
+            raise UnsupportedModel("lightgbm model without a booster")
+        buffer, roots, tree_class, n_groups, link = _lightgbm_trees(booster)
+        # models trained through the native API are scored on float32 input; sklearn ones on float64
+        dtype, decision = ("float32" if getattr(model, "library", None) else "float64"), _LESS_EQUAL
+
+    if not roots:
+        raise UnsupportedModel("booster without trees")
+    nodes, starts, leaf_value = _split_masks(buffer.arrays(), roots)
+    scorer = TreeScorer(nodes, np.asarray(starts), leaf_value, np.asarray(tree_class), np.zeros(n_groups),
+                        decision, np.asarray(model.classes_).tolist(), link, dtype)
+    # the base margin (base_score, boost_from_average) is whatever the trees do not explain
+    origin = np.zeros((1, n_features), dtype=np.float32)
+    scorer.bias = (_booster_margin(library, booster, origin) - scorer.leaf_sum(origin))[0]
+    return scorer
+
+
+def compile_scorer(model: Any, algorithm: str, n_features: int) -> _Scorer:
+    """Compile a trained model into a NumPy scorer; raises UnsupportedModel for anything else."""
+    if algorithm in ("sklearn_logreg", "sklearn_sgd"):
+        return _compile_linear(model)
+    if algorithm in ("xgboost", "lightgbm"):
+        return _compile_trees(model, algorithm, n_features)
+    raise UnsupportedModel(f"algorithm {algorithm}")
+
+
+# ---------------- storage ----------------
+
+def save_scorer(scorer: _Scorer, path: Path) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, meta=np.asarray(json.dumps(scorer._meta())), **scorer.arrays())
+    tmp.replace(path)
+
+
+def load_scorer(path: Path) -> _Scorer:
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data["meta"]))
+        arrays = {k: data[k] for k in data.files if k != "meta"}
+    if meta.get("format") != SCORER_FORMAT:
+        raise UnsupportedModel(f"scorer format {meta.get('format')}")
+    if meta["kind"] == LinearScorer.kind:
+        return LinearScorer(arrays["weights"], arrays["bias"], meta["classes"], meta["link"])
+    return TreeScorer(
+        arrays,
+        arrays["starts"],
+        arrays["leaf_value"],
+        arrays["tree_class"],
+        arrays["bias"],
+        meta["decision"],
+        meta["classes"],
+        meta["link"],
+        meta["dtype"],
+    )
@@ -0,0 +1,367 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.dataset import get_profile, load_dataset, load_window
+from app.dataset_store import DatasetNotFoundError, dataset_store
+from app.profiling import parse_datetime
+from app.registry import ModelNotFoundError, registry
+from app.storage import DATA_DIR, state
+
+TRAINING_METRICS_PATH = DATA_DIR / "training_metrics.json"
+SIM_STATE_PATH = DATA_DIR / "simulation_state.json"
+
+SIM_FLUSH_INTERVAL = float(os.environ.get("SIM_FLUSH_INTERVAL", "1.0"))
+# sample ids are reserved in blocks so a crash between flushes never reuses one,
+# and so several API workers hand out distinct ids without a write per sample
+SIM_ID_BLOCK = int(os.environ.get("SIM_ID_BLOCK", "1000"))
+
+SCORE_CHUNK_ROWS = 65536
+SENSOR_COLUMNS = ["temperature", "pressure", "humidity"]
+
+
+class SimulationError(Exception):
+    pass
+
+
+class SimulationEngine:
+    """Predictions for the simulation window, scored once and served by index."""
+
+    def __init__(
+        self,
+        times: Optional[np.ndarray],
+        predictions: np.ndarray,
+        confidence: np.ndarray,
+        sensors: Dict[str, Optional[np.ndarray]],
+    ) -> None:
+        self.times = times
+        self.predictions = predictions
+        self.confidence = confidence
+        self.sensors = sensors
+
+    def __len__(self) -> int:
+        return int(self.predictions.shape[0])
+
+    @classmethod
+    def build(
+        cls,
+        df: pd.DataFrame,
+        model: object,
+        features: List[str],
+        time_column: Optional[str] = None,
+        time_format: Optional[str] = None,
+    ) -> "SimulationEngine":
+        if not features:
+            raise SimulationError("Trained model has no recorded features")
+        missing = [f for f in features if f not in df.columns]
+        if missing:
+            raise SimulationError(f"Dataset is missing model features: {', '.join(missing)}")
+
+        times: Optional[pd.Series] = None
+        if time_column is not None and time_column in df.columns:
+            times = parse_datetime(df[time_column], time_format)
+
+        X = df[features]
+        valid = X.notna().all(axis=1).to_numpy()
+        X = X.loc[valid]
+        if X.shape[0] == 0:
+            raise SimulationError("No dataset rows fall in the simulation window")
+
+        predictions, confidence = _score(model, X)
+
+        sensors: Dict[str, Optional[np.ndarray]] = {}
+        lowered = {str(c).lower(): c for c in df.columns}
+        for name in SENSOR_COLUMNS:
+            col = lowered.get(name)
+            if col is not None and pd.api.types.is_numeric_dtype(df[col]):
+                sensors[name] = df[col].to_numpy(dtype=np.float64)[valid]
+            else:
+                sensors[name] = None
+
+        time_values = times.to_numpy()[valid] if times is not None else None
+        return cls(time_values, predictions, confidence, sensors)
+
+    def sample(self, index: int, sample_id: str) -> Dict[str, object]:
+        i = index % len(self)
+        if self.times is not None and not pd.isna(self.times[i]):
+            time = pd.Timestamp(self.times[i]).strftime("%H:%M:%S")
+        else:
+            time = datetime.now().strftime("%H:%M:%S")
+
+        temperature = self.sensors.get("temperature")
+        pressure = self.sensors.get("pressure")
+        humidity = self.sensors.get("humidity")
+        return {
+            "time": time,
+            "sampleId": sample_id,
+            "prediction": "Pass" if self.predictions[i] == 1 else "Fail",
+            "confidence": round(float(self.confidence[i]), 1),
+            "temperature": round(float(temperature[i]), 1) if temperature is not None else None,
+            "pressure": round(float(pressure[i])) if pressure is not None else None,
+            "humidity": round(float(humidity[i]), 1) if humidity is not None else None,
+        }
+
+
+def _score(model: object, X: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    n = X.shape[0]
+    predictions = np.empty(n, dtype=np.int64)
+    confidence = np.empty(n, dtype=np.float32)
+    classes = np.asarray(getattr(model, "classes_", [0, 1]))
+    for start in range(0, n, SCORE_CHUNK_ROWS):
+        chunk = X.iloc[start:start + SCORE_CHUNK_ROWS]
+        stop = start + chunk.shape[0]
+        if hasattr(model, "predict_proba"):
+            proba = model.predict_proba(chunk)
+            best = proba.argmax(axis=1)
+            predictions[start:stop] = classes[best]
+            confidence[start:stop] = proba[np.arange(proba.shape[0]), best] * 100
+        else:
+            predictions[start:stop] = model.predict(chunk)
+            confidence[start:stop] = 100.0
+    return predictions, confidence
+
+
+_engine: Optional[SimulationEngine] = None
+_engine_key: Optional[tuple] = None
+_engine_lock = threading.Lock()
+
+
+def _mtime(path: Path) -> float:
+    return path.stat().st_mtime if path.exists() else 0.0
+
+
+def current_engine() -> Optional[SimulationEngine]:
+    """The engine built by the last ``get_engine`` call, unless ``check_engine`` has since dropped it."""
+    return _engine
+
+
+def _engine_inputs() -> Tuple[tuple, dict, Path, Path, Path]:
+    # everything the engine is built from, and a key that changes with any of it
+    training = state.get(TRAINING_METRICS_PATH)
+    if not training or not training.get("model_id"):
+        raise SimulationError("No trained model available")
+    model_id = training["model_id"]
+    try:
+        model_path = registry.path_for(model_id)
+    except ModelNotFoundError:
+        raise SimulationError(f"Model not found: {model_id}")
+    # models trained before the dataset store recorded no dataset: use the current one
+    dataset_id = training.get("dataset_id")
+    try:
+        dataset_id = dataset_store.resolve(dataset_id)
+    except DatasetNotFoundError:
+        raise SimulationError(f"Dataset not found: {dataset_id}" if dataset_id else "No dataset uploaded")
+    csv_path = dataset_store.csv_path(dataset_id)
+    ranges_path = dataset_store.ranges_path(dataset_id)
+
+    key = (
+        str(model_path),
+        _mtime(model_path),
+        str(csv_path),
+        _mtime(csv_path),
+        state.version(ranges_path),
+        state.version(TRAINING_METRICS_PATH),
+    )
+    return key, training, model_path, csv_path, ranges_path
+
+
+def check_engine() -> None:
+    """Drop the engine when the model, its dataset or the simulation window changed.
+
+    Only versions and mtimes are read, so the simulation's background flusher calls
+    this every flush interval; the next poll rebuilds the engine (or reports why it cannot).
+    """
+    global _engine, _engine_key
+    if _engine is None:
+        return
+    try:
+        key = _engine_inputs()[0]
+    except SimulationError:
+        key = None
+    with _engine_lock:
+        if _engine_key != key:
+            _engine, _engine_key = None, None
+
+
+def get_engine() -> SimulationEngine:
+    """Return the engine for the current model, the dataset it was trained on and its simulation window.
+
+    Scoring happens once; the engine is rebuilt only when one of its inputs changes.
+    """
+    global _engine, _engine_key
+
+    key, training, model_path, csv_path, ranges_path = _engine_inputs()
+    if _engine is not None and _engine_key == key:
+        return _engine
+
+    ranges = state.get(ranges_path)
+    period = ranges.get("simulation") or {}
+    window = (period["start"], period["end"]) if period.get("start") and period.get("end") else None
+
+    try:
+        model = registry.load(training["model_id"])
+    except ModelNotFoundError:
+        raise SimulationError(f"Model file not found: {model_path.name}")
+
+    profile = get_profile(csv_path)
+    features = list(training.get("features") or [])
+    available = list((profile.get("columns") or {}).keys())
+    time_column = profile.get("time_column")
+    sensors = [c for c in available if c.lower() in SENSOR_COLUMNS]
+    columns = list(dict.fromkeys(features + ([time_column] if time_column else []) + sensors))
+    if any(c not in available for c in columns):
+        raise SimulationError(f"Dataset is missing model features: {', '.join(c for c in columns if c not in available)}")
+
+    # the time index turns the simulation window into a row slice
+    df = load_window(window[0], window[1], columns, csv_path) if window is not None else None
+    if df is None:
+        df = load_dataset(columns, csv_path)
+    engine = SimulationEngine.build(
+        df, model, features, time_column=time_column, time_format=profile.get("time_format")
+    )
+    with _engine_lock:
+        _engine, _engine_key = engine, key
+    return engine
+
+
+class SimulationState:
+    """Running flag and sample counter, shared by every API worker through the state store.
+
+    Each worker takes a block of ``SIM_ID_BLOCK`` sample ids from the store and hands
+    them out from memory under an asyncio lock, so concurrent pollers always get
+    distinct ids, increasing within a worker (and overall when there is one worker).
+    The last handed-out id is flushed in the background; the stored reservation
+    ("reserved") lets the counter resume after a crash without reusing ids. Start,
+    stop and clear are written through at once; the other workers notice them by
+    the document's version, which the background flusher checks every
+    ``flush_interval``, so polls never wait on the store outside a block reservation.
+    Clear bumps an epoch that drops every worker's block.
+    """
+
+    def __init__(self, path: Path = SIM_STATE_PATH, flush_interval: float = SIM_FLUSH_INTERVAL) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.running = False
+        self.counter = 0
+        self.reserved = 0
+        self.epoch = 0
+        self._version = -1
+        self._loaded = False
+        self._dirty = False
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+    def _refresh(self) -> None:
+        version = state.version(self.path)
+        if version == self._version:
+            return
+        st = state.get(self.path)
+        self.running = bool(st.get("running", False))
+        epoch = int(st.get("epoch", 0))
+        if epoch != self.epoch:
+            # cleared by some worker: this worker's block belongs to the old numbering
+            self.epoch = epoch
+            self.counter = self.reserved = 0
+        self._version = version
+        self._loaded = True
+
+    def _reserve(self, st: Dict[str, object]) -> None:
+        # resume after the last reservation; equal to the counter after a clean shutdown
+        start = max(int(st.get("counter", 0)), int(st.get("reserved", 0)))
+        st["reserved"] = start + SIM_ID_BLOCK
+        self.epoch = int(st.get("epoch", 0))
+        self.counter, self.reserved = start, start + SIM_ID_BLOCK
+
+    @staticmethod
+    def _record(st: Dict[str, object], counter: int, epoch: int) -> None:
+        if int(st.get("epoch", 0)) == epoch:
+            st["counter"] = max(int(st.get("counter", 0)), counter)
+
+    def _release(self, st: Dict[str, object]) -> None:
+        self._record(st, self.counter, self.epoch)
+        # give back the unused part of the block if no worker reserved past it
+        if int(st.get("epoch", 0)) == self.epoch and int(st.get("reserved", 0)) == self.reserved:
+            st["reserved"] = st["counter"]
+
+    async def _update(self, fn: Callable[[Dict[str, object]], None]) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, state.update, self.path, fn)
+
+    async def _ensure(self) -> None:
+        if not self._loaded:
+            await asyncio.get_running_loop().run_in_executor(None, self._refresh)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            await self.sync()
+            await asyncio.get_running_loop().run_in_executor(None, check_engine)
+
+    async def sync(self) -> None:
+        """Pick up start, stop and clear written by other workers."""
+        async with self._lock:
+            await asyncio.get_running_loop().run_in_executor(None, self._refresh)
+
+    async def open(self) -> None:
+        async with self._lock:
+            await self._ensure()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._dirty:
+                return
+            counter, epoch = self.counter, self.epoch
+            self._dirty = False
+        await self._update(lambda st: self._record(st, counter, epoch))
+
+    async def set_running(self, running: bool) -> None:
+        async with self._lock:
+            await self._ensure()
+            self.running = running
+            await self._update(lambda st: st.update(running=running))
+
+    async def clear(self) -> None:
+        def reset(st: Dict[str, object]) -> None:
+            st.update(running=False, counter=0, reserved=0, epoch=int(st.get("epoch", 0)) + 1)
+            self.epoch = st["epoch"]
+
+        async with self._lock:
+            await self._ensure()
+            self.running = False
+            self.counter = self.reserved = 0
+            self._dirty = False
+            await self._update(reset)
+
+    async def next_id(self) -> Optional[int]:
+        """Next sample number, or None when the simulation is not running."""
+        async with self._lock:
+            await self._ensure()
+            if not self.running:
+                return None
+            if self.counter >= self.reserved:
+                await self._update(self._reserve)
+            self.counter += 1
+            self._dirty = True
+            return self.counter
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._loaded:
+            async with self._lock:
+                self._dirty = False
+                await self._update(self._release)
+
+
+simulation_state = SimulationState()
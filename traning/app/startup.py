@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import io
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.inference import PREDICT_COMPILED, compiled_model, feature_matrix, predict_frame
+from app.jobs import training_jobs
+from app.lazy import preload, pyplot
+from app.metrics import metrics
+from app.registry import registry
+from app.storage import state
+from app.training import TRAINING_METRICS_PATH
+
+# import scikit-learn, the boosters and matplotlib in the background at start-up (0: on first use)
+STARTUP_PRELOAD = int(os.environ.get("STARTUP_PRELOAD", "1"))
+# load the current model and score one row at start-up, so the first prediction is warm
+STARTUP_PREWARM = int(os.environ.get("STARTUP_PREWARM", "1"))
+
+PRELOAD_MODULES = (
+    "joblib",
+    "sklearn.linear_model",
+    "sklearn.preprocessing",
+    "sklearn.pipeline",
+    "sklearn.model_selection",
+    "sklearn.metrics",
+    "xgboost",
+    "lightgbm",
+)
+
+
+class Warmup:
+    """Start-up steps run in order on a background thread while the API already serves.
+
+    A failing step is recorded and the next one runs; the service counts as ready once
+    every step has finished. Step durations go to ``startup_step_duration_seconds``.
+    """
+
+    def __init__(self) -> None:
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self._plan: List[Tuple[str, Callable[[], Any]]] = []
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self.seconds: Optional[float] = None
+
+    def add(self, name: str, fn: Callable[[], Any]) -> None:
+        self._plan.append((name, fn))
+        self.steps[name] = {"status": "pending"}
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        for name, fn in self._plan:
+            step = self.steps[name]
+            step["status"] = "running"
+            started = time.perf_counter()
+            try:
+                detail = fn()
+                step["status"] = "done"
+                if detail is not None:
+                    step["detail"] = detail
+            except Exception as e:
+                step.update(status="failed", error=f"{type(e).__name__}: {e}")
+            step["seconds"] = round(time.perf_counter() - started, 6)
+            metrics.observe("startup_step_duration_seconds", step["seconds"], step=name)
+        self.seconds = round(time.perf_counter() - self._started, 6)
+        self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "seconds": self.seconds,
+            "steps": {name: dict(step) for name, step in self.steps.items()},
+        }
+
+
+def warm_charts() -> None:
+    # the first text drawn loads matplotlib's font cache, the slowest part of a cold chart
+    plt = pyplot()
+    fig, ax = plt.subplots(figsize=(1, 1))
+    ax.set_title("warmup")
+    fig.savefig(io.BytesIO(), format="png", dpi=10)
+    plt.close(fig)
+
+
+def warm_model() -> Optional[Dict[str, Any]]:
+    """Load the current model (the one predictions and the simulation default to) and score one row."""
+    model_id = state.get(TRAINING_METRICS_PATH).get("model_id")
+    entry = registry.get(model_id) if model_id else registry.latest()
+    if entry is None:
+        return None
+    model_id = entry["model_id"]
+    model = registry.load(model_id)
+    scorer = registry.load_scorer(model_id) if PREDICT_COMPILED else None
+    if scorer is not None:
+        model = compiled_model(model_id, scorer, lambda: registry.load(model_id))
+    features = entry.get("features") or []
+    if features:
+        predict_frame(model, feature_matrix(pd.DataFrame([dict.fromkeys(features, 0.0)]), features))
+    return {"model_id": model_id, "compiled": scorer is not None}
+
+
+def build_warmup(preload_modules: bool = bool(STARTUP_PRELOAD), prewarm: bool = bool(STARTUP_PREWARM)) -> Warmup:
+    """Steps in order of how soon requests need them: libraries, the model, charts, training workers."""
+    warmup = Warmup()
+    if preload_modules:
+        warmup.add("imports", lambda: preload(PRELOAD_MODULES))
+    if prewarm:
+        warmup.add("model", warm_model)
+    if preload_modules:
+        warmup.add("charts", warm_charts)
+        # start the training processes now, so the first job does not pay for their imports
+        warmup.add("training_workers", lambda: {"workers": len(training_jobs.prewarm(preload, PRELOAD_MODULES))})
+    return warmup
+
+
+warmup = build_warmup()
@@ -1,27 +1,68 @@
+import hashlib
 import json
 import os
+import sqlite3
+import struct
+import threading
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 MODELS_DIR = BASE_DIR / "models"
 META_PATH = DATA_DIR / "metadata.json"
 
+# where shared service state lives: "sqlite" (one WAL database, safe for several workers) or "file" (JSON files)
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "sqlite")
+STATE_DB_PATH = Path(os.environ.get("STATE_DB_PATH", str(DATA_DIR / "state.db")))
+# how long a writer waits for another process's transaction before failing
+STATE_BUSY_TIMEOUT = float(os.environ.get("STATE_BUSY_TIMEOUT", "30"))
+
 for d in [DATA_DIR, MODELS_DIR]:
     d.mkdir(parents=True, exist_ok=True)
 
 
+def _tmp_path(path: Path) -> Path:
+    # per-process, per-thread temp name: several workers may write the same file at once
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
 def save_file(file_path: Path, content: bytes) -> None:
+    """Write ``content`` atomically: readers see the old file or the new one, never a partial write."""
     file_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(file_path, "wb") as f:
+    tmp_path = _tmp_path(file_path)
+    with open(tmp_path, "wb") as f:
         f.write(content)
+    os.replace(tmp_path, file_path)
+
+
+def file_stamp(path: Path) -> Dict[str, int]:
+    """Cheap version marker for a file: its size and modification time."""
+    st = path.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 def save_json(path: Path, data: Dict[str, Any]) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    save_file(path, json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"))
 
 
 def load_json(path: Path) -> Dict[str, Any]:
@@ -29,3 +70,229 @@ def load_json(path: Path) -> Dict[str, Any]:
         return {}
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
+
+
+def compact_labels(values: np.ndarray) -> np.ndarray:
+    """Smallest integer dtype that holds integral labels; other arrays are returned as-is."""
+    values = np.asarray(values)
+    if values.size == 0 or not (np.issubdtype(values.dtype, np.integer) or values.dtype == bool):
+        return values
+    lo, hi = int(values.min()), int(values.max())
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= lo and hi <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def save_arrays(path: Path, arrays: Dict[str, np.ndarray]) -> None:
+    """Write arrays as an uncompressed .npz, atomically (write to a temp file, then rename)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_arrays(path: Path, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """Read an .npz written by ``save_arrays``; stored members are memory-mapped, not copied."""
+    out: Dict[str, np.ndarray] = {}
+    if not path.exists():
+        return out
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as raw:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                # locate the .npy payload inside the archive: local header, name, extra field
+                raw.seek(info.header_offset)
+                name_len, extra_len = struct.unpack("<HH", raw.read(30)[26:30])
+                raw.seek(info.header_offset + 30 + name_len + extra_len)
+                version = np.lib.format.read_magic(raw)
+                if version == (1, 0):
+                    shape, fortran, dtype = np.lib.format.read_array_header_1_0(raw)
+                else:
+                    shape, fortran, dtype = np.lib.format.read_array_header_2_0(raw)
+                if not dtype.hasobject and int(np.prod(shape)) > 0:
+                    out[name] = np.memmap(
+                        path, dtype=dtype, mode="r", offset=raw.tell(), shape=shape, order="F" if fortran else "C"
+                    )
+                    continue
+            with zf.open(info) as member:
+                out[name] = np.lib.format.read_array(member, allow_pickle=False)
+    return out
+
+
+class StateError(Exception):
+    pass
+
+
+@lru_cache(maxsize=1024)
+def state_key(path: Path) -> str:
+    """Backend-independent name of a state document: its path relative to the service root."""
+    try:
+        return Path(path).resolve().relative_to(BASE_DIR).as_posix()
+    except ValueError:
+        return Path(path).resolve().as_posix()
+
+
+class StateStore:
+    """Shared service state: small JSON documents named by the file they used to live in.
+
+    Every write bumps the document's version, so readers in any worker can tell cheaply
+    whether what they derived from it is stale. ``update`` is an atomic read-modify-write.
+    """
+
+    def get(self, path: Path) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def version(self, path: Path) -> int:
+        """0 when the document does not exist; otherwise changes on every write."""
+        raise NotImplementedError
+
+    def update(self, path: Path, fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Apply ``fn`` to the current document under an exclusive lock and store its result.
+
+        ``fn`` may mutate the document in place and return None. Returns the stored document.
+        """
+        raise NotImplementedError
+
+    def delete(self, path: Path) -> None:
+        raise NotImplementedError
+
+    def put(self, path: Path, data: Dict[str, Any]) -> None:
+        self.update(path, lambda _: data)
+
+
+class FileStateStore(StateStore):
+    """Documents as JSON files, replaced atomically; writers serialize on an advisory lock file."""
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def _locked(self, path: Path) -> Iterator[None]:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(path.with_name(f"{path.name}.lock"), "a+b") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, path: Path) -> Dict[str, Any]:
+        return load_json(path)
+
+    def version(self, path: Path) -> int:
+        try:
+            st = Path(path).stat()
+        except OSError:
+            return 0
+        # every write renames a new file into place, so the inode changes along with the mtime
+        return hash((st.st_ino, st.st_mtime_ns, st.st_size)) & 0x7FFFFFFFFFFFFFFF or 1
+
+    def update(self, path: Path, fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        with self._locked(path):
+            data = load_json(path)
+            result = fn(data)
+            data = data if result is None else result
+            save_json(path, data)
+        return data
+
+    def delete(self, path: Path) -> None:
+        with self._locked(path):
+            Path(path).unlink(missing_ok=True)
+
+
+class SQLiteStateStore(StateStore):
+    """Documents as versioned rows of one SQLite database in WAL mode.
+
+    Readers never block writers or each other, and every worker process sees a
+    committed write immediately. A document missing from the database is imported
+    once from the JSON file it replaces, so existing deployments keep their state.
+    """
+
+    def __init__(self, path: Path, busy_timeout: float = STATE_BUSY_TIMEOUT) -> None:
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " key TEXT PRIMARY KEY,"
+            " version INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " updated_at TEXT NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # one connection per thread and process: sqlite connections are not shared across either
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL commits are durable across process crashes without an fsync per write
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _row(self, conn: sqlite3.Connection, key: str, path: Path) -> Optional[tuple]:
+        row = conn.execute("SELECT version, data FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None and Path(path).exists():
+            legacy = load_json(path)
+            conn.execute(
+                "INSERT OR IGNORE INTO state (key, version, data, updated_at) VALUES (?, 1, ?, ?)",
+                (key, json.dumps(legacy, ensure_ascii=False), _now()),
+            )
+            row = conn.execute("SELECT version, data FROM state WHERE key = ?", (key,)).fetchone()
+        return row
+
+    def get(self, path: Path) -> Dict[str, Any]:
+        row = self._row(self._conn(), state_key(path), path)
+        return json.loads(row[1]) if row else {}
+
+    def version(self, path: Path) -> int:
+        row = self._row(self._conn(), state_key(path), path)
+        return int(row[0]) if row else 0
+
+    def update(self, path: Path, fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        conn = self._conn()
+        key = state_key(path)
+        # IMMEDIATE takes the write lock up front, so concurrent read-modify-writes serialize
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._row(conn, key, path)
+            data = json.loads(row[1]) if row else {}
+            result = fn(data)
+            data = data if result is None else result
+            conn.execute(
+                "INSERT INTO state (key, version, data, updated_at) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET version = version + 1, data = excluded.data, "
+                "updated_at = excluded.updated_at",
+                (key, json.dumps(data, ensure_ascii=False), _now()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return data
+
+    def delete(self, path: Path) -> None:
+        self._conn().execute("DELETE FROM state WHERE key = ?", (state_key(path),))
+        # a leftover JSON file would be imported again on the next read
+        Path(path).unlink(missing_ok=True)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def open_state_store(backend: str = STATE_BACKEND) -> StateStore:
+    if backend == "file":
+        return FileStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore(STATE_DB_PATH)
+    raise StateError(f"Unknown STATE_BACKEND: {backend}")
+
+
+state = open_state_store()
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from app.modeling import TrainingError, build_estimator, classification_metrics
+from app.schemas import LeaderboardEntry, TournamentRequest, TournamentResponse
+from app.dataset_store import dataset_store
+from app.storage import state
+from app.training import load_prepared_data, resolve_dataset
+
+# worker processes for the tournament (-1 = one per core)
+TOURNAMENT_JOBS = int(os.environ.get("TOURNAMENT_JOBS", "-1"))
+# arrays larger than this are dumped once and memory-mapped by the workers instead of pickled
+TOURNAMENT_MMAP_MIN = os.environ.get("TOURNAMENT_MMAP_MIN", "1M")
+
+METRIC_KEYS = ["accuracy", "precision", "recall", "f1Score"]
+
+
+def _fit_fold(
+    algorithm: str,
+    random_state: int,
+    X: np.ndarray,
+    y: np.ndarray,
+    train_idx: np.ndarray,
+    test_idx: np.ndarray,
+) -> Tuple[str, Dict[str, float], float, float]:
+    # one core per task; the parallelism comes from running folds side by side.
+    # X is the shared (memory-mapped) matrix: only this fold's rows are copied, here in the worker
+    model = build_estimator(algorithm, random_state, n_jobs=1)
+    started = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    fitted = time.perf_counter()
+    y_pred = model.predict(X[test_idx])
+    predicted = time.perf_counter()
+    return algorithm, classification_metrics(y[test_idx], y_pred), fitted - started, predicted - fitted
+
+
+def _splitter(y: np.ndarray, folds: int, random_state: int) -> Any:
+    from sklearn.model_selection import KFold, StratifiedKFold
+
+    _, counts = np.unique(y, return_counts=True)
+    if counts.shape[0] < 50 and counts.min() >= folds:
+        return StratifiedKFold(n_splits=folds, shuffle=True, random_state=random_state)
+    return KFold(n_splits=folds, shuffle=True, random_state=random_state)
+
+
+def run_tournament(req: TournamentRequest) -> TournamentResponse:
+    """Cross-validate every requested algorithm on one shared copy of X/y and rank them by F1.
+
+    Features come from the prepared-data cache shared with ``/api/train``; joblib
+    memory-maps the arrays into its worker processes, and every (algorithm, fold)
+    pair runs as a separate task. Folds are row numbers into the full matrix, so
+    excluding the testing window never copies it.
+    """
+    from joblib import Parallel, delayed
+
+    started = time.perf_counter()
+    dataset_id, csv_path = resolve_dataset(req.dataset_id)
+    ranges = state.get(dataset_store.ranges_path(dataset_id))
+    data = load_prepared_data(req.target, req.split, ranges, csv_path=csv_path)
+    X, y, target_col, features = data.X, np.asarray(data.y), data.target_col, data.features
+    rows = np.arange(X.shape[0])
+    if data.is_test is not None:
+        # keep the testing window out of model selection
+        rows = np.flatnonzero(~np.asarray(data.is_test, dtype=bool))
+    if rows.shape[0] < req.cv_folds:
+        raise TrainingError(f"Need at least {req.cv_folds} usable rows for {req.cv_folds}-fold cross-validation")
+    folds = [
+        (rows[train], rows[test])
+        for train, test in _splitter(y[rows], req.cv_folds, req.random_state).split(rows, y[rows])
+    ]
+
+    entries: Dict[str, LeaderboardEntry] = {}
+    algorithms: List[str] = []
+    for algorithm in dict.fromkeys(req.models):
+        try:
+            build_estimator(algorithm, req.random_state)
+            algorithms.append(algorithm)
+        except TrainingError as e:
+            entries[algorithm] = LeaderboardEntry(algorithm=algorithm, error=str(e))
+
+    tasks = [
+        delayed(_fit_fold)(algorithm, req.random_state, X, y, train_idx, test_idx)
+        for algorithm in algorithms
+        for train_idx, test_idx in folds
+    ]
+    results = []
+    if tasks:
+        results = Parallel(
+            n_jobs=TOURNAMENT_JOBS,
+            max_nbytes=TOURNAMENT_MMAP_MIN,
+            mmap_mode="r",
+        )(tasks)
+
+    for algorithm in algorithms:
+        runs = [r for r in results if r[0] == algorithm]
+        scores = {k: np.array([r[1][k] for r in runs]) for k in METRIC_KEYS}
+        entries[algorithm] = LeaderboardEntry(
+            algorithm=algorithm,
+            metrics={k: float(v.mean()) for k, v in scores.items()},
+            metrics_std={k: float(v.std()) for k, v in scores.items()},
+            fit_seconds=float(np.mean([r[2] for r in runs])),
+            predict_seconds=float(np.mean([r[3] for r in runs])),
+        )
+
+    ranked = sorted(
+        (e for e in entries.values() if e.error is None),
+        key=lambda e: (e.metrics["f1Score"], e.metrics["accuracy"]),
+        reverse=True,
+    )
+    for rank, entry in enumerate(ranked, start=1):
+        entry.rank = rank
+    leaderboard = ranked + [e for e in entries.values() if e.error is not None]
+
+    return TournamentResponse(
+        target=target_col,
+        features=features,
+        rows=int(rows.shape[0]),
+        cv_folds=req.cv_folds,
+        wall_seconds=time.perf_counter() - started,
+        leaderboard=leaderboard,
+        dataset_id=dataset_id,
+    )
@@ -0,0 +1,438 @@
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.dataset import DatasetChunks, dataset_hash, get_profile, get_time_index, load_dataset, load_rows
+from app.dataset_store import DatasetNotFoundError, dataset_store
+from app.evaluation import Evaluation
+from app.memory import memory_report, reset_peak_rss, rss_mb
+from app.metrics import StageTimer, metrics as latency_metrics
+from app.modeling import (
+    SCORER_PARITY_ROWS,
+    TrainingError,
+    feature_frame,
+    positive_scores,
+    prepare_matrix,
+    split_positions,
+    train_prepared,
+    update_model,
+)
+from app.out_of_core import (
+    OUT_OF_CORE_ALGORITHMS,
+    TRAIN_MEMORY_BUDGET_MB,
+    chunk_rows_for,
+    estimated_in_memory_mb,
+    evaluate_out_of_core,
+    train_out_of_core,
+)
+from app.prepared import PreparedData, load_prepared, prepared_key, save_prepared
+from app.profiling import numeric_columns
+from app.registry import registry
+from app.schemas import TrainMetrics, TrainRequest, TrainResponse
+from app.storage import DATA_DIR, compact_labels, load_arrays, load_json, save_arrays, state
+
+TRAINING_METRICS_PATH = DATA_DIR / "training_metrics.json"
+TRAINING_RESULTS_PATH = DATA_DIR / "training_results.npz"
+LEGACY_TRAINING_RESULTS_PATH = DATA_DIR / "training_results.json"
+
+# also save the raw test-set labels and scores (the charts only need the evaluation bundle)
+TRAINING_SAVE_PREDICTIONS = int(os.environ.get("TRAINING_SAVE_PREDICTIONS", "0"))
+
+STAGES = ["load", "split", "fit", "evaluate", "persist"]
+
+
+def format_period(ranges: Dict[str, Any], period_key: str) -> str:
+    """Human-readable period summary from saved date ranges."""
+    try:
+        p = ranges.get(period_key)
+        if not p:
+            return "N/A"
+        start = p.get("start") or ""
+        end = p.get("end") or ""
+        days = p.get("days")
+        if start and end and days:
+            return f"{start} to {end} ({days} days)"
+        if start and end:
+            return f"{start} to {end}"
+        return "N/A"
+    except Exception:
+        return "N/A"
+
+
+def resolve_dataset(dataset_id: Optional[str] = None) -> Tuple[str, Path]:
+    """Id and CSV of the stored dataset to train on: ``dataset_id``, or the current one."""
+    try:
+        resolved = dataset_store.resolve(dataset_id)
+    except DatasetNotFoundError:
+        raise TrainingError(f"Dataset not found: {dataset_id}" if dataset_id else "No dataset uploaded")
+    dataset_store.touch(resolved)
+    return resolved, dataset_store.csv_path(resolved)
+
+
+def _window_rows(split: str, ranges: Dict[str, Any], csv_path: Optional[Path] = None) -> Optional[Tuple[Any, Any]]:
+    """Row numbers of the training and testing windows, or None to split at random."""
+    if split == "random":
+        return None
+    index = get_time_index(csv_path)
+    train_p, test_p = ranges.get("training") or {}, ranges.get("testing") or {}
+    if index is None or not (train_p.get("start") and train_p.get("end") and test_p.get("start") and test_p.get("end")):
+        if split == "date_ranges":
+            raise TrainingError("Date-range split needs configured ranges and a timestamp column")
+        return None
+    train_rows = index.rows(train_p["start"], train_p["end"])
+    test_rows = index.rows(test_p["start"], test_p["end"])
+    if train_rows.shape[0] == 0 or test_rows.shape[0] == 0:
+        if split == "date_ranges":
+            raise TrainingError("Training or testing window contains no rows")
+        return None
+    return train_rows, test_rows
+
+
+def training_columns(profile: Dict[str, Any], target: Optional[str]) -> Optional[List[str]]:
+    """Only the numeric features and the target are needed for training (None: all columns)."""
+    target = target or profile.get("target_column")
+    if target in (profile.get("columns") or {}):
+        return [c for c in numeric_columns(profile) if c != target] + [target]
+    return None
+
+
+def load_training_frame(
+    target: Optional[str],
+    split: str,
+    ranges: Dict[str, Any],
+    windows: Any = False,
+    csv_path: Optional[Path] = None,
+) -> Tuple[pd.DataFrame, Dict[str, Any], Optional[pd.Series]]:
+    """Dataset columns needed for training, its profile, and the testing-window mask (None for a random split).
+
+    ``windows`` takes already resolved ``_window_rows`` (False resolves them here);
+    ``csv_path`` defaults to the current dataset.
+    """
+    if csv_path is None:
+        _, csv_path = resolve_dataset()
+    if windows is False:
+        windows = _window_rows(split, ranges, csv_path)
+    test_mask = None
+    try:
+        profile = get_profile(csv_path)
+        columns = training_columns(profile, target)
+        if windows is None:
+            df = load_dataset(columns, csv_path, downcast=True)
+        else:
+            train_rows, test_rows = windows
+            df = pd.concat(
+                [load_rows(train_rows, columns, csv_path, downcast=True), load_rows(test_rows, columns, csv_path, downcast=True)],
+                ignore_index=True,
+            )
+            test_mask = pd.Series(df.index >= train_rows.shape[0], index=df.index)
+    except Exception as e:
+        raise TrainingError(f"Failed to read dataset: {e}")
+    return df, profile, test_mask
+
+
+def load_prepared_data(
+    target: Optional[str],
+    split: str,
+    ranges: Dict[str, Any],
+    timer: Optional[StageTimer] = None,
+    csv_path: Optional[Path] = None,
+) -> PreparedData:
+    """The training matrix for a dataset (the current one by default), from the prepared-data cache when possible.
+
+    On a miss the frame is loaded and prepared once, written to the cache and
+    handed back memory-mapped, so the next run with another algorithm or seed
+    skips straight to fitting.
+    """
+    timer = timer or StageTimer()
+    if csv_path is None:
+        _, csv_path = resolve_dataset()
+    windows = _window_rows(split, ranges, csv_path)
+    key = prepared_key(dataset_hash(csv_path), target, windows)
+    data = load_prepared(key)
+    if data is not None:
+        return data
+
+    df, profile, test_mask = load_training_frame(target, split, ranges, windows, csv_path)
+    timer.mark("prepare_features")
+    X, y, is_test, target_col, features = prepare_matrix(df, target, profile, test_mask)
+    del df
+    timer.mark("cache_write")
+    return save_prepared(key, PreparedData(X, y, is_test, target_col, features))
+
+
+def run_training(
+    req: TrainRequest,
+    progress: Optional[Callable[[str], None]] = None,
+) -> Tuple[Dict[str, Any], TrainResponse]:
+    """Load the dataset, fit and evaluate, and write the model artifact and test predictions.
+
+    The model is not added to the registry index here; see ``publish_training``.
+    """
+    report = progress or (lambda stage: None)
+    reset_peak_rss()
+    baseline_mb = rss_mb()
+    timer = StageTimer()
+
+    report("load")
+    timer.mark("load")
+    dataset_id, csv_path = resolve_dataset(req.dataset_id)
+    ranges = state.get(dataset_store.ranges_path(dataset_id))
+    profile = get_profile(csv_path)
+    columns = training_columns(profile, req.target)
+    out_of_core = req.out_of_core
+    if out_of_core is None:
+        out_of_core = estimated_in_memory_mb(profile, columns) > TRAIN_MEMORY_BUDGET_MB
+
+    algorithm = OUT_OF_CORE_ALGORITHMS.get(req.model, req.model) if out_of_core else req.model
+    # reported with the result, so clients can tell the model is not the one they asked for
+    requested_model = req.model if algorithm != req.model else None
+    prepared_cache = None
+    if out_of_core:
+        source = DatasetChunks(columns, chunk_rows_for(len(columns or profile.get("columns") or [])), csv_path)
+        model, metrics, features, target_col, y_true, y_pred, y_score, evaluation = train_out_of_core(
+            source,
+            algorithm=algorithm,
+            target=req.target,
+            test_size=req.test_size,
+            random_state=req.random_state,
+            profile=profile,
+            progress=report,
+            windows=_window_rows(req.split, ranges, csv_path),
+            timer=timer,
+        )
+        memory = memory_report(baseline_mb, budget_mb=TRAIN_MEMORY_BUDGET_MB, chunk_rows=source.chunk_rows)
+        sample = source.chunk(0)[features].dropna().head(SCORER_PARITY_ROWS)
+    else:
+        data = load_prepared_data(req.target, req.split, ranges, timer, csv_path)
+        prepared_cache = "hit" if data.cached else "miss"
+        model, metrics, features, target_col, y_true, y_pred, y_score, evaluation = train_prepared(
+            data.X,
+            data.y,
+            data.features,
+            data.target_col,
+            algorithm=req.model,
+            test_size=req.test_size,
+            random_state=req.random_state,
+            is_test=data.is_test,
+            progress=report,
+            timer=timer,
+        )
+        sample = np.asarray(data.X[:SCORER_PARITY_ROWS])
+        memory = memory_report(baseline_mb, prepared_mb=data.nbytes / (1024 * 1024))
+        del data
+
+    report("persist")
+    timer.mark("dump")
+    entry = registry.save_artifact(
+        model,
+        algorithm=algorithm,
+        dataset_hash=dataset_hash(csv_path),
+        dataset_id=dataset_id,
+        sample=sample,
+        features=features,
+        target=target_col,
+        metrics=metrics,
+        evaluation=evaluation,
+        # what it takes to rebuild the hold-out set when the model is updated
+        holdout={
+            "target": req.target,
+            "split": req.split,
+            "test_size": req.test_size,
+            "random_state": req.random_state,
+            "ranges": ranges,
+        },
+        memory=memory,
+        out_of_core=out_of_core,
+        requested_model=requested_model,
+        prepared_cache=prepared_cache,
+    )
+
+    timer.mark("save_results")
+    if TRAINING_SAVE_PREDICTIONS:
+        arrays = {"y_true": compact_labels(y_true), "y_pred": compact_labels(y_pred)}
+        if y_score is not None:
+            arrays["y_score"] = np.asarray(y_score, dtype=np.float32)
+        save_arrays(TRAINING_RESULTS_PATH, arrays)
+    else:
+        # predictions of an earlier run would no longer match the current model
+        TRAINING_RESULTS_PATH.unlink(missing_ok=True)
+    LEGACY_TRAINING_RESULTS_PATH.unlink(missing_ok=True)
+    entry["stages"] = timer.breakdown()
+
+    resp = TrainResponse(
+        model_id=entry["model_id"],
+        algorithm=algorithm,
+        metrics=TrainMetrics(
+            accuracy=metrics["accuracy"],
+            precision=metrics["precision"],
+            recall=metrics["recall"],
+            f1Score=metrics["f1Score"],
+            rocAuc=metrics.get("rocAuc"),
+            averagePrecision=metrics.get("averagePrecision"),
+            trainingData=format_period(ranges, "training"),
+            validationData=format_period(ranges, "testing"),
+            simulationData=format_period(ranges, "simulation"),
+        ),
+        features=features,
+        target=target_col,
+        memory=memory,
+        stages=entry["stages"],
+        dataset_id=dataset_id,
+        requested_model=requested_model,
+    )
+    return entry, resp
+
+
+def evaluate_holdout(entry: Dict[str, Any], model: Any) -> Dict[str, Any]:
+    """Evaluation bundle of ``model`` on the hold-out set of the run that trained ``entry``."""
+    holdout = entry.get("holdout")
+    if not holdout or not entry.get("dataset_id"):
+        raise TrainingError(f"Model {entry['model_id']} has no recorded hold-out set; retrain it before updating")
+    _, csv_path = resolve_dataset(entry["dataset_id"])
+    features, target = entry["features"], entry["target"]
+    if entry.get("out_of_core"):
+        source = DatasetChunks(features + [target], chunk_rows_for(len(features) + 1), csv_path)
+        windows = _window_rows(holdout["split"], holdout["ranges"], csv_path)
+        return evaluate_out_of_core(
+            source, model, features, target, holdout["test_size"], holdout["random_state"], windows,
+        )
+    data = load_prepared_data(holdout["target"], holdout["split"], holdout["ranges"], csv_path=csv_path)
+    _, test_pos = split_positions(data.y, holdout["test_size"], holdout["random_state"], data.is_test)
+    X_test = feature_frame(np.asarray(data.X[test_pos]), data.features)
+    evaluation = Evaluation(np.asarray(model.classes_))
+    return evaluation.add(data.y[test_pos], model.predict(X_test), positive_scores(model, X_test)).bundle()
+
+
+def run_update(model_id: str, df: pd.DataFrame) -> Tuple[Dict[str, Any], TrainResponse]:
+    """Update a registered model with new labeled rows and write it as a new version.
+
+    The updated model is then evaluated on the parent's hold-out set (same dataset,
+    split and seed), so the stored metrics describe the version that is published.
+    """
+    parent = registry.get(model_id)
+    model = registry.load(model_id)
+    features, target = parent.get("features") or [], parent.get("target")
+    if not features or target not in df.columns:
+        raise TrainingError(f"Update rows need the model's features and its target column '{target}'")
+    missing = [f for f in features if f not in df.columns]
+    if missing:
+        raise TrainingError(f"Missing features: {', '.join(missing)}")
+
+    X = df[features].apply(pd.to_numeric, errors="coerce")
+    y = df[target]
+    valid = X.notna().all(axis=1) & y.notna()
+    X, y = X.loc[valid], y.loc[valid]
+    if X.shape[0] == 0:
+        raise TrainingError("Update contains no usable rows")
+
+    updated = update_model(model, parent["algorithm"], X, y)
+    evaluation = evaluate_holdout(parent, updated)
+    metrics = evaluation["metrics"]
+
+    entry = registry.save_artifact(
+        updated,
+        algorithm=parent["algorithm"],
+        dataset_hash=parent.get("dataset_hash", ""),
+        dataset_id=parent.get("dataset_id"),
+        sample=X,
+        features=features,
+        target=target,
+        metrics=metrics,
+        evaluation=evaluation,
+        holdout=parent["holdout"],
+        out_of_core=parent.get("out_of_core"),
+        parent=model_id,
+        updated_rows=int(X.shape[0]),
+    )
+    ranges = state.get(dataset_store.ranges_path(parent["dataset_id"])) if parent.get("dataset_id") else {}
+    resp = TrainResponse(
+        model_id=entry["model_id"],
+        algorithm=parent["algorithm"],
+        metrics=TrainMetrics(
+            accuracy=metrics["accuracy"],
+            precision=metrics["precision"],
+            recall=metrics["recall"],
+            f1Score=metrics["f1Score"],
+            rocAuc=metrics.get("rocAuc"),
+            averagePrecision=metrics.get("averagePrecision"),
+            trainingData=format_period(ranges, "training"),
+            validationData=format_period(ranges, "testing"),
+            simulationData=format_period(ranges, "simulation"),
+        ),
+        features=features,
+        target=target,
+        dataset_id=parent.get("dataset_id"),
+    )
+    return entry, resp
+
+
+def current_evaluation() -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Evaluation bundle of the current model and a key that changes with it, or (None, None).
+
+    Runs published before the bundle existed are summarized from their saved predictions.
+    """
+    training = state.get(TRAINING_METRICS_PATH)
+    if training.get("evaluation"):
+        return training["model_id"], training["evaluation"]
+    path = training_results_path()
+    data = load_training_results()
+    if path is None or "y_true" not in data or "y_pred" not in data:
+        return None, None
+    classes = np.union1d(data["y_true"], data["y_pred"])
+    bundle = Evaluation(classes).add(data["y_true"], data["y_pred"], data.get("y_score")).bundle()
+    return f"{path.name}:{path.stat().st_mtime_ns}", bundle
+
+
+def training_results_path() -> Optional[Path]:
+    for path in (TRAINING_RESULTS_PATH, LEGACY_TRAINING_RESULTS_PATH):
+        if path.exists():
+            return path
+    return None
+
+
+def load_training_results() -> Dict[str, np.ndarray]:
+    """Test-set labels and scores of the last run (memory-mapped), or {} if there are none.
+
+    Results written as JSON lists by older versions are still read.
+    """
+    path = training_results_path()
+    if path is None:
+        return {}
+    if path == TRAINING_RESULTS_PATH:
+        return load_arrays(path)
+    data = load_json(path)
+    return {k: np.asarray(v) for k, v in data.items() if v is not None}
+
+
+def publish_training(entry: Dict[str, Any], resp: TrainResponse) -> None:
+    """Register a finished model and make it the current one.
+
+    Stage timings are recorded in the latency metrics only here, so runs that are
+    never published do not show up in ``/api/metrics``.
+    """
+    started = time.perf_counter()
+    registry.add(entry)
+    stages = dict(resp.stages or {})
+    if stages:
+        stages["publish"] = round(time.perf_counter() - started, 6)
+        for stage, seconds in stages.items():
+            latency_metrics.observe("training_stage_duration_seconds", seconds, stage=stage, algorithm=resp.algorithm)
+    # persist last training response for verification
+    state.put(TRAINING_METRICS_PATH, {
+        "model_id": resp.model_id,
+        "algorithm": resp.algorithm,
+        "metrics": resp.metrics.model_dump(),
+        "evaluation": entry.get("evaluation"),
+        "features": resp.features,
+        "target": resp.target,
+        "dataset_id": resp.dataset_id,
+        "requested_model": resp.requested_model,
+        "memory": resp.memory,
+        "stages": stages or None,
+    })
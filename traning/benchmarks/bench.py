@@ -0,0 +1,305 @@
+"""Benchmarks for the training service hot paths.
+
+Generates synthetic sensor datasets, drives the FastAPI app in-process through the
+test client and records wall time, peak RSS and throughput per endpoint and per
+training stage. The app runs from a copy of this tree in a scratch
+directory, so the checked-in ``data/`` and ``models/`` are never touched.
+
+    python benchmarks/bench.py --sizes 10k,100k,1M --out benchmarks/results/run.json
+    python benchmarks/bench.py --sizes 10k --baseline benchmarks/results/run.json --threshold 0.2
+
+With ``--baseline`` the run exits with status 1 when any benchmark is slower than
+the baseline by more than ``--threshold`` (a fraction).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+SIZE_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+GENERATE_CHUNK_ROWS = 500_000
+SIMULATION_POLLS = 200
+PREDICT_BATCH_ROWS = 1000
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    if text[-1:] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def size_label(rows: int) -> str:
+    for suffix, factor in (("M", 1_000_000), ("k", 1_000)):
+        if rows >= factor and rows % factor == 0:
+            return f"{rows // factor}{suffix}"
+    return str(rows)
+
+
+def generate_dataset(path: Path, rows: int, features: int, seed: int) -> None:
+    """Per-minute timestamps, ``features`` numeric sensor columns, a categorical line and a binary target.
+
+    Written in chunks so 10M-row files never exist in memory at once.
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.normal(size=features)
+    start = pd.Timestamp("2024-01-01")
+    with open(path, "w", newline="") as f:
+        for offset in range(0, rows, GENERATE_CHUNK_ROWS):
+            n = min(GENERATE_CHUNK_ROWS, rows - offset)
+            X = rng.normal(size=(n, features))
+            logits = X @ weights + rng.normal(scale=1.0, size=n)
+            df = pd.DataFrame(X.round(4), columns=[f"sensor_{i}" for i in range(features)])
+            df.insert(0, "timestamp", start + pd.to_timedelta(np.arange(offset, offset + n), unit="min"))
+            df["line"] = rng.choice(["A", "B", "C"], size=n)
+            df["target"] = (logits > 0).astype(int)
+            df.to_csv(f, index=False, header=offset == 0)
+
+
+def thirds(start: pd.Timestamp, end: pd.Timestamp) -> Dict[str, Any]:
+    """Training / testing / simulation windows covering the dataset in 60/20/20 proportions."""
+    span = end - start
+    cut1, cut2 = start + span * 0.6, start + span * 0.8
+
+    def period(a: pd.Timestamp, b: pd.Timestamp) -> Dict[str, Any]:
+        return {"start": str(a.date()), "end": str(b.date()), "days": max((b - a).days, 1)}
+
+    return {
+        "training": period(start, cut1),
+        "testing": period(cut1 + pd.Timedelta(days=1), cut2),
+        "simulation": period(cut2 + pd.Timedelta(days=1), end),
+    }
+
+
+class Runner:
+    def __init__(self, client: Any, memory: Any, repeat: int) -> None:
+        self.client = client
+        self.memory = memory
+        self.repeat = max(repeat, 1)
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def measure(self, name: str, fn: Callable[[], Any], items: Optional[int] = None, repeat: Optional[int] = None) -> Any:
+        """Median wall time over the repeats, the largest peak RSS, and ``items`` per second."""
+        times: List[float] = []
+        peaks: List[float] = []
+        out = None
+        for _ in range(repeat or self.repeat):
+            self.memory.reset_peak_rss()
+            started = time.perf_counter()
+            out = fn()
+            times.append(time.perf_counter() - started)
+            peak = self.memory.peak_rss_mb()
+            if peak is not None:
+                peaks.append(peak)
+        seconds = statistics.median(times)
+        self.results[name] = {
+            "seconds": round(seconds, 6),
+            "peak_rss_mb": round(max(peaks), 2) if peaks else None,
+            "throughput": round(items / seconds, 2) if items and seconds > 0 else None,
+        }
+        print(f"  {name:<32} {seconds * 1000:10.1f} ms" + (f"  {items / seconds:12.0f}/s" if items and seconds > 0 else ""))
+        return out
+
+    def ok(self, response: Any) -> Any:
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.request.method} {response.request.url} -> {response.status_code}: {response.text[:300]}")
+        return response
+
+
+def bench_size(runner: Runner, workdir: Path, rows: int, args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    client = runner.client
+    csv_path = workdir / f"bench_{rows}.csv"
+    started = time.perf_counter()
+    generate_dataset(csv_path, rows, args.features, args.seed)
+    print(f"[{size_label(rows)}] generated {csv_path.stat().st_size / 1e6:.1f} MB in {time.perf_counter() - started:.1f}s")
+
+    def upload() -> Any:
+        with open(csv_path, "rb") as f:
+            return runner.ok(client.post("/api/upload/dataset", files={"file": (csv_path.name, f, "text/csv")})).json()
+
+    info = runner.measure("upload_dataset", upload, items=rows, repeat=1)
+    # the same bytes again are answered from the dataset store
+    runner.measure("upload_dataset[cached]", upload, items=rows, repeat=1)
+    dataset_id = info["datasetId"]
+    ranges = thirds(pd.Timestamp(info["dateRange"]["start"]), pd.Timestamp(info["dateRange"]["end"]))
+    runner.ok(client.post("/api/dateranges/validate", json=ranges))
+
+    # stage timings come from the progress callback of the training path, run in this process
+    from app.modeling import prepare_matrix, train_prepared
+    from app.dataset_store import dataset_store
+    from app.training import load_training_frame
+    from app.storage import state
+
+    for algorithm in args.models:
+        stages: Dict[str, float] = {}
+
+        def direct() -> None:
+            marks: List[tuple] = [("load", time.perf_counter())]
+            df, profile, test_mask = load_training_frame(
+                None, "auto", state.get(dataset_store.ranges_path(dataset_id)), csv_path=dataset_store.csv_path(dataset_id)
+            )
+            marks.append(("prepare_features", time.perf_counter()))
+            X, y, is_test, target_col, features = prepare_matrix(df, None, profile, test_mask)
+            train_prepared(
+                X, y, features, target_col, algorithm, 0.2, 42, is_test=is_test,
+                progress=lambda stage: marks.append((stage, time.perf_counter())),
+            )
+            marks.append(("end", time.perf_counter()))
+            for (stage, t0), (_, t1) in zip(marks, marks[1:]):
+                stages[stage] = t1 - t0
+
+        runner.measure(f"train[{algorithm}]", direct, items=rows)
+        for stage, seconds in stages.items():
+            runner.results[f"train[{algorithm}].{stage}"] = {
+                "seconds": round(seconds, 6), "peak_rss_mb": None,
+                "throughput": round(rows / seconds, 2) if seconds > 0 else None,
+            }
+        runner.measure(
+            f"api_train[{algorithm}]",
+            lambda: runner.ok(client.post("/api/train", json={"model": algorithm})).json(),
+            items=rows,
+        )
+
+    # charts: the first request renders, later ones are served from the render cache
+    for path in ("/api/dateranges/summary.png", "/api/training/confusion-matrix.png", "/api/training/roc.png"):
+        name = path.rsplit("/", 1)[-1]
+        runner.measure(f"{name}[cold]", lambda: runner.ok(client.get(path)), repeat=1)
+        runner.measure(f"{name}[warm]", lambda: runner.ok(client.get(path)))
+
+    runner.ok(client.post("/api/simulation/clear"))
+    runner.measure("simulation_start", lambda: runner.ok(client.post("/api/simulation/start")), repeat=1)
+
+    def poll() -> None:
+        for _ in range(SIMULATION_POLLS):
+            runner.ok(client.get("/api/simulation/next"))
+
+    runner.measure("simulation_next", poll, items=SIMULATION_POLLS)
+    runner.ok(client.post("/api/simulation/stop"))
+
+    sample = pd.read_csv(csv_path, nrows=PREDICT_BATCH_ROWS).drop(columns=["target"])
+    one = sample.iloc[0].to_dict()
+    runner.measure("predict[single]", lambda: runner.ok(client.post("/api/predict", json=one)), items=1)
+    body = sample.to_csv(index=False).encode()
+    runner.measure(
+        "predict[batch]",
+        lambda: runner.ok(client.post("/api/predict", content=body, headers={"content-type": "text/csv"})),
+        items=PREDICT_BATCH_ROWS,
+    )
+
+    csv_path.unlink(missing_ok=True)
+    results, runner.results = runner.results, {}
+    return results
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_seconds: float) -> List[str]:
+    """Benchmarks slower than the baseline by more than ``threshold``; very short timings are ignored."""
+    regressions = []
+    for size, benches in current["results"].items():
+        for name, result in benches.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if not before or not before.get("seconds"):
+                continue
+            if max(result["seconds"], before["seconds"]) < min_seconds:
+                continue
+            ratio = result["seconds"] / before["seconds"]
+            if ratio > 1 + threshold:
+                regressions.append(f"{size} {name}: {before['seconds']:.4f}s -> {result['seconds']:.4f}s ({ratio:.2f}x)")
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10k,100k", help="comma-separated row counts, e.g. 10k,100k,1M,10M")
+    parser.add_argument("--features", type=int, default=20, help="numeric sensor columns")
+    parser.add_argument("--models", default="sklearn_logreg", help="comma-separated algorithms for the training benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="repeats per benchmark; the median is recorded")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=ROOT / "benchmarks" / "results" / "latest.json")
+    parser.add_argument("--baseline", type=Path, help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before failing, as a fraction")
+    parser.add_argument("--min-seconds", type=float, default=0.01, help="ignore benchmarks faster than this in both runs")
+    parser.add_argument("--workdir", type=Path, help="scratch directory (default: a temporary one)")
+    args = parser.parse_args(argv)
+    args.models = [m.strip() for m in args.models.split(",") if m.strip()]
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    args.out = args.out.resolve()
+    if args.baseline:
+        args.baseline = args.baseline.resolve()
+
+    scratch = Path(args.workdir or tempfile.mkdtemp(prefix="traning-bench-"))
+    app_dir = scratch / "app_copy"
+    shutil.rmtree(app_dir, ignore_errors=True)
+    shutil.copytree(ROOT / "app", app_dir / "app", ignore=shutil.ignore_patterns("__pycache__"))
+    shutil.copy2(ROOT / "main.py", app_dir / "main.py")
+    (app_dir / "data").mkdir()
+    (app_dir / "models").mkdir()
+    sys.path.insert(0, str(app_dir))
+    os.chdir(app_dir)
+
+    from fastapi.testclient import TestClient
+    import main as service
+    from app import memory
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "features": args.features,
+            "models": args.models,
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+    try:
+        with TestClient(service.app) as client:
+            runner = Runner(client, memory, args.repeat)
+            for rows in sizes:
+                report["results"][size_label(rows)] = bench_size(runner, scratch, rows, args)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(report, indent=2))
+    print(f"results written to {args.out}")
+
+    if args.baseline:
+        regressions = compare(report, json.loads(args.baseline.read_text()), args.threshold, args.min_seconds)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"no regressions over {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,56 @@
+import asyncio
 import io
 import os
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import pandas as pd
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app.schemas import DatasetInfo, TrainRequest, TrainResponse, DateRanges, TournamentRequest, TournamentResponse
+from app.storage import file_stamp, state
+from app.registry import ModelNotFoundError, registry
+from app.ingest import UploadError, save_upload, scan_csv, upload_suffix
+from app.dataset import build_columnar_cache, build_time_index, get_profile, get_time_index, save_profile
+from app.dataset_store import DatasetInUseError, DatasetNotFoundError, dataset_store
+from app.evaluation import Evaluation
+from app.simulation import SimulationError, current_engine, get_engine, simulation_state
+from app.training import TRAINING_METRICS_PATH, current_evaluation, publish_training, run_update
+from app.jobs import JobNotFoundError, training_jobs
+from app.tournament import run_tournament
+from app.modeling import TrainingError
+from app.render_cache import render_cache, render_key
+from app.metrics import StageTimer, metrics
+from app.inference import (
+    PREDICT_COMPILED, InferenceError, compiled_model, feature_matrix, format_predictions, get_batcher, parse_payload,
+    predict_frame, stop_batchers,
+)
+from app.lazy import pyplot
+from app.startup import warmup
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await simulation_state.open()
+    # heavy imports and the current model load in the background; /api/ready reports when done
+    warmup.start()
+    yield
+    await simulation_state.close()
+    stop_batchers()
+    training_jobs.shutdown()
 
-from app.schemas import DatasetInfo, TrainRequest, TrainResponse, TrainMetrics, DateRanges
-from app.storage import DATA_DIR, MODELS_DIR, META_PATH, save_file, save_json, load_json
-from app.modeling import train_model, save_model, TrainingError
 
-app = FastAPI(title="IntelliInspect Training API", version="1.0.0")
+app = FastAPI(title="IntelliInspect Training API", version="1.0.0", lifespan=lifespan)
 
-TRAINING_METRICS_PATH = DATA_DIR / "training_metrics.json"
-TRAINING_RESULTS_PATH = DATA_DIR / "training_results.json"
-SIM_STATE_PATH = DATA_DIR / "simulation_state.json"
+# points on the summary chart's cumulative curve, whatever the row count
+SUMMARY_PLOT_BINS = 1024
+# seconds between checks while another request ingests the same upload
+UPLOAD_WAIT_INTERVAL = 0.5
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,205 +61,249 @@ app.add_middleware(
 )
 
 
-@app.get("/api/health")
-def health():
-    return {"status": "ok"}
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # label by route template so /api/models/{model_id} stays one series
+        route = request.scope.get("route")
+        metrics.observe(
+            "http_request_duration_seconds",
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status),
+        )
 
-# ---------------- Simulation helpers ----------------
 
-def _load_sim_state():
-    st = load_json(SIM_STATE_PATH)
-    if not st:
-        st = {"running": False, "counter": 0}
-    return st
+def resolve_dataset_id(dataset_id: Optional[str] = None) -> str:
+    """The stored dataset a request refers to: ``dataset_id``, or the current one."""
+    try:
+        return dataset_store.resolve(dataset_id)
+    except DatasetNotFoundError:
+        if dataset_id:
+            raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+        raise HTTPException(status_code=400, detail="No dataset uploaded")
 
 
-def _save_sim_state(st):
-    save_json(SIM_STATE_PATH, st)
+def datasets_in_use() -> List[Optional[str]]:
+    """Datasets that must stay: the current model's, so the simulation and model updates
+    keep working, and those of training jobs that have not finished."""
+    jobs = [job for job in training_jobs.list() if job["finished_at"] is None]
+    return [state.get(TRAINING_METRICS_PATH).get("dataset_id"), *(job["request"].get("dataset_id") for job in jobs)]
 
 
-def _random_between(a: float, b: float) -> float:
-    import random
-    return random.random() * (b - a) + a
+@app.get("/api/health")
+def health():
+    return {"status": "ok"}
+
 
+@app.get("/api/ready")
+def ready():
+    """503 until start-up warmup has finished, so load balancers hold traffic until then."""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
-def _determine_prediction(temp: float, pressure: float, humidity: float, confidence: float) -> str:
-    temp_ok = 25 <= temp <= 35
-    pressure_ok = 1010 <= pressure <= 1040
-    humidity_ok = 40 <= humidity <= 70
-    score = sum([temp_ok, pressure_ok, humidity_ok])
-    return 'Pass' if (score >= 2 and confidence >= 75) else 'Fail'
 
+@app.get("/api/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# ---------------- Simulation ----------------
 
 @app.post("/api/simulation/start")
 async def simulation_start():
-    st = _load_sim_state()
-    st["running"] = True
-    _save_sim_state(st)
+    # score the simulation window up front so polling stays cheap
+    try:
+        await run_in_threadpool(get_engine)
+    except SimulationError as se:
+        raise HTTPException(status_code=400, detail=str(se))
+
+    await simulation_state.set_running(True)
     return {"running": True}
 
 
 @app.post("/api/simulation/stop")
 async def simulation_stop():
-    st = _load_sim_state()
-    st["running"] = False
-    _save_sim_state(st)
+    await simulation_state.set_running(False)
     return {"running": False}
 
 
 @app.post("/api/simulation/clear")
 async def simulation_clear():
-    _save_sim_state({"running": False, "counter": 0})
+    await simulation_state.clear()
     return {"cleared": True}
 
 
 @app.get("/api/simulation/next")
 async def simulation_next():
-    from datetime import datetime
-
-    st = _load_sim_state()
-    if not st.get("running", False):
+    counter = await simulation_state.next_id()
+    if counter is None:
         raise HTTPException(status_code=400, detail="Simulation not running")
 
-    st["counter"] = int(st.get("counter", 0)) + 1
-
-    now = datetime.now().strftime("%H:%M:%S")
-    sample_id = f"SAMPLE_{str(st['counter']).zfill(3)}"
-
-    temperature = _random_between(20, 40)
-    pressure = _random_between(1000, 1050)
-    humidity = _random_between(30, 80)
-    confidence = _random_between(70, 98)
+    engine = current_engine()
+    if engine is None:
+        # e.g. after a restart: the running state survived but the engine has to be rebuilt
+        try:
+            engine = await run_in_threadpool(get_engine)
+        except SimulationError as se:
+            raise HTTPException(status_code=400, detail=str(se))
 
-    prediction = _determine_prediction(temperature, pressure, humidity, confidence)
+    sample_id = f"SAMPLE_{str(counter).zfill(3)}"
+    return engine.sample(counter - 1, sample_id)
 
-    data = {
-        "time": now,
-        "sampleId": sample_id,
-        "prediction": prediction,
-        "confidence": round(confidence, 1),
-        "temperature": round(temperature, 1),
-        "pressure": round(pressure),
-        "humidity": round(humidity, 1)
-    }
 
-    _save_sim_state(st)
-    return data
+def ingest_dataset(dataset_id: str, csv_path: Path, digest: str, file_name: str, timer: StageTimer) -> dict:
+    """Scan a claimed dataset's CSV and build its profile, columnar cache, time index and metadata."""
+    timer.mark("scan")
+    try:
+        summary = scan_csv(csv_path)
+    except Exception as e:
+        raise UploadError(f"Failed to parse CSV: {e}")
+    timer.mark("profile")
+    profile = save_profile(summary.profile(), csv_path, sha256=digest)
+    timer.mark("columnar_cache")
+    build_columnar_cache(csv_path, time_column=profile["time_column"], target_column=profile["target_column"])
+    timer.mark("time_index")
+    build_time_index(csv_path)
+
+    timer.mark("metadata")
+    meta = {**summary.metadata(file_name, csv_path.stat().st_size), "datasetId": dataset_id}
+    state.put(dataset_store.metadata_path(dataset_id), meta)
+    return meta
 
 
 @app.post("/api/upload/dataset", response_model=DatasetInfo)
 async def upload_dataset(file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Only CSV files are supported")
-
-    content = await file.read()
-    csv_path = DATA_DIR / "dataset.csv"
-    save_file(csv_path, content)
-
+    suffix = upload_suffix(file.filename)
+    if suffix is None:
+        raise HTTPException(status_code=400, detail="Only CSV (.csv, .csv.gz, .csv.zst) and Parquet files are supported")
+
+    # uploads are decoded to CSV as they stream to disk; the hash is of that CSV
+    timer = StageTimer()
+    timer.mark("receive")
+    tmp_path = dataset_store.upload_path()
     try:
-        df = pd.read_csv(io.BytesIO(content))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to parse CSV: {e}")
-
-    records = int(df.shape[0])
-    features = int(df.shape[1] - 1 if df.shape[1] > 0 else 0)
-
-    # naive pass rate estimate if a plausible target is present
-    pass_rate = 0
-    target_candidates = ["target", "label", "pass", "passed", "is_pass", "y", "class"]
-    for c in target_candidates:
-        if c in df.columns:
-            try:
-                positive = int((df[c] == 1).sum() if df[c].dtype != "object" else (df[c].astype(str).str.lower().isin(["1", "true", "pass"]).sum()))
-                pass_rate = int(round(100 * positive / max(records, 1)))
-            except Exception:
-                pass
-            break
-
-    # date range heuristic: look for first datetime-like column
-    date_start = ""
-    date_end = ""
-    for col in df.columns:
         try:
-            series = pd.to_datetime(df[col], errors="coerce")
-            if series.notna().any():
-                date_start = str(series.min().date())
-                date_end = str(series.max().date())
-                break
-        except Exception:
-            continue
-
-    meta = {
-        "fileName": file.filename,
-        "fileSize": f"{len(content) / (1024*1024):.2f} MB",
-        "records": records,
-        "features": features,
-        "passRate": pass_rate,
-        "dateRange": {"start": date_start or "", "end": date_end or ""},
-    }
-
-    save_json(META_PATH, meta)
+            _, digest = await save_upload(file, tmp_path, suffix)
+        except UploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        timer.mark("lookup")
+        dataset_id, status = await run_in_threadpool(dataset_store.claim, digest, file.filename)
+        while status == "busy":
+            # another request is ingesting the same bytes; wait for its result
+            await asyncio.sleep(UPLOAD_WAIT_INTERVAL)
+            dataset_id, status = await run_in_threadpool(dataset_store.claim, digest, file.filename)
+        csv_path = dataset_store.csv_path(dataset_id)
+        if status == "claimed":
+            os.replace(tmp_path, csv_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    if status == "ready":
+        # identical content was ingested before: its metadata is already stored
+        timer.observe("upload_stage_duration_seconds")
+        return {**await run_in_threadpool(state.get, dataset_store.metadata_path(dataset_id)), "datasetId": dataset_id}
+
+    try:
+        meta = await run_in_threadpool(ingest_dataset, dataset_id, csv_path, digest, file.filename, timer)
+    except UploadError as e:
+        await run_in_threadpool(dataset_store.abandon, dataset_id)
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        await run_in_threadpool(dataset_store.abandon, dataset_id)
+        raise
+    keep = await run_in_threadpool(datasets_in_use)
+    await run_in_threadpool(dataset_store.commit, dataset_id, keep)
+    timer.observe("upload_stage_duration_seconds")
     return meta
 
 
 @app.get("/api/upload/metadata", response_model=DatasetInfo)
-async def get_metadata():
-    meta = load_json(META_PATH)
+def get_metadata(dataset_id: Optional[str] = None):
+    try:
+        dataset_id = dataset_store.resolve(dataset_id)
+    except DatasetNotFoundError:
+        raise HTTPException(status_code=404, detail="No dataset metadata found")
+    meta = state.get(dataset_store.metadata_path(dataset_id))
     if not meta:
         raise HTTPException(status_code=404, detail="No dataset metadata found")
-    return meta
+    return {**meta, "datasetId": dataset_id}
+
+
+@app.get("/api/datasets")
+def list_datasets():
+    return {"datasets": dataset_store.list()}
+
+
+@app.get("/api/datasets/{dataset_id}")
+def get_dataset(dataset_id: str):
+    try:
+        entry = dataset_store.get(dataset_id)
+    except DatasetNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+    return {**entry, "metadata": state.get(dataset_store.metadata_path(dataset_id)) or None}
+
+
+@app.delete("/api/datasets/{dataset_id}")
+def delete_dataset(dataset_id: str):
+    try:
+        entry = dataset_store.delete(dataset_id, keep=datasets_in_use())
+    except DatasetNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+    except DatasetInUseError:
+        raise HTTPException(status_code=409, detail=f"Dataset is used by the current model or a training job: {dataset_id}")
+    return {"deleted": entry["dataset_id"]}
 
 
 @app.post("/api/dateranges/validate", response_model=DateRanges)
-async def validate_date_ranges(ranges: DateRanges):
-    save_json(DATA_DIR / "date_ranges.json", ranges.model_dump())
+def validate_date_ranges(ranges: DateRanges, dataset_id: Optional[str] = None):
+    state.put(dataset_store.ranges_path(resolve_dataset_id(dataset_id)), ranges.model_dump())
     return ranges
 
 
 @app.get("/api/dateranges/summary.png")
-async def dateranges_summary_png():
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
+async def dateranges_summary_png(request: Request, dataset_id: Optional[str] = None):
+    dataset_id = await run_in_threadpool(resolve_dataset_id, dataset_id)
+    csv_path = dataset_store.csv_path(dataset_id)
 
-    csv_path = DATA_DIR / "dataset.csv"
-    if not csv_path.exists():
-        raise HTTPException(status_code=400, detail="No dataset uploaded")
-
-    ranges_path = DATA_DIR / "date_ranges.json"
-    if not ranges_path.exists():
+    ranges = await run_in_threadpool(state.get, dataset_store.ranges_path(dataset_id))
+    if not ranges:
         raise HTTPException(status_code=400, detail="No date ranges configured")
 
+    key = render_key("summary", str(csv_path), file_stamp(csv_path), ranges, {"figsize": (6, 3), "dpi": 150})
+    cached = render_cache.lookup(request, key)
+    if cached is not None:
+        return cached
+    timer = StageTimer()
+    timer.mark("load")
+
+    plt = pyplot()
+
+    # the sorted time index gives the cumulative curve without loading any rows
     try:
-        df = pd.read_csv(csv_path)
+        profile = get_profile(csv_path)
+        index = get_time_index(csv_path)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to read dataset: {e}")
 
-    # Try to find a datetime column for plotting counts per period
-    time_col = None
-    for col in df.columns:
-        s = pd.to_datetime(df[col], errors='coerce')
-        if s.notna().any():
-            df[col] = s
-            time_col = col
-            break
-
-    if time_col is None:
-        # If no datetime column, create an index-based pseudo time
-        df['_idx'] = range(len(df))
-        time_col = '_idx'
-
-    ranges = load_json(ranges_path)
-
+    timer.mark("render")
     fig, ax = plt.subplots(figsize=(6, 3))
     ax.set_title('Selected Date Ranges Summary')
 
     # Plot total distribution (hist counts over time)
-    if time_col == '_idx':
-        ax.plot(df[time_col], [1] * len(df), alpha=0.3, label='All samples')
+    if index is None:
+        # If no datetime column, use an index-based pseudo time; the flat line needs only its ends
+        n = int(profile.get("records", 0))
+        ax.plot([0, max(n - 1, 0)] if n else [], [1, 1] if n else [], alpha=0.3, label='All samples')
     else:
-        df_sorted = df.sort_values(by=time_col)
-        ax.plot(df_sorted[time_col], range(1, len(df_sorted) + 1), alpha=0.3, label='Cumulative count')
+        edges, counts = index.cumulative(SUMMARY_PLOT_BINS)
+        ax.plot(edges, counts, alpha=0.3, label='Cumulative count')
 
     # Shade training/testing/simulation windows if dates available
     def shade(period_key, color, label):
@@ -242,132 +320,184 @@ async def dateranges_summary_png():
     ax.grid(True, alpha=0.2)
     fig.autofmt_xdate()
 
+    timer.mark("encode")
     buf = io.BytesIO()
     plt.tight_layout()
     fig.savefig(buf, format='png', dpi=150)
     plt.close(fig)
     buf.seek(0)
+    timer.observe("plot_stage_duration_seconds", plot="summary")
 
-    return Response(content=buf.getvalue(), media_type='image/png')
+    return render_cache.store(key, buf.getvalue())
 
 
 @app.post("/api/train", response_model=TrainResponse)
 async def train(req: TrainRequest):
-    csv_path = DATA_DIR / "dataset.csv"
-    if not csv_path.exists():
-        raise HTTPException(status_code=400, detail="No dataset uploaded")
-
+    # pin the dataset now, so a later upload does not change what this run trains on
+    req = req.model_copy(update={"dataset_id": await run_in_threadpool(resolve_dataset_id, req.dataset_id)})
+
+    # the fit runs in the training pool; this only waits for it
+    job = await training_jobs.wait((await run_in_threadpool(training_jobs.submit, req))["job_id"])
+    if job["status"] == "done":
+        return job["result"]
+    if job["status"] == "cancelled":
+        raise HTTPException(status_code=409, detail="Training cancelled")
+    error = job["error"] or {}
+    if error.get("type") == "TrainingError":
+        raise HTTPException(status_code=400, detail=error.get("message"))
+    raise HTTPException(status_code=500, detail=f"Training failed: {error.get('message')}")
+
+
+@app.post("/api/train/tournament", response_model=TournamentResponse)
+async def train_tournament(req: TournamentRequest):
+    req = req.model_copy(update={"dataset_id": await run_in_threadpool(resolve_dataset_id, req.dataset_id)})
     try:
-        df = pd.read_csv(csv_path)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to read dataset: {e}")
+        return await run_in_threadpool(run_tournament, req)
+    except TrainingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
+@app.post("/api/train/jobs")
+def submit_training_job(req: TrainRequest):
+    return training_jobs.submit(req.model_copy(update={"dataset_id": resolve_dataset_id(req.dataset_id)}))
+
+
+@app.get("/api/train/jobs")
+def list_training_jobs():
+    return {"jobs": training_jobs.list()}
+
+
+@app.get("/api/train/jobs/{job_id}")
+def get_training_job(job_id: str):
     try:
-        model, metrics, features, target_col, y_true, y_pred, y_score = train_model(
-            df=df,
-            algorithm=req.model,
-            target=req.target,
-            test_size=req.test_size,
-            random_state=req.random_state,
-        )
-    except TrainingError as te:
-        raise HTTPException(status_code=400, detail=str(te))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Training failed: {e}")
+        return training_jobs.get(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
 
-    # Derive human-readable period summaries from saved date ranges if present
-    ranges = load_json(DATA_DIR / "date_ranges.json")
-    def fmt_period(period_key: str) -> str:
-        try:
-            p = ranges.get(period_key)
-            if not p:
-                return "N/A"
-            start = p.get("start") or ""
-            end = p.get("end") or ""
-            days = p.get("days")
-            if start and end and days:
-                return f"{start} to {end} ({days} days)"
-            if start and end:
-                return f"{start} to {end}"
-            return "N/A"
-        except Exception:
-            return "N/A"
-
-    training_period = fmt_period("training")
-    validation_period = fmt_period("testing")
-    simulation_period = fmt_period("simulation")
-
-    model_id = f"{req.model}"
-    model_path = MODELS_DIR / f"{model_id}.joblib"
-    save_model(model, str(model_path))
-
-    resp = TrainResponse(
-        model_id=model_id,
-        algorithm=req.model,
-        metrics=TrainMetrics(
-            accuracy=metrics["accuracy"],
-            precision=metrics["precision"],
-            recall=metrics["recall"],
-            f1Score=metrics["f1Score"],
-            trainingData=training_period,
-            validationData=validation_period,
-            simulationData=simulation_period,
-        ),
-        features=features,
-        target=target_col,
-    )
-
-    # persist last training response for verification
-    save_json(TRAINING_METRICS_PATH, {
-        "model_id": resp.model_id,
-        "algorithm": resp.algorithm,
-        "metrics": resp.metrics.model_dump(),
-        "features": resp.features,
-        "target": resp.target
-    })
-
-    # persist test predictions for plots
-    save_json(TRAINING_RESULTS_PATH, {
-        "y_true": y_true,
-        "y_pred": y_pred,
-        "y_score": y_score
-    })
 
-    return resp
+@app.post("/api/train/jobs/{job_id}/cancel")
+def cancel_training_job(job_id: str):
+    try:
+        return training_jobs.cancel(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
 
 
 @app.get("/api/training/metrics")
-async def get_training_metrics():
-    data = load_json(TRAINING_METRICS_PATH)
+def get_training_metrics():
+    data = state.get(TRAINING_METRICS_PATH)
     if not data:
         raise HTTPException(status_code=404, detail="No training metrics available")
     return data
 
 
 @app.get("/api/training/status")
-async def get_training_status():
-    models = [p.name for p in MODELS_DIR.glob("*.joblib")]
+def get_training_status():
+    entries = registry.list()
+    models = [e["path"] for e in entries]
     exists = len(models) > 0
-    return {"hasModel": exists, "models": models}
+    return {"hasModel": exists, "models": models, "latest": entries[0]["model_id"] if exists else None}
 
 
-@app.get("/api/training/confusion-matrix.png")
-async def training_confusion_matrix_png():
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    import numpy as np  # type: ignore
-    from sklearn.metrics import confusion_matrix
+@app.get("/api/models")
+def list_models():
+    return {"models": registry.list(), "cached": registry.cached_ids()}
+
+
+@app.get("/api/models/{model_id}")
+def get_model(model_id: str):
+    try:
+        return registry.get(model_id)
+    except ModelNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Model not found: {model_id}")
+
+
+@app.delete("/api/models/{model_id}")
+def delete_model(model_id: str):
+    try:
+        entry = registry.delete(model_id)
+    except ModelNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Model not found: {model_id}")
+    return {"deleted": entry["model_id"]}
+
+
+@app.post("/api/models/{model_id}/update", response_model=TrainResponse)
+async def update_registered_model(model_id: str, request: Request):
+    try:
+        df, _ = parse_payload(await request.body(), request.headers.get("content-type", ""))
+        entry, resp = await run_in_threadpool(run_update, model_id, df)
+    except ModelNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Model not found: {model_id}")
+    except (InferenceError, TrainingError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await run_in_threadpool(publish_training, entry, resp)
+    return resp
+
+
+def predictor(model_id: Optional[str]) -> Tuple[str, Optional[List[str]], Optional[object], Optional[object]]:
+    """The model a prediction request refers to: its id, features, compiled scorer and,
+    without a scorer, the loaded model. Reads the state store, so it runs off the event loop."""
+    training = state.get(TRAINING_METRICS_PATH)
+    model_id = model_id or training.get("model_id")
+    if not model_id:
+        raise HTTPException(status_code=404, detail="No trained model available")
+    try:
+        entry = registry.get(model_id)
+        scorer = registry.load_scorer(model_id) if PREDICT_COMPILED else None
+        model = registry.load(model_id) if scorer is None else None
+    except ModelNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Model not found: {model_id}")
+
+    features = entry.get("features")
+    if not features and training.get("model_id") == model_id:
+        features = training.get("features")
+    return model_id, features, scorer, model
+
+
+@app.post("/api/predict")
+async def predict(request: Request, model_id: Optional[str] = None):
+    model_id, features, scorer, model = await run_in_threadpool(predictor, model_id)
+    if scorer is not None:
+        model = compiled_model(model_id, scorer, lambda: registry.load(model_id))
+    try:
+        df, single = parse_payload(await request.body(), request.headers.get("content-type", ""))
+        X = feature_matrix(df, features or [])
+    except InferenceError as ie:
+        raise HTTPException(status_code=400, detail=str(ie))
+
+    if single:
+        # single records are coalesced with concurrent requests into one batch
+        label, proba = await get_batcher(model_id, model, features).submit(X)
+        classes = getattr(model, "classes_", None)
+        return {
+            "model_id": model_id,
+            "classes": classes.tolist() if classes is not None else None,
+            "label": label,
+            "probabilities": proba,
+        }
+
+    labels, proba = await run_in_threadpool(predict_frame, model, X)
+    return {"model_id": model_id, **format_predictions(model, labels, proba)}
 
-    data = load_json(TRAINING_RESULTS_PATH)
-    if not data or "y_true" not in data or "y_pred" not in data:
+
+@app.get("/api/training/confusion-matrix.png")
+async def training_confusion_matrix_png(request: Request):
+    timer = StageTimer()
+    timer.mark("load")
+    version, evaluation = await run_in_threadpool(current_evaluation)
+    if evaluation is None:
         raise HTTPException(status_code=404, detail="No training results available")
+    key = render_key("confusion-matrix", version, {"figsize": (3.5, 3), "dpi": 150})
+    cached = render_cache.lookup(request, key)
+    if cached is not None:
+        return cached
 
-    y_true = np.array(data["y_true"])  # type: ignore
-    y_pred = np.array(data["y_pred"])  # type: ignore
+    plt = pyplot()
+    import numpy as np  # type: ignore
 
-    cm = confusion_matrix(y_true, y_pred)
+    cm = np.asarray(evaluation["confusion"])
 
+    timer.mark("render")
     fig, ax = plt.subplots(figsize=(3.5, 3))
     im = ax.imshow(cm, cmap='Blues')
     ax.set_title('Confusion Matrix')
@@ -377,32 +507,35 @@ async def training_confusion_matrix_png():
         ax.text(j, i, int(val), ha='center', va='center', color='black')
     plt.colorbar(im, ax=ax, fraction=0.046, pad=0.04)
 
+    timer.mark("encode")
     buf = io.BytesIO()
     plt.tight_layout()
     fig.savefig(buf, format='png', dpi=150)
     plt.close(fig)
     buf.seek(0)
-    return Response(content=buf.getvalue(), media_type='image/png')
+    timer.observe("plot_stage_duration_seconds", plot="confusion-matrix")
+    return render_cache.store(key, buf.getvalue())
 
 
 @app.get("/api/training/roc.png")
-async def training_roc_png():
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    import numpy as np  # type: ignore
-    from sklearn.metrics import roc_curve, auc
-
-    data = load_json(TRAINING_RESULTS_PATH)
-    if not data or data.get("y_score") is None:
+async def training_roc_png(request: Request):
+    timer = StageTimer()
+    timer.mark("load")
+    version, evaluation = await run_in_threadpool(current_evaluation)
+    if evaluation is None or "scores" not in evaluation:
         raise HTTPException(status_code=404, detail="No probability scores available for ROC")
+    key = render_key("roc", version, {"figsize": (3.5, 3), "dpi": 150})
+    cached = render_cache.lookup(request, key)
+    if cached is not None:
+        return cached
 
-    y_true = np.array(data["y_true"])  # type: ignore
-    y_score = np.array(data["y_score"])  # type: ignore
+    plt = pyplot()
 
-    fpr, tpr, _ = roc_curve(y_true, y_score)
-    roc_auc = auc(fpr, tpr)
+    curves = Evaluation.from_bundle(evaluation).curves()
+    fpr, tpr = curves["fpr"], curves["tpr"]
+    roc_auc = evaluation["metrics"].get("rocAuc") or 0.0
 
+    timer.mark("render")
     fig, ax = plt.subplots(figsize=(3.5, 3))
     ax.plot(fpr, tpr, label=f'ROC AUC = {roc_auc:.2f}')
     ax.plot([0, 1], [0, 1], 'k--', alpha=0.3)
@@ -413,12 +546,14 @@ async def training_roc_png():
     ax.set_title('ROC Curve')
     ax.legend(loc='lower right')
 
+    timer.mark("encode")
     buf = io.BytesIO()
     plt.tight_layout()
     fig.savefig(buf, format='png', dpi=150)
     plt.close(fig)
     buf.seek(0)
-    return Response(content=buf.getvalue(), media_type='image/png')
+    timer.observe("plot_stage_duration_seconds", plot="roc")
+    return render_cache.store(key, buf.getvalue())
 
 
 # Entrypoint for uvicorn